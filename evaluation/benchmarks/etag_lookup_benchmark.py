@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Benchmarks the construction of the reverse ETag lookup (tag -> metadata
+entry indices) of `IndexBuilder.build_metadata_index` on synthetic metadata.
+
+    old: for every distinct tag, scan every metadata entry  O(tags x posts)
+    new: single pass over the metadata entries              O(posts x ETags)
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '../../src'))
+from wordvec_models.metadata_store import MetadataStore
+
+
+def synthetic_metadata(num_posts, num_tags, tags_per_post, seed=0):
+    """Metadata entries with Zipf distributed ETags."""
+    rng = np.random.RandomState(seed)
+    metadata = []
+    for ii in range(num_posts):
+        tag_ids = set(rng.zipf(1.3, tags_per_post) % num_tags)
+        metadata.append({
+            'PostId': ii,
+            'Score': 0,
+            'Title': 'post {}'.format(ii),
+            'ETags': ['tag{}'.format(t) for t in tag_ids],
+            'SnippetCount': 0,
+            'Snippets': []
+        })
+    return metadata
+
+
+def old_etag_lookup(metadata):
+    etags_list = [tag for entry in metadata for tag in entry['ETags']]
+    etag_lookup = {}
+    for etag in set(etags_list):
+        etag_lookup[etag] = []
+        for ii, entry in enumerate(metadata):
+            if etag in entry['ETags']:
+                etag_lookup[etag].append(ii)
+    return etag_lookup
+
+
+def new_etag_lookup(metadata):
+    tag_index = MetadataStore.from_records(metadata).tag_index
+    return {
+        tag: tag_index.postings(tag).tolist()
+        for tag in tag_index.tags
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Reverse ETag lookup construction benchmark.')
+    parser.add_argument('-p',
+                        '--posts',
+                        type=int,
+                        nargs='+',
+                        default=[1000, 5000, 20000],
+                        help='Numbers of metadata entries. (default: %(default)s)')
+    parser.add_argument('-t',
+                        '--tags',
+                        type=int,
+                        default=5000,
+                        help='Tag vocabulary size. (default: %(default)s)')
+    parser.add_argument('-e',
+                        '--etags',
+                        type=int,
+                        default=8,
+                        help='ETags drawn per post. (default: %(default)s)')
+    args = parser.parse_args()
+
+    print('{:>8s} {:>8s} {:>10s} {:>10s}'.format('posts', 'tags', 'old (s)',
+                                                 'new (s)'))
+    for num_posts in args.posts:
+        metadata = synthetic_metadata(num_posts, args.tags, args.etags)
+        start = time.time()
+        old = old_etag_lookup(metadata)
+        old_time = time.time() - start
+        start = time.time()
+        new = new_etag_lookup(metadata)
+        new_time = time.time() - start
+        assert old == new
+        print('{:8d} {:8d} {:10.3f} {:10.3f}'.format(num_posts, len(new),
+                                                     old_time, new_time))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Benchmarks the search query normalization: the reference double tokenizer
+pass against the memoized QueryNormalizer, on the evaluation queries (or the
+lines of a query file). Both outputs are checked for equality.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '../../src'))
+from text_processing.tokenizer import QueryNormalizer, get_custom_tokenizer
+
+# evaluation queries (see evaluation/README.md)
+QUERIES = [
+    'How to read a comma separated file?', 'How to read a CSV file?',
+    'How to read a delimited file?', 'How to read input from console?',
+    'How to read input from terminal?',
+    'How to read input from command prompt?', 'How to play an mp3 file?',
+    'How to play an audio file?', 'How to compare dates?',
+    'How to compare time stamps?', 'How to dynamically load a class?',
+    'How to load a jar/class at runtime?',
+    'How to calculate checksums for files?',
+    'How to calculate MD5 checksums for files?',
+    'How to iterate through a hashmap?', 'How to loop over a hashmap?',
+    'How to split a string?', 'How to handle an exception?'
+]
+
+
+def time_fn(fn, queries, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        for query in queries:
+            fn(query)
+    return 1000 * (time.time() - start) / (repeat * len(queries))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Query normalization latency benchmark.')
+    parser.add_argument('-q',
+                        '--queries',
+                        default=None,
+                        help='Query file, one query per line. '
+                        '(default: the evaluation queries)')
+    parser.add_argument('-r',
+                        '--repeat',
+                        type=int,
+                        default=100,
+                        help='Passes over the queries. (default: %(default)s)')
+    args = parser.parse_args()
+
+    queries = QUERIES
+    if args.queries:
+        with open(args.queries, 'r') as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    nlp = get_custom_tokenizer()
+    normalizer = QueryNormalizer(nlp)
+    mismatches = [q for q in queries if normalizer(q) != normalizer.reference(q)]
+    print('equivalent outputs: {}/{}'.format(
+        len(queries) - len(mismatches), len(queries)))
+
+    def pipeline_reference(query):
+        # the previous BaseSearchModel._normalize_query (full nlp pipeline)
+        doc = nlp(query.strip())
+        norm_query = ' '.join(t.norm_ for t in doc
+                              if not (t.is_punct or t.is_bracket or t.is_quote
+                                      or t._.is_symbol or t.like_num))
+        return ' '.join(t.norm_ for t in nlp(norm_query))
+
+    cold = QueryNormalizer(nlp)
+    print('pipeline double pass:   {:.3f} ms/query'.format(
+        time_fn(pipeline_reference, queries, args.repeat)))
+    print('tokenizer double pass:  {:.3f} ms/query'.format(
+        time_fn(normalizer.reference, queries, args.repeat)))
+    print('QueryNormalizer (cold): {:.3f} ms/query'.format(
+        time_fn(cold, queries, 1)))
+    print('QueryNormalizer (warm): {:.3f} ms/query'.format(
+        time_fn(normalizer, queries, args.repeat)))
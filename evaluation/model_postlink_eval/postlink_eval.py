@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import os
+import sys
 import glob
 import json
 import time
@@ -12,6 +13,10 @@ import pandas as pd
 from collections import OrderedDict
 from sklearn.metrics.pairwise import cosine_similarity
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '../../src'))
+from wordvec_models.index_store import load_index_store
+
 ## Params
 min_postlinks_per_id = 2 
 min_snippets_per_id = 1
@@ -30,11 +35,14 @@ temp_dir = 'temp_files'
 
 # Index
 ft_version = 'v0.6.1'
-fasttext_index_path = '../../src/wordvec_models/index/ft_' + ft_version + '_post_index.pkl'
+fasttext_index_path = '../../src/wordvec_models/index/ft_' + ft_version + '_post_index'
 tfidf_version = 'v0.3'
-tfidf_index_path = '../../src/wordvec_models/index/tfidf_' + tfidf_version + '_post_index.pkl'
+tfidf_index_path = '../../src/wordvec_models/index/tfidf_' + tfidf_version + '_post_index'
 glove_version = 'v0.1.1'
-glove_index_path = '../../src/wordvec_models/index/glove_' + glove_version + '_post_index.pkl'
+glove_index_path = '../../src/wordvec_models/index/glove_' + glove_version + '_post_index'
+
+# Index keys
+index_keys = ['TitleV', 'BodyV']
 
 # Metadata
 metadata_path = '../../src/wordvec_models/index/metadata.json'
@@ -536,20 +544,16 @@ def postlink_eval(index_path, metadata_path, export_dir):
         return postlink_percentage_alg_1(searches, lookup)
 
     
-    with open(fasttext_index_path, 'rb') as _in:
-        ft_index = pickle.load(_in)
+    ft_index = load_index_store(fasttext_index_path, index_keys)
 
     postlink_percentage_alg_2(ft_index['TitleV'], ft_index['BodyV'], t=0.92)
     
-    with open(tfidf_index_path, 'rb') as _in:
-        tfidf_index = pickle.load(_in)    
+    tfidf_index = load_index_store(tfidf_index_path, index_keys)
 
     postlink_percentage_alg_2(tfidf_index['TitleV'], tfidf_index['BodyV'], t=0.75)
     
     
-    with open(tfidf_index_path, 'rb') as _in:
-        tfidf_index = pickle.load(_in)
-        #del tfidf_index['TagV']
+    tfidf_index = load_index_store(tfidf_index_path, index_keys)
     
     
     calc_batch_sims(
@@ -562,9 +566,7 @@ def postlink_eval(index_path, metadata_path, export_dir):
         version=tfidf_version)
     
     
-    with open(fasttext_index_path, 'rb') as _in:
-        ft_index = pickle.load(_in)
-        #del ft_index['TagsV']  
+    ft_index = load_index_store(fasttext_index_path, index_keys)
     
     calc_batch_sims(
         ft_index['TitleV'],
@@ -584,9 +586,8 @@ def postlink_eval(index_path, metadata_path, export_dir):
         version=ft_version)
     
     '''
-    with open(glove_index_path, 'rb') as _in:
-        glove_index = pickle.load(_in)
-        
+    glove_index = load_index_store(glove_index_path, index_keys)
+    
     calc_batch_sims(
         glove_index['TitleV'],
         glove_index['BodyV'],
@@ -70,11 +70,12 @@ def json_results(model, num_res):
         else:
             tags = list(filter(bool, tags.split()))
 
-        mt_df, top_tags = model.search(query=query,
-                                       tags=tags,
-                                       num_results=num_res)
+        results, top_tags = model.search(query=query,
+                                         tags=tags,
+                                         num_results=num_res,
+                                         as_frame=False)
         print(top_tags)
-        print(json.dumps(mt_df.to_json(orient='index'), indent=2))
+        print(json.dumps([r.to_dict() for r in results], indent=2))
 
 
 ## Demo Functions
@@ -96,7 +97,10 @@ def hybrid_demo(args):
                       tfidf_model_path=get_abs_path(args.tfidf_model_path),
                       tfidf_index_path=get_abs_path(args.tfidf_index_path),
                       index_keys=index_keys,
-                      metadata_path=get_abs_path(args.metadata_path))
+                      metadata_path=get_abs_path(args.metadata_path),
+                      rerank=args.rerank is not None,
+                      candidate_pool=args.rerank or 200,
+                      candidate_generator=args.candidates)
 
     if args.cli:
         hy.cli_search(num_results=args.num_res)
@@ -209,6 +213,18 @@ if __name__ == '__main__':
                                action='store_true',
                                default=False,
                                help='CLI interface. (alt. JSON results)')
+    hybrid_parser.add_argument(
+        '-r',
+        '--rerank',
+        type=int,
+        metavar='POOL',
+        default=None,
+        help='Rerank mode, score only a pool of POOL candidate posts.')
+    hybrid_parser.add_argument(
+        '--candidates',
+        choices=['sparse', 'ann'],
+        default='sparse',
+        help='Candidate generator used in rerank mode. (default: sparse)')
 
     args = parser.parse_args()
     print(args)
@@ -3,10 +3,10 @@
 import os
 import sys
 import json
-import pickle
 import pprint
 import sqlite3
 import argparse
+from functools import partial
 
 import numpy as np
 import pandas as pd
@@ -20,14 +20,24 @@ from wordvec_models.tfidf_model import load_tfidf_model
 import wordvec_models.glove_model
 from wordvec_models.glove_model import build_doc_vectors as build_glove_vecs
 from wordvec_models.glove_model import GloVeModel, load_glove_model
+from wordvec_models.metadata_store import MetadataStore
+from wordvec_models.field_index import build_field_index
+from wordvec_models.ann_index import IVFIndex, ann_index_path, recall_report
+from wordvec_models.index_store import is_index_store, save_index_store
+from wordvec_models.segments import METADATA_DIR, compact_segments
+from wordvec_models.segments import discard_compaction, segment_snapshot
+from wordvec_models.segments import new_segment_path, write_segment_manifest
 
 QID_QUERY = "SELECT Id FROM questions WHERE {} ORDER BY Id"
+# number of index titles used as queries for the ANN recall report
+ANN_REPORT_QUERIES = 200
 METADATA_QUERY = "SELECT {} FROM questions WHERE Id IN {{id_list}} ORDER BY Id"
 
 
 class IndexBuilder:
     def __init__(self, qdataframe_path, database_path, fasttext_path,
-                 tfidf_path, glove_path, temp_dir, export_dir):
+                 tfidf_path, glove_path, temp_dir, export_dir,
+                 num_workers=1):
         ## File/Model Paths
         self.qdataframe_path = qdataframe_path
         self.database_path = database_path
@@ -44,6 +54,9 @@ class IndexBuilder:
         if not os.path.exists(self.export_dir):
             os.makedirs(self.export_dir)
 
+        ## Doc vector building processes
+        self.num_workers = num_workers
+
     def _load_text_list(self, filename):
         text_list = []
         with open(filename, 'r') as f:
@@ -64,18 +77,49 @@ class IndexBuilder:
         return qids
 
     def _build_index_dataset(self, qids, keys=['Title', 'Body']):
-        index_ids = []
-        index_dataset = {key: [] for key in keys}
+        """Selects the given columns of the index questions (in question
+        dataframe order) with a vectorized Id lookup.
+
+        The question dataframe is a pickle, which cannot be read partially:
+        it is loaded in full (every question and column) and dropped once the
+        index rows and columns are copied out, so the peak memory of this
+        step is the size of the whole question dataframe. Incremental updates
+        (see `update_index`) load it in full as well.
+        """
         qdf = pd.read_pickle(self.qdataframe_path)
-        for index, row in qdf.iterrows():
-            if index in qids:
-                index_ids.append(index)
-                for key in keys:
-                    index_dataset[key].append(row[key])
-        print('Index contains {} questions.'.format(len(index_ids)))
-        return index_ids, index_dataset
+        index_dataset = qdf.loc[qdf.index.isin(qids), keys]
+        qdf = None
+        print('Index contains {} questions.'.format(len(index_dataset)))
+        return index_dataset
+
+    def _process_index_dataset(self, index_dataset, temp_dir):
+        """Dumps the question bodies & titles of the index dataset to disk,
+        processes each corpus and replaces the dataset columns with the
+        processed texts.
+
+        The corpus processing (stack trace filter & normalization scripts,
+        tokenizer) works on files, so each corpus makes a round trip through
+        `temp_dir` and its processed texts are read back in memory (one
+        column at a time) to replace the raw column.
+        """
+        print('Processing body & title corpora...')
+        for key, filter_corpus in (('Body', True), ('Title', False)):
+            corpus = os.path.join(temp_dir, key.lower() + '_corpus')
+            final_corpus = os.path.join(temp_dir,
+                                        'final_' + key.lower() + '_corpus')
+            self._dump_text_list(corpus, index_dataset[key])
+            process_corpus(corpus, final_corpus, filter_corpus, 'norm')
+
+            # Tags are not processed until the search index building process
+            texts = self._load_text_list(final_corpus)
+            # Sanity check after text processing
+            if len(texts) != len(index_dataset):
+                raise Exception('Length mismatch on Id & {} lists.'.format(key))
+            index_dataset[key] = texts
 
-    def build_metadata_index(self, qids, query):
+    def _fetch_metadata(self, qids, query):
+        """Fetches the metadata records (see `MetadataStore.from_records`) of
+        the given questions from the database."""
         def split_snippets(snippet_str):
             if snippet_str == '':
                 return []
@@ -92,16 +136,15 @@ class IndexBuilder:
             print()
 
         metadata = []
-        etags_list = []
         db_conn = sqlite3.connect(self.database_path)
         c = db_conn.cursor()
-        c.execute(query.format(id_list=str(tuple(qids))))
+        id_list = '({})'.format(', '.join(str(int(qid)) for qid in qids))
+        c.execute(query.format(id_list=id_list))
         max_items = len(qids)
         for _, row in progress(c, max_items):
             ents = row[4].split('<_ent_>')
             etags = set(row[3][1:-1].replace('><', ' ').split() + ents)
             etags = list(filter(bool, etags))
-            etags_list.extend(etags)
             str_out = {
                 'PostId': row[0],
                 'Score': row[1],
@@ -111,33 +154,61 @@ class IndexBuilder:
                 'Snippets': split_snippets(row[6])
             }
             metadata.append(str_out)
+        return metadata
 
+    def build_metadata_index(self, qids, query):
+        metadata = self._fetch_metadata(qids, query)
         with open(os.path.join(self.export_dir, 'metadata.json'), 'w') as out:
             json.dump(metadata, out, indent=2)
 
-        # Reverse etags lookup
-        print('Building reverse ETags lookup (ETags: [Tags, Entities])...')
-        etag_lookup = {}
-        etags_list = list(set(etags_list))
-        max_items = len(etags_list)
-        for _, etag in progress(etags_list, max_items):
-            # etag: indices of metadata entries
-            metadata_entry_indices = []
-            for ii, entry in enumerate(metadata):
-                if etag in entry['ETags']:
-                    metadata_entry_indices.append(ii)
-            etag_lookup[etag] = metadata_entry_indices
-
+        # Columnar metadata store (incl. the inverted ETag index) used by
+        # the search models. The reverse ETag lookup (ETags: [Tags, Entities])
+        # is built in a single pass over the metadata.
+        print('Building metadata store & reverse ETags lookup...')
+        store = MetadataStore.from_records(metadata)
+        store_path = os.path.join(self.export_dir, 'metadata')
+        store.save(store_path)
+        # the rebuilt base replaces any compacted base (see segments.py)
+        discard_compaction(self.export_dir)
+
+        tag_index = store.tag_index
+        etag_lookup = {
+            tag: tag_index.postings(tag).tolist()
+            for tag in tag_index.tags
+        }
         with open(os.path.join(self.export_dir, 'etags.json'), 'w') as out:
             json.dump(etag_lookup, out, indent=2)
-
-        # Extended metadata filepath
-        filepath = os.path.join(self.export_dir, 'extended_metadata.pkl')
-        with open(filepath, 'wb') as out:
-            ext_metadata = {'etag_lookup': etag_lookup, 'metadata': metadata}
-            pickle.dump(ext_metadata, out)
-
-    def build_search_index(self, index_dataset, model, keys=['Title', 'Body']):
+        print('metadata store saved in', os.path.realpath(store_path))
+
+    def build_ann_index(self, index_path, field_index):
+        """Builds the IVF (approximate nearest neighbour) index of a dense
+        search index next to it, and reports its recall@10 against the exact
+        scorer using a sample of the index titles as queries."""
+        field_index.ann = IVFIndex.build(field_index)
+        ann_path = ann_index_path(index_path)
+        field_index.ann.save(ann_path)
+        print('ANN index saved in', os.path.realpath(ann_path))
+
+        query_key = field_index.keys()[0]
+        if 'TitleV' in field_index:
+            query_key = 'TitleV'
+        query_vecs = field_index[query_key]
+        sample = np.random.RandomState(0).choice(
+            len(query_vecs), min(ANN_REPORT_QUERIES, len(query_vecs)),
+            replace=False)
+        report = recall_report(field_index, query_vecs[sample])
+        pprint.pprint(report)
+        with open(ann_path[:-4] + '_report.json', 'w') as out:
+            json.dump(report, out, indent=2)
+
+    def _build_search_dict(self, index_dataset, model, keys):
+        """Builds the doc vectors of every index dataset key with the given
+        model ('ft', 'tfidf' or 'glove').
+
+        Returns:
+            The search index output path and the dictionary of doc vector
+            matrices (e.g. TitleV, BodyV).
+        """
         def split_tags(tagstring_list):
             taglist_list = []
             for row in list(tagstring_list):
@@ -173,21 +244,26 @@ class IndexBuilder:
                 search_index[key + 'V'] = build_vecs_fn(model, key_text_list)
             output_path = os.path.join(
                 self.export_dir,
-                os.path.basename(model_path)[:-4] + '_post_index.pkl')
+                os.path.basename(model_path)[:-4] + '_post_index')
             return output_path, search_index
 
         output_path = None
         output_dict = None
         if model == 'ft':
-            output_path, output_dict = build_dict(index_dataset,
-                                                  self.fasttext_path,
-                                                  load_ft_model, build_ft_vecs,
-                                                  keys)
+            load_fn = load_ft_model
+            if self.num_workers > 1:
+                # the model is loaded by every worker process from its path
+                load_fn = str
+            output_path, output_dict = build_dict(
+                index_dataset, self.fasttext_path, load_fn,
+                partial(build_ft_vecs, num_workers=self.num_workers), keys)
         elif model == 'tfidf':
-            output_path, output_dict = build_dict(index_dataset,
-                                                  self.tfidf_path,
-                                                  load_tfidf_model,
-                                                  build_tfidf_vecs, keys)
+            load_fn = load_tfidf_model
+            if self.num_workers > 1:
+                load_fn = str
+            output_path, output_dict = build_dict(
+                index_dataset, self.tfidf_path, load_fn,
+                partial(build_tfidf_vecs, num_workers=self.num_workers), keys)
         elif model == 'glove':
             output_path, output_dict = build_dict(index_dataset,
                                                   self.glove_path,
@@ -195,9 +271,25 @@ class IndexBuilder:
                                                   build_glove_vecs, keys)
         else:
             raise ValueError('Unknown model type {}.'.format(model))
+        return output_path, output_dict
+
+    def build_search_index(self,
+                           index_dataset,
+                           model,
+                           keys=['Title', 'Body'],
+                           build_ann=False):
+        output_path, output_dict = self._build_search_dict(
+            index_dataset, model, keys)
+
+        # Normalized, memory-mappable index store (see index_store.py)
+        output_index = build_field_index(output_dict)
+        output_dict = None
+        save_index_store(output_index, output_path)
+        print('search index saved in', os.path.realpath(output_path))
 
-        with open(output_path, 'wb') as out:
-            pickle.dump(output_dict, out)
+        if build_ann and model != 'tfidf':
+            print('Building ANN index...')
+            self.build_ann_index(output_path, output_index)
 
     def build_index(self,
                     index_query,
@@ -208,75 +300,44 @@ class IndexBuilder:
                     build_ft_index=True,
                     build_tfidf_index=True,
                     build_glove_index=True,
-                    build_wv_index=True):
+                    build_wv_index=True,
+                    build_ann_index=False):
         def build_init_index_dataset(index_query):
-            qids = frozenset(self._fetch_qids(index_query))
-            return self._build_index_dataset(qids)
-
-        def load_processed_index_dataset(index_dataset,
-                                         body_corpus=None,
-                                         title_corpus=None):
-            if isinstance(index_dataset, str):
-                if os.path.exists(index_dataset):
-                    df = pd.read_pickle(index_dataset)
-                    keys = list(df.columns)
-                    return {key: list(df[key]) for key in keys}
-            else:
-                # Tags are not processed until the search index building process
-                index_dataset['Body'] = self._load_text_list(body_corpus)
-                index_dataset['Title'] = self._load_text_list(title_corpus)
+            return self._build_index_dataset(self._fetch_qids(index_query))
+
+        def load_processed_index_dataset(index_dataset):
+            if os.path.exists(index_dataset):
+                return pd.read_pickle(index_dataset)
 
         # File Paths
-        bcorpus = os.path.join(self.temp_dir, 'body_corpus')
-        final_bcorpus = os.path.join(self.temp_dir, 'final_body_corpus')
-        tcorpus = os.path.join(self.temp_dir, 'title_corpus')
-        final_tcorpus = os.path.join(self.temp_dir, 'final_title_corpus')
         wordvec_output_path = os.path.join(
             self.export_dir,
             os.path.basename(self.fasttext_path)[:-4] + '_wordvec_index.pkl')
 
         # Index Dataset
-        index_ids = None
         index_dataset = None
         dataset_processed = False
 
         if build_metadata:
             if index_dataset is None:
-                index_ids, index_dataset = build_init_index_dataset(
-                    index_query)
+                index_dataset = build_init_index_dataset(index_query)
             # Build unprocessed index dataset and metadata index
             print('Building search index dataset and metadata lookup...')
-            self.build_metadata_index(index_ids, metadata_query)
+            self.build_metadata_index(index_dataset.index.tolist(),
+                                      metadata_query)
 
         if build_dataset:
             if index_dataset is None:
-                index_ids, index_dataset = build_init_index_dataset(
-                    index_query)
-            # Dump question bodies & titles to disk and process each corpus
-            print('Processing body & title corpora...')
-            self._dump_text_list(bcorpus, index_dataset['Body'])
-            process_corpus(bcorpus, final_bcorpus, True, 'norm')
-            self._dump_text_list(tcorpus, index_dataset['Title'])
-            process_corpus(tcorpus, final_tcorpus, False, 'norm')
-
-            # Load processed bodies & titles from disk
-            load_processed_index_dataset(index_dataset, final_bcorpus,
-                                         final_tcorpus)
+                index_dataset = build_init_index_dataset(index_query)
+            self._process_index_dataset(index_dataset, self.temp_dir)
             dataset_processed = True
 
-            # Sanity check after text processing
-            if len(index_ids) != len(index_dataset['Body']):
-                raise Exception('Length mismatch on Id & Body lists.')
-            if len(index_ids) != len(index_dataset['Title']):
-                raise Exception('Length mismatch on Id & Title lists.')
-
             # Save index dataset dataframe to export folder
             idataset_df = os.path.join(self.export_dir,
                                        'data/index_dataset.pkl')
             if not os.path.exists(os.path.dirname(idataset_df)):
                 os.makedirs(os.path.dirname(idataset_df))
-            pd.DataFrame(data=index_dataset,
-                         index=index_ids).to_pickle(idataset_df)
+            index_dataset.to_pickle(idataset_df)
 
         # Load processed index from disk to build ft or tfidf search index
         if index_dataset is None or not dataset_processed:
@@ -289,7 +350,9 @@ class IndexBuilder:
 
         if build_ft_index:
             print('Building fasttext search index...')
-            self.build_search_index(index_dataset, 'ft')
+            self.build_search_index(index_dataset,
+                                    'ft',
+                                    build_ann=build_ann_index)
 
         if build_tfidf_index:
             print('Building tfidf search index...')
@@ -297,16 +360,70 @@ class IndexBuilder:
 
         if build_glove_index:
             print('Building GloVe search index...')
-            self.build_search_index(index_dataset, 'glove')
+            self.build_search_index(index_dataset,
+                                    'glove',
+                                    build_ann=build_ann_index)
 
         if build_wv_index:
             print('Exporting word vector index...')
             build_wordvec_index(self.wordvec_path, wordvec_output_path)
 
+    def update_index(self, qids, metadata_query, keys=['Title', 'Body']):
+        """Adds new or edited questions to the index as a segment (see
+        segments.py). The metadata and the doc vectors (for every search
+        index built in the export folder) of the questions are stored in a
+        new segment next to the base index. The older rows of edited
+        questions are superseded.
+
+        Args:
+            qids: The Ids of the new or edited questions.
+            metadata_query: The metadata query (see METADATA_QUERY).
+            keys: The index dataset keys.
+
+        Returns:
+            The segment directory.
+        """
+        qids = sorted(set(int(qid) for qid in qids))
+        snapshot = segment_snapshot(self.export_dir)
+        segment_path = new_segment_path(self.export_dir)
+        segment_temp = os.path.join(self.temp_dir,
+                                    os.path.basename(segment_path))
+        if not os.path.exists(segment_temp):
+            os.makedirs(segment_temp)
+
+        print('Building segment metadata store...')
+        store = MetadataStore.from_records(
+            self._fetch_metadata(qids, metadata_query))
+        store.save(os.path.join(segment_path, METADATA_DIR))
+
+        index_dataset = self._build_index_dataset(qids, keys).sort_index()
+        if not np.array_equal(index_dataset.index.values, store.post_ids):
+            raise Exception('Mismatch on segment metadata & dataset Ids.')
+        self._process_index_dataset(index_dataset, segment_temp)
+
+        indices = []
+        for model, model_path in (('ft', self.fasttext_path),
+                                  ('tfidf', self.tfidf_path),
+                                  ('glove', self.glove_path)):
+            name = os.path.basename(model_path)[:-4] + '_post_index'
+            if not is_index_store(os.path.join(snapshot.base_path, name)):
+                continue
+            print('Building {} segment index...'.format(model))
+            _, output_dict = self._build_search_dict(index_dataset, model,
+                                                     keys)
+            save_index_store(output_dict, os.path.join(segment_path, name))
+            indices.append(name)
+
+        write_segment_manifest(segment_path, len(store), indices)
+        print('index segment ({} questions) saved in'.format(len(store)),
+              os.path.realpath(segment_path))
+        return segment_path
+
 
 def main(question_dataframe, database_path, fasttext_model_path,
          tfidf_model_path, glove_index_path, temp_dir, export_dir,
-         index_qids_query, metadata_query, index_dataset, build_options):
+         index_qids_query, metadata_query, index_dataset, build_options,
+         num_workers, update_path=None, compact=False):
 
     indexbuilder = IndexBuilder(qdataframe_path=question_dataframe,
                                 database_path=database_path,
@@ -314,7 +431,17 @@ def main(question_dataframe, database_path, fasttext_model_path,
                                 tfidf_path=tfidf_model_path,
                                 glove_path=glove_index_path,
                                 temp_dir=temp_dir,
-                                export_dir=export_dir)
+                                export_dir=export_dir,
+                                num_workers=num_workers)
+
+    if update_path:
+        with open(update_path, 'r') as f:
+            qids = [int(line) for line in f if line.strip()]
+        indexbuilder.update_index(qids, metadata_query)
+        return
+    if compact:
+        compact_segments(export_dir)
+        return
 
     indexbuilder.build_index(index_query=index_qids_query,
                              metadata_query=metadata_query,
@@ -334,7 +461,8 @@ def param_parser(params_filepath):
         'index_qids_query': None,
         'metadata_query': None,
         'index_dataset': None,
-        'build_options': None
+        'build_options': None,
+        'num_workers': None
     }
 
     with open(params_filepath, 'r') as _in:
@@ -353,6 +481,7 @@ def param_parser(params_filepath):
         params_dict['index']['metadata_cols']))
     params['index_dataset'] = params_dict['index']['index_dataset']
     params['build_options'] = params_dict['index']['build_options']
+    params['num_workers'] = params_dict['index'].get('num_workers', 1)
 
     return params
 
@@ -370,6 +499,17 @@ if __name__ == '__main__':
         '--params',
         default='params.json',
         help='Path to a valid params file. (default: params.json)')
+    parser.add_argument(
+        '-u',
+        '--update',
+        metavar='IDS',
+        default=None,
+        help='Add the (new or edited) questions whose Ids are listed in IDS '
+        '(one per line) to the index as a segment.')
+    parser.add_argument('-c',
+                        '--compact',
+                        action='store_true',
+                        help='Merge the index segments into the base index.')
 
     args = parser.parse_args()
     validate_file(args.params)
@@ -377,4 +517,4 @@ if __name__ == '__main__':
     p = param_parser(args.params)
     print('Index build options:')
     pprint.pprint(p['build_options'])
-    main(**p)
+    main(**p, update_path=args.update, compact=args.compact)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the packages (wordvec_models, text_processing, ...) live in src/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,13 @@
+import os
+
+from wordvec_models.ann_index import ann_index_path
+
+
+def test_ann_index_path_keeps_the_version():
+    index_dir = os.path.join('wordvec_models', 'index')
+    for name in ('ft_v0.6.1_post_index', 'ft_v0.6.1_post_index/',
+                 'ft_v0.6.1_post_index.pkl'):
+        assert ann_index_path(os.path.join(index_dir, name)) == os.path.join(
+            index_dir, 'ft_v0.6.1_ivf_index.npz')
+    assert ann_index_path('ft_v0.6.2_post_index') != ann_index_path(
+        'ft_v0.6.1_post_index')
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from wordvec_models import cache
+from wordvec_models.cache import LRUCache, vector_nbytes
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_evicts_the_least_recently_used_entry():
+    lru = LRUCache(2)
+    lru.put('a', 1)
+    lru.put('b', 2)
+    assert lru.get('a') == 1
+    lru.put('c', 3)
+    assert 'b' not in lru
+    assert lru.get('a') == 1 and lru.get('c') == 3
+    assert lru.get('b') is None
+    assert (lru.hits, lru.misses) == (3, 1)
+
+
+def test_lru_entries_expire_after_the_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock)
+    lru = LRUCache(4, ttl=10)
+    lru.put('a', 1)
+    clock.now = 5
+    lru.put('b', 2)
+    clock.now = 10
+    assert lru.get('a') == 1
+    # a hit does not renew an entry
+    clock.now = 11
+    assert lru.get('a') is None
+    assert lru.get('b') == 2
+    assert len(lru) == 1
+    clock.now = 16
+    assert 'b' not in lru and len(lru) == 0
+
+
+def test_lru_evicts_down_to_the_memory_budget():
+    lru = LRUCache(10, max_bytes=1000, sizeof=vector_nbytes)
+    lru.put('a', np.zeros(100, dtype=np.float32))
+    lru.put('b', {'TitleV': np.zeros(50, dtype=np.float32)})
+    assert lru.nbytes == 600
+    lru.get('a')
+    lru.put('c', sparse.random(1, 100, 0.5, format='csr', dtype=np.float32))
+    # 50 float32 values + 50 int32 indices + 2 int32 indptr
+    assert vector_nbytes(lru.get('c')) == 408
+    assert 'b' not in lru and lru.nbytes == 808
+    # larger than the whole budget, not cached
+    lru.put('d', np.zeros(300, dtype=np.float32))
+    assert 'd' not in lru and len(lru) == 2
+    lru.clear()
+    assert lru.nbytes == 0 and len(lru) == 0
+
+
+def test_lru_requires_a_sizeof_function_for_a_memory_budget():
+    with pytest.raises(ValueError):
+        LRUCache(10, max_bytes=1000)
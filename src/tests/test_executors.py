@@ -0,0 +1,44 @@
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from web_app.executors import BoundedExecutor, OverloadedError
+
+
+def test_bounded_executor_rejects_tasks_beyond_max_pending():
+    executor = BoundedExecutor('scoring', 1, 2)
+    release = threading.Event()
+    futures = [executor.submit(release.wait, 5) for _ in range(2)]
+    with pytest.raises(OverloadedError):
+        executor.submit(release.wait, 5)
+    assert executor.stats() == {
+        'max_workers': 1,
+        'max_pending': 2,
+        'pending': 2,
+        'rejected': 1
+    }
+    release.set()
+    assert all(f.result(5) for f in futures)
+    assert executor.pending == 0
+    assert executor.run(time.time() + 5, abs, -1) == 1
+
+
+def test_bounded_executor_run_times_out_at_the_deadline():
+    executor = BoundedExecutor('scoring', 1, 4)
+    release = threading.Event()
+    running = executor.submit(release.wait, 5)
+    start = time.time()
+    with pytest.raises(TimeoutError):
+        executor.run(start + 0.1, abs, -1)
+    assert time.time() - start < 1
+    # the queued task was cancelled
+    release.set()
+    running.result(5)
+    assert executor.pending == 0
+
+
+def test_bounded_executor_requires_a_queue_for_every_worker():
+    with pytest.raises(ValueError):
+        BoundedExecutor('scoring', 4, 2)
@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+import pytest
+
+fasttext = pytest.importorskip('fasttext')
+
+from wordvec_models.fasttext_model import build_doc_vectors
+
+
+@pytest.fixture(scope='module')
+def model_path(tmpdir_factory):
+    directory = tmpdir_factory.mktemp('fasttext')
+    corpus = str(directory.join('corpus.txt'))
+    rs = np.random.RandomState(0)
+    words = ['word{}'.format(ii) for ii in range(50)]
+    with open(corpus, 'w') as out:
+        for _ in range(300):
+            out.write(' '.join(rs.choice(words, 12)) + '\n')
+    model = fasttext.train_unsupervised(corpus, dim=8, epoch=1, minCount=1,
+                                        thread=1, verbose=0)
+    path = str(directory.join('model.bin'))
+    model.save_model(path)
+    return path
+
+
+def test_pool_matches_a_single_process(model_path):
+    doc = ['word{} word{}'.format(ii, ii + 1) for ii in range(40)]
+    vectors = build_doc_vectors(model_path, doc, chunk_size=7)
+    pooled = build_doc_vectors(model_path, doc, chunk_size=7, num_workers=2)
+    assert vectors.shape == (40, 8)
+    assert np.array_equal(vectors, pooled)
+
+
+def test_empty_doc_keeps_the_model_dimension(model_path, tmpdir):
+    empty = str(tmpdir.join('empty.txt'))
+    open(empty, 'w').close()
+    for doc in ([], empty):
+        for num_workers in (1, 2):
+            vectors = build_doc_vectors(model_path, doc,
+                                        num_workers=num_workers)
+            assert vectors.shape == (0, 8)
@@ -0,0 +1,48 @@
+import numpy as np
+from scipy import sparse
+
+from wordvec_models.field_index import SparseFieldIndex, build_field_index
+
+
+def sparse_index(num_rows=300, num_terms=40, seed=0):
+    """Title/Body tf-idf like index, the last 10 terms never appear in the
+    titles (empty title posting lists)."""
+    rs = np.random.RandomState(seed)
+    titles = sparse.random(num_rows, num_terms, 0.05, random_state=rs,
+                           format='csr')
+    titles = sparse.csr_matrix(titles.toarray() * (np.arange(num_terms) < 30))
+    bodies = sparse.random(num_rows, num_terms, 0.2, random_state=rs,
+                           format='csr')
+    return build_field_index({'TitleV': titles, 'BodyV': bodies})
+
+
+def exhaustive_top_k(index, query_vec, k):
+    sims = index.scores(query_vec)
+    order = np.lexsort((np.arange(len(sims)), -sims))[:k]
+    return order, sims[order]
+
+
+def test_sparse_top_k_term_missing_from_a_field():
+    index = sparse_index()
+    assert isinstance(index, SparseFieldIndex)
+    # one common term and two body-only terms, weighted so that pruning kicks
+    # in before the body-only terms (empty title posting lists) are scored
+    query = np.zeros((1, 40), dtype=np.float32)
+    query[0, [0, 1, 2, 35, 38]] = [1.0, 0.9, 0.8, 0.05, 0.04]
+    query = sparse.csr_matrix(query)
+    for k in (1, 5, 10):
+        _, sims = index.top_k(query, k)
+        _, ref_sims = exhaustive_top_k(index, query, k)
+        assert np.allclose(sims, ref_sims, atol=1e-6)
+
+
+def test_sparse_top_k_matches_exhaustive():
+    index = sparse_index(seed=1)
+    rs = np.random.RandomState(2)
+    for _ in range(200):
+        query = sparse.random(1, 40, 0.1, random_state=rs, format='csr')
+        if query.nnz == 0:
+            continue
+        _, sims = index.top_k(query, 10)
+        _, ref_sims = exhaustive_top_k(index, query, 10)
+        assert np.allclose(sims, ref_sims, atol=1e-6)
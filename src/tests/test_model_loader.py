@@ -0,0 +1,136 @@
+import time
+import threading
+
+from web_app.model_loader import ModelLoader
+from wordvec_models.registry import ArtifactRegistry
+from wordvec_models.segments import compact_segments, segment_snapshot
+
+from test_segments import add_segment, build_segmented_dir
+
+
+class SnapshotModel:
+    """Stands in for a search model loaded from a snapshot of base_dir."""
+    def __init__(self, base_dir):
+        self.snapshot = segment_snapshot(base_dir)
+        self.invalidated = False
+
+    def outdated(self):
+        return self.snapshot.outdated()
+
+    def invalidate_caches(self):
+        self.invalidated = True
+
+
+def wait_ready(loader, timeout=10):
+    start = time.time()
+    while loader.state == 'loading':
+        assert time.time() - start < timeout
+        time.sleep(0.01)
+
+
+def test_refresh_rebuilds_the_outdated_models(tmpdir):
+    base_dir = str(tmpdir)
+    build_segmented_dir(base_dir)
+    loader = ModelLoader(lambda model_type: SnapshotModel(base_dir))
+    loader.preload('tf-idf')
+    loader.preload('fasttext')
+    loader.frozen = True
+    assert loader.refresh() == []
+
+    add_segment(base_dir, [22], 2)
+    served = loader.model
+    assert sorted(loader.refresh()) == ['fasttext', 'tf-idf']
+    wait_ready(loader)
+    assert loader.state == 'ready'
+    assert loader.model is loader.models['fasttext']
+    assert loader.model is not served and served.invalidated
+    assert not any(m.outdated() for m in loader.models.values())
+
+
+def test_compaction_triggers_a_refresh(tmpdir):
+    base_dir = str(tmpdir)
+    build_segmented_dir(base_dir)
+    registry = ArtifactRegistry()
+    loader = ModelLoader(lambda model_type: SnapshotModel(base_dir))
+    loader.preload('hybrid')
+    registry.add_evict_listener(lambda path: loader.refresh())
+
+    compact_segments(base_dir, registry)
+    wait_ready(loader)
+    assert loader.model.snapshot.base is not None
+    assert loader.model.snapshot.segments == ()
+
+
+def test_poll_waits_for_the_refresh_interval(tmpdir):
+    base_dir = str(tmpdir)
+    build_segmented_dir(base_dir)
+    loader = ModelLoader(lambda model_type: SnapshotModel(base_dir), 3600)
+    loader.preload('hybrid')
+    served = loader.model
+    add_segment(base_dir, [22], 2)
+    loader.poll()
+    assert loader.model is served
+    loader.checked -= 3600
+    loader.poll()
+    wait_ready(loader)
+    assert loader.model is not served
+
+
+class GatedBuild:
+    """A build function that blocks until released, failing on 'broken'."""
+    def __init__(self):
+        self.release = threading.Event()
+        self.built = []
+
+    def __call__(self, model_type):
+        self.release.wait(5)
+        if model_type == 'broken':
+            raise IOError('missing index')
+        self.built.append(model_type)
+        return model_type
+
+
+def test_load_state_transitions():
+    build = GatedBuild()
+    loader = ModelLoader(build)
+    assert loader.status() == {
+        'state': 'idle',
+        'model_type': None,
+        'seconds': None,
+        'error': None
+    }
+    assert loader.load('hybrid') is None
+    assert loader.status()['state'] == 'loading' and loader.model is None
+    # the same model is already loading, another one has to wait
+    assert loader.load('hybrid') is None
+    assert 'hybrid' in loader.load('fasttext')
+    build.release.set()
+    wait_ready(loader)
+    assert loader.status()['state'] == 'ready'
+    assert loader.model == 'hybrid' and build.built == ['hybrid']
+
+    # a failed load keeps the model in use
+    assert loader.load('broken') is None
+    wait_ready(loader)
+    status = loader.status()
+    assert status['state'] == 'failed' and status['model_type'] == 'broken'
+    assert status['error'] == 'OSError: missing index'
+    assert loader.model == 'hybrid'
+
+    # switching back to a loaded model is immediate
+    assert loader.load('hybrid') is None
+    assert loader.status()['state'] == 'ready'
+    assert loader.status()['error'] is None
+    assert build.built == ['hybrid']
+
+
+def test_frozen_loader_only_switches_between_preloaded_models():
+    build = GatedBuild()
+    build.release.set()
+    loader = ModelLoader(build)
+    loader.preload('tf-idf')
+    loader.preload('hybrid')
+    loader.frozen = True
+    assert loader.load('fasttext') is not None
+    assert loader.load('tf-idf') is None and loader.model == 'tf-idf'
+    assert build.built == ['tf-idf', 'hybrid']
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from wordvec_models.registry import ArtifactRegistry, artifact_key
+
+
+def test_concurrent_requests_share_a_single_load():
+    registry = ArtifactRegistry()
+    key = artifact_key('index', 'index/ft_v0.6.1_post_index', ('BodyV', ))
+    loads = []
+    started = threading.Event()
+
+    def load():
+        loads.append(threading.current_thread().name)
+        started.set()
+        time.sleep(0.2)
+        return object()
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(registry.get(key, load)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    started.wait(5)
+    assert [s['state'] for s in registry.status()] == ['loading']
+    for thread in threads:
+        thread.join(5)
+    assert len(loads) == 1
+    assert len(results) == 8 and all(r is results[0] for r in results)
+    assert [s['state'] for s in registry.status()] == ['ready']
+
+
+def test_distinct_artifacts_load_concurrently():
+    registry = ArtifactRegistry()
+    barrier = threading.Barrier(2, timeout=5)
+
+    def load():
+        # both loads are in progress at once, or the barrier times out
+        barrier.wait()
+        return object()
+
+    threads = [
+        threading.Thread(target=registry.get,
+                         args=(artifact_key('metadata', name), load))
+        for name in ('a', 'b')
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(registry) == 2
+
+
+def test_evict_drops_the_artifacts_of_a_path():
+    registry = ArtifactRegistry()
+    evicted = []
+    registry.add_evict_listener(evicted.append)
+    registry.get(artifact_key('index', 'index/a', ('BodyV', )), object)
+    registry.get(artifact_key('index', 'index/a', ('TitleV', )), object)
+    registry.get(artifact_key('metadata', 'index/metadata'), object)
+    registry.evict('index/./a')
+    assert registry.keys() == [artifact_key('metadata', 'index/metadata')]
+    assert evicted == ['index/./a']
@@ -0,0 +1,124 @@
+import threading
+
+import pytest
+
+from web_app import app, routes
+from web_app.executors import BoundedExecutor
+from wordvec_models.search_model import SearchResult
+
+
+class StaticModel:
+    """Returns the same results for every query, after `release` is set."""
+    name = 'hybrid'
+
+    def __init__(self, results, top_tags):
+        self.results = results
+        self.top_tags = top_tags
+        self.release = threading.Event()
+        self.release.set()
+        self.calls = []
+
+    def search(self, query, tags=None, num_results=10, as_frame=True):
+        self.calls.append((query, tags, num_results))
+        self.release.wait(5)
+        return self.results[:num_results], self.top_tags
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = StaticModel([
+        SearchResult(11, 'md5 checksums', 2, 12, 7, 'int a = 1;', 0.75),
+        SearchResult(21, 'sha1', 1, -1, 0, 'int b = 2;', 0.5)
+    ], ['md5', 'hash'])
+    monkeypatch.setattr(routes.loader, 'model', model)
+    monkeypatch.setattr(routes.loader, 'refresh_interval', None)
+    monkeypatch.setattr(routes, 'scoring_pool',
+                        BoundedExecutor('scoring', 1, 1))
+    yield model
+    model.release.set()
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_api_search_rejects_requests_when_overloaded(model, client):
+    model.release.clear()
+    # the only pending slot is taken by a running search
+    routes.scoring_pool.submit(model.search, 'busy')
+    response = client.post('/api/search', json={'query': 'md5'})
+    assert response.status_code == 503
+    assert 'overloaded' in response.get_json()['error']
+    assert routes.scoring_pool.stats()['rejected'] == 1
+
+
+def test_api_search_times_out(model, client, monkeypatch):
+    monkeypatch.setattr(routes, 'SEARCH_TIMEOUT', 0.1)
+    monkeypatch.setattr(routes, 'scoring_pool',
+                        BoundedExecutor('scoring', 1, 4))
+    model.release.clear()
+    response = client.post('/api/search', json={'query': 'md5'})
+    assert response.status_code == 504
+    assert response.get_json() == {
+        'error': routes.timeout_error.format(0.1)
+    }
+
+
+def test_search_without_a_model(client, monkeypatch):
+    monkeypatch.setattr(routes.loader, 'model', None)
+    monkeypatch.setattr(routes.loader, 'refresh_interval', None)
+    response = client.post('/api/search', json={'query': 'md5'})
+    assert response.status_code == 503
+    assert response.get_json() == {'error': routes.no_model_error}
+
+
+def test_api_search_json_shape(model, client):
+    response = client.post('/api/search',
+                           json={
+                               'query': 'md5 checksums',
+                               'tags': ['md5'],
+                               'num_results': 1
+                           })
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    assert response.get_json() == {
+        'tags': ['md5', 'hash'],
+        'results': [{
+            'PostId': 11,
+            'Title': 'md5 checksums',
+            'SnippetCount': 2,
+            'sdict': {
+                'anslink': 'https://stackoverflow.com/questions/12',
+                'snippet': 'int a = 1;',
+                'score': 7
+            },
+            'Sim': 0.75,
+            'Link': 'https://stackoverflow.com/questions/11'
+        }]
+    }
+    assert model.calls == [('md5 checksums', ['md5'], 1)]
+
+    response = client.post('/api/search', json={'query': 'md5'})
+    results = response.get_json()['results']
+    assert [r['PostId'] for r in results] == [11, 21]
+    # no tags, at most MAX_API_RESULTS results
+    client.post('/api/search', json={'query': 'md5', 'num_results': 10**6})
+    assert model.calls[1:] == [('md5', None, 10),
+                               ('md5', None, routes.MAX_API_RESULTS)]
+
+
+@pytest.mark.parametrize('payload', [{}, {
+    'query': 1
+}, {
+    'query': 'md5',
+    'num_results': 0
+}, {
+    'query': 'md5',
+    'num_results': '10'
+}])
+def test_api_search_rejects_invalid_requests(model, client, payload):
+    response = client.post('/api/search', json=payload)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+    assert model.calls == []
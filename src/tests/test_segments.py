@@ -0,0 +1,175 @@
+import os
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from wordvec_models.field_index import finite_results, top_k
+from wordvec_models.index_store import load_index_store, save_index_store
+from wordvec_models.metadata_store import MetadataStore
+from wordvec_models.registry import ArtifactRegistry
+from wordvec_models.segments import COMPACTED_DIR, METADATA_DIR
+from wordvec_models.segments import compact_segments
+from wordvec_models.segments import list_segments, load_segmented_index
+from wordvec_models.segments import load_segmented_metadata
+from wordvec_models.segments import new_segment_path, segment_snapshot
+from wordvec_models.segments import store_name, write_segment_manifest
+
+FT_INDEX = 'ft_v0.6.1_post_index'
+TFIDF_INDEX = 'tfidf_v0.3_post_index'
+KEYS = ['TitleV', 'BodyV']
+
+
+def metadata_rows(post_ids):
+    return [(post_id, 1, 0, 0, 0, 'title {}'.format(post_id), '',
+             ['java'] if post_id % 2 else ['python']) for post_id in post_ids]
+
+
+def index_dicts(num_rows, rs):
+    ft = {key: rs.rand(num_rows, 8).astype(np.float32) for key in KEYS}
+    tfidf = {
+        key: sparse.random(num_rows, 30, 0.3, random_state=rs, format='csr')
+        for key in KEYS
+    }
+    return ft, tfidf
+
+
+def write_stores(path, post_ids, rs):
+    MetadataStore.from_rows(metadata_rows(post_ids)).save(
+        os.path.join(path, METADATA_DIR))
+    ft, tfidf = index_dicts(len(post_ids), rs)
+    save_index_store(ft, os.path.join(path, FT_INDEX))
+    save_index_store(tfidf, os.path.join(path, TFIDF_INDEX))
+
+
+def add_segment(base_dir, post_ids, seed):
+    segment_path = new_segment_path(base_dir)
+    write_stores(segment_path, post_ids, np.random.RandomState(seed))
+    write_segment_manifest(segment_path, len(post_ids),
+                           [FT_INDEX, TFIDF_INDEX])
+
+
+def build_segmented_dir(base_dir):
+    """A base of 20 posts and a segment adding 2 posts and editing post 3."""
+    write_stores(base_dir, list(range(20)), np.random.RandomState(0))
+    add_segment(base_dir, [3, 20, 21], 1)
+
+
+def load_snapshot(snapshot, name):
+    """Loads an index and the metadata of a snapshot, the way the search
+    models do."""
+    path = snapshot.store_path(os.path.join(snapshot.directory, name))
+    index = load_index_store(path, KEYS)
+    metadata = MetadataStore.load(
+        snapshot.store_path(os.path.join(snapshot.directory, METADATA_DIR)))
+    if snapshot.segments:
+        index = load_segmented_index(snapshot, path, index, KEYS)
+        metadata = load_segmented_metadata(snapshot, metadata)
+    return index, metadata
+
+
+def live_post_ids(index, metadata):
+    assert index.shape[0] == len(metadata)
+    superseded = set(getattr(index, 'superseded', []))
+    return sorted(metadata.post_ids[i] for i in range(len(metadata))
+                  if i not in superseded)
+
+
+def test_store_name_keeps_the_version():
+    for name in (FT_INDEX, FT_INDEX + '/', FT_INDEX + '.pkl'):
+        assert store_name(os.path.join('index', name)) == FT_INDEX
+
+
+def test_versioned_segments_load_and_compact(tmpdir):
+    base_dir = str(tmpdir)
+    build_segmented_dir(base_dir)
+    snapshot = segment_snapshot(base_dir)
+    assert len(snapshot.segments) == 1
+
+    for name in (FT_INDEX, TFIDF_INDEX):
+        index, metadata = load_snapshot(snapshot, name)
+        assert index.shape == (23, 2)
+        # row 3 (post 3) is superseded by the first segment row
+        assert list(index.superseded) == [3]
+        query = index.parts[0]['BodyV'][:1]
+        indices, sims = index.top_k(query, 22)
+        assert 3 not in indices
+        assert len(indices) == 22
+        assert np.all(np.diff(sims) <= 0)
+
+    assert compact_segments(base_dir,
+                            ArtifactRegistry()) == list(snapshot.segments)
+    compacted = segment_snapshot(base_dir)
+    assert compacted.base is not None and compacted.segments == ()
+    for name in (FT_INDEX, TFIDF_INDEX):
+        index, metadata = load_snapshot(compacted, name)
+        assert index.shape == (22, 2)
+        assert list(metadata.post_ids) == [
+            p for p in range(20) if p != 3] + [3, 20, 21]
+
+
+def test_snapshots_survive_compaction(tmpdir):
+    base_dir = str(tmpdir)
+    build_segmented_dir(base_dir)
+    registry = ArtifactRegistry()
+    expected = list(range(22))
+    # a model loading while the segments are compacted
+    before = segment_snapshot(base_dir)
+    compact_segments(base_dir, registry)
+    for snapshot in (before, segment_snapshot(base_dir)):
+        for name in (FT_INDEX, TFIDF_INDEX):
+            assert live_post_ids(*load_snapshot(snapshot, name)) == expected
+
+    # a new segment is live on top of the compacted base, until the next
+    # compaction removes the original base and the merged segment
+    add_segment(base_dir, [5, 22], 2)
+    expected.append(22)
+    middle = segment_snapshot(base_dir)
+    assert len(middle.segments) == 1
+    compact_segments(base_dir, registry)
+    assert list_segments(base_dir) == list(middle.segments)
+    assert not os.path.exists(os.path.join(base_dir, FT_INDEX))
+    assert not os.path.exists(os.path.join(base_dir, METADATA_DIR))
+    for snapshot in (middle, segment_snapshot(base_dir)):
+        for name in (FT_INDEX, TFIDF_INDEX):
+            assert live_post_ids(*load_snapshot(snapshot, name)) == expected
+
+
+def _ranked(sims, k):
+    order = top_k(sims, k)
+    return order, sims[order]
+
+
+def test_top_k_beyond_the_live_rows_is_finite(tmpdir):
+    base_dir = str(tmpdir)
+    build_segmented_dir(base_dir)
+    snapshot = segment_snapshot(base_dir)
+    for name in (FT_INDEX, TFIDF_INDEX):
+        index, _ = load_snapshot(snapshot, name)
+        queries = index.parts[0]['BodyV'][:3]
+        # e.g. the hybrid ranking: scores of every row, then the top k
+        sims = index.scores(queries[:1])
+        indices, values = finite_results(*_ranked(sims, 30))
+        assert len(indices) == 22 and 3 not in indices
+        assert np.all(np.isfinite(values))
+        for indices, values in [index.top_k(queries[:1], 30)
+                                ] + index.batch_top_k(queries, 30):
+            assert len(indices) == 22 and 3 not in indices
+            assert np.all(np.isfinite(values))
+
+
+def test_pickled_base_indices_are_not_compacted(tmpdir):
+    base_dir = str(tmpdir)
+    build_segmented_dir(base_dir)
+    pickled = os.path.join(base_dir, 'glove_v0.1.1_post_index.pkl')
+    with open(pickled, 'wb') as out:
+        out.write(b'')
+    with pytest.raises(ValueError):
+        compact_segments(base_dir, ArtifactRegistry())
+    assert segment_snapshot(base_dir).base is None
+    assert not os.path.exists(os.path.join(base_dir, COMPACTED_DIR))
+    # pickles already converted to index stores do not block it
+    os.remove(pickled)
+    with open(os.path.join(base_dir, FT_INDEX + '.pkl'), 'wb') as out:
+        out.write(b'')
+    assert compact_segments(base_dir, ArtifactRegistry())
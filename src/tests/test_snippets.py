@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+pytest.importorskip('pyastyle')
+
+from web_app import snippets
+from web_app.snippets import SnippetRenderer, prerender, snippet_key
+from wordvec_models.metadata_store import MetadataStore
+from wordvec_models.search_model import base_url
+
+SNIPPET = 'public class A { int a() { return 1; } }'
+
+
+def test_snippets_are_cached_per_answer_score_and_snippet():
+    renderer = SnippetRenderer()
+    link, anslink = base_url + '1', base_url + '2'
+    html = renderer.render(link, anslink, 5, SNIPPET)
+    assert 'Answer Score: 5' in html
+    assert renderer.render(link, anslink, 5, SNIPPET) is html
+    assert renderer.cache.hits == 1
+    # a new score or an edited snippet is rendered again
+    assert 'Answer Score: 6' in renderer.render(link, anslink, 6, SNIPPET)
+    edited = renderer.render(link, anslink, 6, SNIPPET.replace('1', '2'))
+    assert 'return' in edited and edited != html
+    assert renderer.cache.hits == 1 and len(renderer.cache) == 3
+    # posts without an answer are keyed by their post link
+    assert snippet_key(link, base_url + '-1', 0, SNIPPET) != snippet_key(
+        base_url + '3', base_url + '-1', 0, SNIPPET)
+
+
+def test_prerendered_snippets_are_read_from_the_store(tmpdir, monkeypatch):
+    metadata_path = os.path.join(str(tmpdir), 'metadata')
+    store_path = os.path.join(str(tmpdir), 'snippets.db')
+    MetadataStore.from_rows([(1, 0, 1, 2, 5, 'title', SNIPPET, ['java']),
+                             (3, 0, 1, -1, 0, 'title', SNIPPET, ['java'])
+                             ]).save(metadata_path)
+    prerender(metadata_path, store_path)
+    expected = snippets.render_snippet(base_url + '1', base_url + '2', 5,
+                                       SNIPPET)
+
+    def render_snippet(*args):
+        raise AssertionError('rendered {}'.format(args))
+
+    monkeypatch.setattr(snippets, 'render_snippet', render_snippet)
+    renderer = SnippetRenderer(store_path)
+    assert len(renderer.store) == 2
+    assert renderer.render(base_url + '1', base_url + '2', 5,
+                           SNIPPET) == expected
+    renderer.render(base_url + '3', base_url + '-1', 0, SNIPPET)
+    # a score changed since the snippets were pre-rendered
+    with pytest.raises(AssertionError):
+        renderer.render(base_url + '1', base_url + '2', 7, SNIPPET)
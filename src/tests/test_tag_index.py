@@ -0,0 +1,23 @@
+import numpy as np
+
+from wordvec_models.metadata_store import MetadataStore
+from wordvec_models.tag_index import TagIndex
+
+
+def test_tag_listed_twice_is_posted_once():
+    rows = [(10 + ii, 1, 0, -1, 0, 'title', '', etags) for ii, etags in
+            enumerate([['java', 'list', 'java'], ['list'], ['java']])]
+    store = MetadataStore.from_rows(rows)
+    assert list(store.tag_index.postings('java')) == [0, 2]
+    assert list(store.tag_index.rows(['java'])) == [0, 2]
+    assert list(store.tag_index.rows(['java', 'list'])) == [0, 1, 2]
+    assert store.etags(0) == ['java', 'list', 'java']
+
+
+def test_from_lookup_and_old_stores_deduplicate():
+    index = TagIndex.from_lookup({'java': [2, 0, 2], 'list': [1]})
+    assert list(index.postings('java')) == [0, 2]
+    # duplicate postings of a store built before the fix
+    old = TagIndex(['java'], [0, 3], [0, 2, 2])
+    rows = old.rows(['java'])
+    assert list(rows) == [0, 2] and rows.dtype == np.int64
@@ -0,0 +1,72 @@
+import os
+import re
+
+import pytest
+
+spacy = pytest.importorskip('spacy')
+if not spacy.__version__.startswith('2.0.'):
+    # spaCy >= 2.1 rejects the custom tokenizer special cases
+    pytest.skip('the custom tokenizer requires the pinned spaCy 2.0 '
+                '(spacy {} installed)'.format(spacy.__version__),
+                allow_module_level=True)
+
+from text_processing.tokenizer import QueryNormalizer, get_custom_tokenizer
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'text_processing', 'tests')
+
+# long dotted digit runs make the custom tokenizer backtrack for hours, in
+# both the reference normalization and the normalizer
+OVERLOAD = re.compile(r'\d+(\.\d+){6,}')
+
+QUERIES = [
+    '18:12:54 AM first 1st second 2nd third 3rd v3.4 1.2.3 2.9898 100% '
+    '0,0,100,200',
+    'cv).model c)+comf a)x I am trying to @role=\'listbox\']div '
+    'role="listbox" [role="listbox"]div',
+    'I didn\'t isn\'t I\'ve got this can\'t ca 0-first \'hello and a '
+    'leprechaun who\'d do that...',
+    'com.rabbitmq:amqp-client org.codehaus.mojo:exec-maven-plugin:1.2.1:exec '
+    'this.org(needs(split.o())) end',
+    'String.replaceAll("\\\\<(.*?)\\\\>", ""); Java/C#\'s C++\'s C#, ,C# ,C#.',
+    'one.two.three(String) one.two(one.two(toString())) getMaxSize(), '
+    ',getMinSize() .o.equals(null) if(time && 0){do this;} #hello '
+    'invalid#hashtag#seq @jvx .NET Java/.Net',
+    'https://www.google.com/search?q=i%20like%20gizmodo&rct=j?te '
+    'testmail@ece.auth.gr file:/aaa/bbb/ccc_20150310235959999.html',
+    'How to calculate md5 checksums?',
+    # irregular whitespace, normalized by the reference passes
+    '  leading and trailing  ',
+    'two  spaces\tand a tab',
+    'new\nlines\r\n',
+    '',
+    '... !!! ???',
+]
+
+
+def corpus_queries():
+    queries = []
+    for filename in sorted(os.listdir(CORPUS_DIR)):
+        with open(os.path.join(CORPUS_DIR, filename), 'r') as f:
+            queries.extend(line for line in f)
+    return queries
+
+
+@pytest.fixture(scope='module')
+def normalizer():
+    try:
+        nlp = get_custom_tokenizer()
+    except (IOError, OSError) as e:
+        pytest.skip('en_core_web_sm is not installed ({})'.format(e))
+    return QueryNormalizer(nlp)
+
+
+def test_query_normalizer_matches_the_reference(normalizer):
+    queries = QUERIES + corpus_queries()
+    queries = [q for q in queries if not OVERLOAD.search(q)]
+    # the second round is served from the memoized norm table
+    for _ in range(2):
+        for query in queries:
+            assert normalizer(query) == normalizer.reference(query), query
+    first_pass, second_pass = normalizer.cache_info()
+    assert first_pass.hits > 0 and second_pass.hits > 0
@@ -0,0 +1,25 @@
+from multiprocessing import Pool
+
+from wordvec_models.utils import bounded_imap, iter_chunks
+
+
+def test_iter_chunks():
+    assert list(iter_chunks(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(iter_chunks([], 3)) == []
+
+
+def test_bounded_imap_reads_the_input_lazily():
+    pulled = []
+
+    def items():
+        for ii in range(50):
+            pulled.append(ii)
+            yield ii
+
+    with Pool(2) as pool:
+        results = []
+        for result in bounded_imap(pool, abs, items(), 4):
+            # at most 4 items were submitted ahead of this result
+            assert len(pulled) - len(results) <= 4
+            results.append(result)
+    assert results == list(range(50))
@@ -1,6 +1,7 @@
 import re
 import spacy
 import unicodedata
+from functools import lru_cache
 from spacy import util
 from spacy.tokens import Token
 from spacy.tokenizer import Tokenizer
@@ -82,6 +83,14 @@ _hashtags = [r'#[a-zA-Z0-9_]+']
 _var = [r'\d+%$']
 
 
+# queries containing whitespace other than single spaces between words are
+# normalized with the reference (double pass) normalizer
+_irregular_space = re.compile(r'[^\S ]|  |^ | $')
+
+# number of distinct whitespace separated chunks memoized by QueryNormalizer
+NORM_CACHE_SIZE = 65536
+
+
 def get_custom_tokenizer(disable=['tagger', 'parser', 'ner']):
     nlp = spacy.load('en_core_web_sm', disable=disable)
     nlp.tokenizer = custom_tokenizer(nlp)
@@ -137,6 +146,57 @@ def add_custom_properties(nlp):
     Token.set_extension('is_symbol', getter=is_symbol_getter, force=True)
 
 
+def _keep_token(t):
+    return not (t.is_punct or t.is_bracket or t.is_quote or t._.is_symbol
+                or t.like_num)
+
+
+class QueryNormalizer:
+    """Fast, output-equivalent version of the search query normalization.
+
+    The reference normalization runs the custom tokenizer twice: the norms of
+    the tokens that are not punctuation, symbols or numbers are joined, and the
+    joined string is tokenized again and joined by token norms.
+    The spaCy tokenizer splits the text on single spaces and tokenizes every
+    chunk independently, so both passes are computed chunk by chunk from a
+    memoized norm table (chunk -> norms) using the tokenizer alone. Text with
+    any other whitespace (tabs, new lines, consecutive spaces) falls back to
+    the reference normalization.
+    """
+    def __init__(self, nlp, cache_size=NORM_CACHE_SIZE):
+        self.tokenizer = nlp.tokenizer
+        self._first_pass = lru_cache(maxsize=cache_size)(self._first_pass)
+        self._second_pass = lru_cache(maxsize=cache_size)(self._second_pass)
+
+    def _first_pass(self, chunk):
+        return tuple(t.norm_ for t in self.tokenizer(chunk) if _keep_token(t))
+
+    def _second_pass(self, chunk):
+        return ' '.join(t.norm_ for t in self.tokenizer(chunk))
+
+    def reference(self, query):
+        """The reference (double tokenizer pass) query normalization."""
+        doc = self.tokenizer(query.strip())
+        norm_query = ' '.join(t.norm_ for t in doc if _keep_token(t))
+        doc = self.tokenizer(norm_query)
+        return ' '.join(t.norm_ for t in doc)
+
+    def __call__(self, query):
+        query = query.strip()
+        if _irregular_space.search(query):
+            return self.reference(query)
+        norm_query = ' '.join(norm for chunk in query.split(' ')
+                              for norm in self._first_pass(chunk))
+        if _irregular_space.search(norm_query):
+            return ' '.join(t.norm_ for t in self.tokenizer(norm_query))
+        return ' '.join(
+            self._second_pass(chunk) for chunk in norm_query.split(' '))
+
+    def cache_info(self):
+        """Returns the memoization statistics of both passes."""
+        return self._first_pass.cache_info(), self._second_pass.cache_info()
+
+
 if __name__ == '__main__':
     nlp = get_custom_tokenizer(disable=['tagger', 'parser', 'ner'])
 
@@ -1,4 +1,43 @@
+import argparse
+
 from web_app import app
+from web_app.routes import MODEL_TYPES, loader
 
 if __name__ == "__main__":
-    app.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='StackSearch web app.')
+    parser.add_argument('--host',
+                        default='127.0.0.1',
+                        help='Interface to bind to. (default: %(default)s)')
+    parser.add_argument('--port',
+                        type=int,
+                        default=5000,
+                        help='Port to bind to. (default: %(default)s)')
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of pre-forked worker processes. With more than one worker '
+        'the models are loaded in the master process and shared by the '
+        'workers. (default: %(default)s)')
+    parser.add_argument(
+        '-m',
+        '--models',
+        nargs='+',
+        choices=MODEL_TYPES,
+        default=None,
+        help='Models loaded at startup, the first one is used. Required for '
+        'pre-fork serving, where model switching is limited to these models.')
+    args = parser.parse_args()
+
+    if args.models:
+        for model_type in reversed(args.models):
+            loader.preload(model_type)
+    if args.workers > 1:
+        if not args.models:
+            parser.error('--models is required when --workers > 1.')
+        from web_app.prefork import serve_prefork
+        loader.frozen = True
+        serve_prefork(app, args.host, args.port, args.workers)
+    else:
+        app.run(host=args.host, port=args.port)
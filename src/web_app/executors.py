@@ -0,0 +1,81 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+## Error Strings
+overloaded_error = 'The "{}" executor is overloaded ({} pending tasks).'
+pending_error = '"max_pending" must be at least "max_workers".'
+
+
+class OverloadedError(RuntimeError):
+    """Raised when a task is submitted to a full BoundedExecutor."""
+
+
+class BoundedExecutor:
+    """Thread pool executor with a bound on the number of pending (queued and
+    running) tasks.
+
+    Submitting a task while `max_pending` tasks are pending raises an
+    OverloadedError right away, so that requests are rejected early under
+    overload instead of queueing up with ever growing latency. NumPy/BLAS
+    scoring releases the GIL, so the worker threads run concurrently.
+    """
+    def __init__(self, name, max_workers, max_pending):
+        if max_pending < max_workers:
+            raise ValueError(pending_error)
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers)
+
+    def _release(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedules `fn(*args, **kwargs)` and returns its Future.
+
+        Raises:
+            OverloadedError: When `max_pending` tasks are already pending.
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise OverloadedError(
+                    overloaded_error.format(self.name, self.pending))
+            self.pending += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, deadline, fn, *args, **kwargs):
+        """Runs `fn(*args, **kwargs)` on the executor and waits for its result
+        until the given deadline (a `time.time()` timestamp).
+
+        Raises:
+            OverloadedError: When `max_pending` tasks are already pending.
+            concurrent.futures.TimeoutError: When the deadline is exceeded. The
+                task is cancelled if it has not started yet.
+        """
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=max(0, deadline - time.time()))
+        except Exception:
+            future.cancel()
+            raise
+
+    def stats(self):
+        """Returns the executor capacity, pending and rejected task counts."""
+        return {
+            'max_workers': self.max_workers,
+            'max_pending': self.max_pending,
+            'pending': self.pending,
+            'rejected': self.rejected
+        }
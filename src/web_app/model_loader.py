@@ -0,0 +1,164 @@
+import time
+import threading
+
+## Error Strings
+busy_error = 'Model "{}" is currently being loaded.'
+frozen_error = 'Model switching is disabled, serving preloaded models only.'
+
+
+class ModelLoader:
+    """Loads search models in a background thread.
+
+    The model in use (`model`) keeps serving requests while another model is
+    loading and is swapped for the new one, with a single reference
+    assignment, only once the new model is fully loaded. Loaded models are
+    kept, so switching back to them is immediate. The loading state is one of
+    'idle', 'loading', 'ready' or 'failed'.
+    Loaded models are rebuilt, the same way, once their index segments are
+    added or compacted (see `refresh`).
+    A `frozen` loader only switches between models loaded with `preload`
+    (e.g. in pre-fork serving, where each worker holds its own selection).
+    Its models are still refreshed, by every worker on its own.
+    """
+    def __init__(self, build_fn, refresh_interval=None):
+        self.build_fn = build_fn
+        self.refresh_interval = refresh_interval
+        self.models = {}
+        self.model = None
+        self.state = 'idle'
+        self.model_type = None
+        self.error = None
+        self.started = None
+        self.seconds = None
+        self.frozen = False
+        self.checked = time.time()
+        self._lock = threading.Lock()
+
+    def preload(self, model_type):
+        """Loads the given model type synchronously and switches to it."""
+        self.started = time.time()
+        self.models[model_type] = self.build_fn(model_type)
+        self.model = self.models[model_type]
+        self.model_type = model_type
+        self.state = 'ready'
+        self.seconds = time.time() - self.started
+
+    def load(self, model_type):
+        """Switches to the given model type, loading it in the background if
+        needed. Only one model is loaded at a time.
+
+        Args:
+            model_type: The model type passed to `build_fn`.
+
+        Returns:
+            None if the model is being (or already was) loaded, else an error
+            message.
+        """
+        with self._lock:
+            if self.state == 'loading':
+                if self.model_type == model_type:
+                    return None
+                return busy_error.format(self.model_type)
+            if self.frozen and model_type not in self.models:
+                return frozen_error
+            self.model_type = model_type
+            self.error = None
+            if model_type in self.models:
+                self.model = self.models[model_type]
+                self.state = 'ready'
+                self.seconds = 0
+                return None
+            self.state = 'loading'
+            self.started = time.time()
+            self.seconds = None
+        threading.Thread(target=self._load, args=(model_type, ),
+                         daemon=True).start()
+        return None
+
+    def _load(self, model_type):
+        try:
+            new_model = self.build_fn(model_type)
+        except Exception as e:
+            with self._lock:
+                self.state = 'failed'
+                self.error = '{}: {}'.format(type(e).__name__, e)
+                self.seconds = time.time() - self.started
+            return
+        with self._lock:
+            self.models[model_type] = new_model
+            # atomic swap, in-flight requests keep the model they started with
+            self.model = new_model
+            self.state = 'ready'
+            self.seconds = time.time() - self.started
+
+    def refresh(self):
+        """Rebuilds, in the background, the loaded models whose index segments
+        were added or compacted since they were loaded (see
+        `BaseSearchModel.outdated`). The outdated models keep serving requests
+        until they are swapped for the rebuilt ones. Nothing is rebuilt while
+        a model is loading.
+
+        Returns:
+            The model types being rebuilt.
+        """
+        with self._lock:
+            if self.state == 'loading':
+                return []
+            self.checked = time.time()
+            models = dict(self.models)
+        outdated = [t for t, model in models.items() if model.outdated()]
+        if len(outdated) == 0:
+            return outdated
+        with self._lock:
+            if self.state == 'loading':
+                return []
+            self.error = None
+            self.state = 'loading'
+            self.started = time.time()
+            self.seconds = None
+        threading.Thread(target=self._reload, args=(outdated, ),
+                         daemon=True).start()
+        return outdated
+
+    def poll(self):
+        """Refreshes the loaded models if `refresh_interval` seconds passed
+        since the last refresh (never if no interval is set), e.g. to pick up
+        the segments added by another process."""
+        if (self.refresh_interval is not None
+                and time.time() - self.checked >= self.refresh_interval):
+            self.refresh()
+
+    def _reload(self, model_types):
+        for model_type in model_types:
+            try:
+                new_model = self.build_fn(model_type)
+            except Exception as e:
+                with self._lock:
+                    self.state = 'failed'
+                    self.error = '{}: {}'.format(type(e).__name__, e)
+                    self.seconds = time.time() - self.started
+                return
+            with self._lock:
+                old_model = self.models[model_type]
+                if self.model is old_model:
+                    self.model = new_model
+                self.models[model_type] = new_model
+            # the cached results of the replaced model are stale
+            old_model.invalidate_caches()
+        with self._lock:
+            self.state = 'ready'
+            self.seconds = time.time() - self.started
+
+    def status(self):
+        """Returns the loading state, the model type being (or last) loaded,
+        the load time (seconds, elapsed so far while loading) and the error of
+        a failed load."""
+        seconds = self.seconds
+        if self.state == 'loading':
+            seconds = time.time() - self.started
+        return {
+            'state': self.state,
+            'model_type': self.model_type,
+            'seconds': None if seconds is None else round(seconds, 3),
+            'error': self.error
+        }
@@ -0,0 +1,80 @@
+import os
+import gc
+import signal
+
+from werkzeug.serving import make_server
+
+## Error Strings
+workers_error = '"workers" must be a positive integer.'
+fork_error = 'Pre-fork serving requires os.fork (POSIX only).'
+
+
+def serve_prefork(app, host='127.0.0.1', port=5000, workers=2):
+    """Serves the app from `workers` forked worker processes sharing a single
+    listening socket.
+
+    Everything loaded in the master process before calling this function
+    (models, memory-mapped indices & metadata) is shared copy-on-write by the
+    workers. The garbage collector is frozen before forking (Python >= 3.7) so
+    that collections in the workers do not touch, and thus copy, the pages of
+    the shared objects. Workers that exit unexpectedly are replaced.
+
+    Args:
+        app: The WSGI application.
+        host: The interface the server binds to.
+        port: The port the server binds to.
+        workers: The number of worker processes.
+    """
+    if not isinstance(workers, int) or workers < 1:
+        raise ValueError(workers_error)
+    if not hasattr(os, 'fork'):
+        raise RuntimeError(fork_error)
+
+    # bind once in the master, every worker accepts on the same socket
+    server = make_server(host, port, app, threaded=True)
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        return pid
+
+    pids = set(spawn() for _ in range(workers))
+    print('Serving on http://{}:{} with {} workers (pids: {})'.format(
+        host, port, workers, ', '.join(str(pid) for pid in sorted(pids))))
+
+    stopping = []
+
+    def stop(signum=None, frame=None):
+        stopping.append(True)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while pids:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            pids.discard(pid)
+            if not stopping:
+                print('Worker {} exited, restarting.'.format(pid))
+                pids.add(spawn())
+    except KeyboardInterrupt:
+        stop()
+        for pid in list(pids):
+            os.waitpid(pid, 0)
+    finally:
+        server.server_close()
@@ -1,29 +1,19 @@
 import os
 import json
 import time
+from concurrent.futures import TimeoutError
 
 from wordvec_models.fasttext_model import FastTextSearch
 from wordvec_models.tfidf_model import TfIdfSearch
 from wordvec_models.hybrid_model import HybridSearch
+from wordvec_models.registry import ARTIFACTS
 
 from web_app import app
+from web_app.model_loader import ModelLoader
+from web_app.executors import BoundedExecutor, OverloadedError
+from web_app.snippets import SnippetRenderer, snippet_pre
 from flask import render_template, request, jsonify, make_response, Markup
-
-from bs4 import BeautifulSoup
-
-import pyastyle
-from pygments import highlight
-from pygments.lexers import JavaLexer
-from pygments.formatters import HtmlFormatter
-
-## Script directory
-POST_HEADER = """
-/** 
- * StackOverflow Post {}
- * Answer {}
- * Answer Score: {}
- */
- """
+from flask import Response, stream_with_context
 
 ## Default Index Keys
 # Valid keys depend on the index_builder output
@@ -32,41 +22,58 @@ index_keys = ['BodyV', 'TitleV']
 
 ## PATHS
 FT_MODEL = "wordvec_models/fasttext_archive/ft_v0.6.1.bin"
-FT_INDEX = "wordvec_models/index/ft_v0.6.1_post_index.pkl"
+FT_INDEX = "wordvec_models/index/ft_v0.6.1_post_index"
 TFIDF_MODEL = "wordvec_models/tfidf_archive/tfidf_v0.3.pkl"
-TFIDF_INDEX = "wordvec_models/index/tfidf_v0.3_post_index.pkl"
-METADATA = "wordvec_models/index/extended_metadata.pkl"
-
-## GLOBALS
-model = None
-
-
-def format_snippets(df):
+TFIDF_INDEX = "wordvec_models/index/tfidf_v0.3_post_index"
+METADATA = "wordvec_models/index/metadata"
+# optional pre-rendered snippets (see snippets.py)
+SNIPPET_STORE = "wordvec_models/index/snippets.db"
+
+## Model types
+MODEL_TYPES = ['fasttext', 'tf-idf', 'hybrid']
+
+## Executors
+# scoring (vector inference & index scoring) and snippet formatting run on
+# separate bounded thread pools, requests exceeding SEARCH_TIMEOUT (seconds)
+# or MAX_PENDING queued searches are rejected
+SCORING_WORKERS = 4
+FORMATTING_WORKERS = 2
+MAX_PENDING = 32
+SEARCH_TIMEOUT = 10
+
+## Model refresh
+# seconds between two checks for new or compacted index segments
+REFRESH_INTERVAL = 60
+
+## Error Strings
+model_type_error = 'Unknown model type "{}".'
+no_model_error = 'No model loaded.'
+timeout_error = 'Search timed out after {} seconds.'
+query_error = 'A "query" string is required.'
+num_results_error = '"num_results" must be a positive integer.'
+
+## JSON API
+# maximum number of results returned by /api/search
+MAX_API_RESULTS = 100
+
+scoring_pool = BoundedExecutor('scoring', SCORING_WORKERS, MAX_PENDING)
+formatting_pool = BoundedExecutor('formatting', FORMATTING_WORKERS,
+                                  MAX_PENDING)
+# rendered snippets cache (per answer)
+renderer = SnippetRenderer(SNIPPET_STORE)
+
+
+def format_snippets(results):
     snippets = []
-    for ii, row in enumerate(df.iterrows()):
-        header = POST_HEADER.format(row[1].Link, row[1].sdict["anslink"],
-                                    row[1].sdict["score"])
-        s = format_code(header + row[1].sdict["snippet"])
-        soup = BeautifulSoup(s, 'lxml')
-        pre = soup.find('pre')
-        if ii == 0:
-            pre['id'] = 'cs1'
-            pre['class'] = 'code-snippet active-cs'
-        else:
-            pre['id'] = 'cs' + str(ii + 1)
-            pre['class'] = 'code-snippet'
-        snippets.append(Markup(pre))
+    for ii, result in enumerate(results):
+        sdict = result.sdict
+        html = renderer.render(result.link, sdict["anslink"], sdict["score"],
+                               sdict["snippet"])
+        snippets.append(Markup(snippet_pre(html, ii)))
 
     return snippets
 
 
-def format_code(text):
-    fcode = pyastyle.format(text, "--style=java --delete-empty-lines")
-    html_string = highlight(fcode, JavaLexer(),
-                            HtmlFormatter(style='friendly'))
-    return html_string
-
-
 @app.route('/', methods=['GET', 'POST'])
 @app.route('/index', methods=['GET', 'POST'])
 def index():
@@ -75,44 +82,87 @@ def index():
 
 @app.route('/check_status', methods=['GET'])
 def check_status():
-    global model
+    loader.poll()
+    model = loader.model
     model_name = model.name if model else "No"
     model_select = model.name if model else "hybrid"
-    return jsonify(model=model_name, model_select=model_select)
+    cache = model.result_cache.stats() if model else None
+    return jsonify(model=model_name,
+                   model_select=model_select,
+                   cache=cache,
+                   loading=loader.status(),
+                   artifacts=ARTIFACTS.status(),
+                   executors={
+                       'scoring': scoring_pool.stats(),
+                       'formatting': formatting_pool.stats()
+                   })
+
+
+def build_model(model_type):
+    """Builds a search model. The models, indices and metadata are loaded once
+    per process (see registry.py) and shared by every model type."""
+    if model_type == 'fasttext':
+        return FastTextSearch(model_path=FT_MODEL,
+                              index_path=FT_INDEX,
+                              index_keys=index_keys,
+                              metadata_path=METADATA)
+    elif model_type == 'tf-idf':
+        return TfIdfSearch(model_path=TFIDF_MODEL,
+                           index_path=TFIDF_INDEX,
+                           index_keys=index_keys,
+                           metadata_path=METADATA)
+    elif model_type == 'hybrid':
+        return HybridSearch(ft_model_path=FT_MODEL,
+                            ft_index_path=FT_INDEX,
+                            tfidf_model_path=TFIDF_MODEL,
+                            tfidf_index_path=TFIDF_INDEX,
+                            index_keys=index_keys,
+                            metadata_path=METADATA)
+    raise ValueError(model_type_error.format(model_type))
+
+
+# loads models in the background, serving the previous one meanwhile, and
+# rebuilds them once their index segments change (e.g. a compaction)
+loader = ModelLoader(build_model, REFRESH_INTERVAL)
+ARTIFACTS.add_evict_listener(lambda path: loader.refresh())
 
 
 @app.route('/load_model', methods=['GET'])
 def load_model():
-    global model
     model_type = request.args.get('model_type', 'hybrid', type=str)
-    if model_type == 'fasttext':
-        model = FastTextSearch(model_path=FT_MODEL,
-                               index_path=FT_INDEX,
-                               index_keys=index_keys,
-                               metadata_path=METADATA)
-    elif model_type == 'tf-idf':
-        model = TfIdfSearch(model_path=TFIDF_MODEL,
-                            index_path=TFIDF_INDEX,
-                            index_keys=index_keys,
-                            metadata_path=METADATA)
-    elif model_type == 'hybrid':
-        model = HybridSearch(ft_model_path=FT_MODEL,
-                             ft_index_path=FT_INDEX,
-                             tfidf_model_path=TFIDF_MODEL,
-                             tfidf_index_path=TFIDF_INDEX,
-                             index_keys=index_keys,
-                             metadata_path=METADATA)
-    return jsonify(success=True, model=model_type)
+    if model_type not in MODEL_TYPES:
+        return jsonify(success=False,
+                       model=model_type,
+                       error=model_type_error.format(model_type))
+    error = loader.load(model_type)
+    return jsonify(success=error is None,
+                   model=model_type,
+                   error=error,
+                   loading=loader.status())
 
 
 @app.route('/search', methods=['POST'])
 def search():
-    global model
+    loader.poll()
+    # the model in use when the request started, unaffected by model swaps
+    model = loader.model
+    if model is None:
+        return make_response(jsonify(error=no_model_error), 503)
     json_data = request.get_json(force=True)
-    mt_df, top_tags = model.search(query=json_data['query'],
-                                   tags=json_data['tags'],
-                                   num_results=10)
-    snippets_html = format_snippets(mt_df)
+    deadline = time.time() + SEARCH_TIMEOUT
+    try:
+        results, top_tags = scoring_pool.run(deadline,
+                                             model.search,
+                                             query=json_data['query'],
+                                             tags=json_data['tags'],
+                                             num_results=10,
+                                             as_frame=False)
+        snippets_html = formatting_pool.run(deadline, format_snippets, results)
+    except OverloadedError as e:
+        return make_response(jsonify(error=str(e)), 503)
+    except TimeoutError:
+        return make_response(
+            jsonify(error=timeout_error.format(SEARCH_TIMEOUT)), 504)
     pagination = list(range(2, len(snippets_html) + 1))
     return jsonify({
         'data':
@@ -121,3 +171,46 @@ def search():
                         tags=top_tags,
                         pagination=pagination)
     })
+
+
+@app.route('/api/search', methods=['POST'])
+def api_search():
+    """JSON search API. Expects {"query": str, "tags": [str] (optional),
+    "num_results": int (optional)} and streams {"tags": [...], "results": [...]}
+    with one object per result (see `SearchResult.to_dict`)."""
+    loader.poll()
+    model = loader.model
+    if model is None:
+        return make_response(jsonify(error=no_model_error), 503)
+    json_data = request.get_json(force=True, silent=True) or {}
+    query = json_data.get('query')
+    if not isinstance(query, str):
+        return make_response(jsonify(error=query_error), 400)
+    num_results = json_data.get('num_results', 10)
+    if not isinstance(num_results, int) or num_results < 1:
+        return make_response(jsonify(error=num_results_error), 400)
+    num_results = min(num_results, MAX_API_RESULTS)
+    deadline = time.time() + SEARCH_TIMEOUT
+    try:
+        results, top_tags = scoring_pool.run(deadline,
+                                             model.search,
+                                             query=query,
+                                             tags=json_data.get('tags') or None,
+                                             num_results=num_results,
+                                             as_frame=False)
+    except OverloadedError as e:
+        return make_response(jsonify(error=str(e)), 503)
+    except TimeoutError:
+        return make_response(
+            jsonify(error=timeout_error.format(SEARCH_TIMEOUT)), 504)
+    except (TypeError, ValueError) as e:
+        return make_response(jsonify(error=str(e)), 400)
+
+    def generate():
+        yield '{"tags": ' + json.dumps(top_tags) + ', "results": ['
+        for ii, result in enumerate(results):
+            yield (', ' if ii else '') + json.dumps(result.to_dict())
+        yield ']}'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
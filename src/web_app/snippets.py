@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""Rendered code snippet cache.
+
+The highlighted HTML of an answer snippet only depends on the answer, its
+score (shown in the post header) and the snippet, so it is rendered once
+(astyle formatting + Pygments highlighting) and cached by these in memory
+(LRU) and, optionally, in an on-disk SQLite store that can be filled offline
+for the whole index:
+
+    python -m web_app.snippets wordvec_models/index/metadata \\
+        wordvec_models/index/snippets.db
+"""
+
+import os
+import re
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+import pyastyle
+from pygments import highlight
+from pygments.lexers import JavaLexer
+from pygments.formatters import HtmlFormatter
+
+from wordvec_models.cache import LRUCache
+from wordvec_models.search_model import base_url
+from wordvec_models.metadata_store import MetadataStore
+from wordvec_models.segments import index_dir, segment_snapshot
+
+POST_HEADER = """
+/** 
+ * StackOverflow Post {}
+ * Answer {}
+ * Answer Score: {}
+ */
+ """
+
+SNIPPET_PRE = '<pre class="{}" id="{}">{}</pre>'
+
+# number of rendered snippets kept in memory
+SNIPPET_CACHE_SIZE = 4096
+# number of rendered snippets written per store transaction
+STORE_BATCH_SIZE = 1000
+
+# content of the <pre> element of the Pygments HTML output
+_pre_content = re.compile(r'<pre[^>]*>(.*)</pre>', re.S)
+
+
+def format_code(text):
+    fcode = pyastyle.format(text, "--style=java --delete-empty-lines")
+    html_string = highlight(fcode, JavaLexer(),
+                            HtmlFormatter(style='friendly'))
+    return html_string
+
+
+def render_snippet(link, anslink, score, snippet):
+    """Formats and highlights an answer snippet (with its post header).
+
+    Returns:
+        The highlighted HTML content of the snippet <pre> element.
+    """
+    header = POST_HEADER.format(link, anslink, score)
+    return _pre_content.search(format_code(header + snippet)).group(1)
+
+
+def snippet_key(link, anslink, score, snippet):
+    """Returns the cache key of a rendered snippet: the answer link (post link
+    for posts without an answer), the answer score and the snippet hash."""
+    link = link if anslink.endswith('/-1') else anslink
+    digest = hashlib.sha1(snippet.encode('utf-8')).hexdigest()
+    return '{} {} {}'.format(link, score, digest)
+
+
+def snippet_pre(html, ii):
+    """Wraps rendered snippet HTML in the <pre> element of the ii-th result
+    (the first one is the active snippet)."""
+    css_class = 'code-snippet active-cs' if ii == 0 else 'code-snippet'
+    return SNIPPET_PRE.format(css_class, 'cs' + str(ii + 1), html)
+
+
+class SnippetStore:
+    """On-disk (SQLite) store of rendered snippets (see `snippet_key`).
+    Connections are opened per thread and process."""
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute('CREATE TABLE IF NOT EXISTS snippets '
+                             '(key TEXT PRIMARY KEY, html TEXT)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute('SELECT html FROM snippets WHERE key = ?',
+                                   (key, )).fetchone()
+        return None if row is None else row[0]
+
+    def put_many(self, items):
+        conn = self._conn()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO snippets VALUES (?, ?)',
+                             items)
+
+    def __len__(self):
+        return self._conn().execute(
+            'SELECT COUNT(*) FROM snippets').fetchone()[0]
+
+
+class SnippetRenderer:
+    """Renders answer snippets through an in-memory LRU cache and an optional
+    (read-only) SnippetStore."""
+    def __init__(self, store_path=None, cache_size=SNIPPET_CACHE_SIZE):
+        self.cache = LRUCache(cache_size)
+        self.store = None
+        if store_path and os.path.isfile(store_path):
+            self.store = SnippetStore(store_path)
+
+    def render(self, link, anslink, score, snippet):
+        """Returns the rendered snippet HTML of an answer (see
+        `snippet_key`)."""
+        key = snippet_key(link, anslink, score, snippet)
+        html = self.cache.get(key)
+        if html is None:
+            html = self.store.get(key) if self.store else None
+            if html is None:
+                html = render_snippet(link, anslink, score, snippet)
+            self.cache.put(key, html)
+        return html
+
+
+def prerender(metadata_path, store_path):
+    """Renders the snippets of every post of a metadata store to a snippet
+    store.
+
+    Args:
+        metadata_path: The metadata store directory (replaced by its compacted
+                       version, see segments.py).
+        store_path: The SQLite snippet store path.
+    """
+    metadata_path = segment_snapshot(
+        index_dir(metadata_path)).store_path(metadata_path)
+    metadata = MetadataStore.load(metadata_path)
+    store = SnippetStore(store_path)
+    batch = []
+    for ii in range(len(metadata)):
+        link = base_url + str(metadata.post_ids[ii])
+        anslink = base_url + str(metadata.answer_ids[ii])
+        score = int(metadata.answer_scores[ii])
+        snippet = metadata.snippets[ii]
+        batch.append((snippet_key(link, anslink, score, snippet),
+                      render_snippet(link, anslink, score, snippet)))
+        if len(batch) == STORE_BATCH_SIZE:
+            store.put_many(batch)
+            batch = []
+            print('\rrendered {}/{}'.format(ii + 1, len(metadata)), end='')
+    store.put_many(batch)
+    print('\nsnippet store saved in', os.path.realpath(store_path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Pre-render the code snippets of a metadata store.')
+    parser.add_argument('metadata_path',
+                        metavar='METADATA',
+                        help='Path to the metadata store.')
+    parser.add_argument('store_path',
+                        metavar='STORE',
+                        help='Path to the SQLite snippet store.')
+    args = parser.parse_args()
+    prerender(args.metadata_path, args.store_path)
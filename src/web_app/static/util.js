@@ -202,20 +202,44 @@ $(function () {
         $this.html("<i class='fa fa-spinner fa-fw fa-spin'></i>");
         $this.prop("disabled", true);
         $modelSelect.prop("disabled", true);
-        $.getJSON("/load_model", {
-            model_type: $("#model-select option:selected").text()
-        }, function (response) {
-            if (response["success"]) {
-                console.log("Model in memory: " + response["model"]);
+        function loadDone(success, modelName, error) {
+            if (success) {
+                console.log("Model in memory: " + modelName);
                 $searchFormInputs.prop("disabled", false);
-                $("#model-info").text(response["model"] + " model in use...");
+                $("#model-info").text(modelName + " model in use...");
             } else {
-                console.log(response["error"]);
+                console.log(error);
                 $("#model-info").text("Error loading model!");
             }
             $this.html("Load");
             $this.prop("disabled", false);
             $modelSelect.prop("disabled", false);
+        }
+
+        // models are loaded in the background, poll the backend status
+        // until the model is ready (the previous model keeps serving searches)
+        function pollStatus() {
+            $.getJSON("/check_status", function (response) {
+                var loading = response["loading"];
+                if (loading["state"] === "loading") {
+                    $("#model-info").text("Loading " + loading["model_type"] +
+                        " model (" + Math.round(loading["seconds"]) + "s)...");
+                    setTimeout(pollStatus, 1000);
+                } else {
+                    loadDone(loading["state"] === "ready", response["model"],
+                        loading["error"]);
+                }
+            });
+        }
+
+        $.getJSON("/load_model", {
+            model_type: $("#model-select option:selected").text()
+        }, function (response) {
+            if (response["success"]) {
+                pollStatus();
+            } else {
+                loadDone(false, response["model"], response["error"]);
+            }
         });
     });
 });
\ No newline at end of file
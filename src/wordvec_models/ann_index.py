@@ -0,0 +1,202 @@
+import os
+import time
+
+import numpy as np
+from scipy import sparse
+
+from wordvec_models.field_index import ROW_BATCH_SIZE, l2_normalize, top_k
+
+## Error Strings
+ann_fields_error = 'ANN index fields {} do not match the search index fields {}.'
+
+# default number of k-means iterations used to train the coarse quantizer
+KMEANS_ITER = 10
+# number of training points sampled per inverted list
+TRAIN_POINTS_PER_LIST = 64
+
+
+def ann_index_path(index_path):
+    """Returns the path of the ANN index built next to the given search index
+    (index store or pickle), e.g. ft_v0.6.1_post_index(.pkl) ->
+    ft_v0.6.1_ivf_index.npz"""
+    base = os.path.normpath(index_path)
+    # only strip a real extension, versions contain dots (ft_v0.6.1)
+    if base.endswith('.pkl'):
+        base = base[:-len('.pkl')]
+    if base.endswith('_post_index'):
+        base = base[:-len('_post_index')]
+    return base + '_ivf_index.npz'
+
+
+class IVFIndex:
+    """Inverted file (IVF-flat) approximate nearest neighbour index for dense
+    (fastText, GloVe) search indices.
+
+    The fused index rows are clustered with spherical k-means. Each row is
+    assigned to the inverted list of its closest centroid, and the row ids of
+    every list are stored contiguously in CSR form. At query time only the rows
+    of the `nprobe` lists whose centroids are closest to the query are scored
+    exactly, which trades recall for latency (higher `nprobe` -> higher recall).
+    """
+    def __init__(self, fields, centroids, indptr, rows):
+        self.fields = list(fields)
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.nlist = self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, field_index, nlist=None, n_iter=KMEANS_ITER, seed=0):
+        """Trains the coarse quantizer on a sample of the fused index rows and
+        assigns every row to an inverted list.
+
+        Args:
+            field_index: The FieldIndex (dense) the ANN index is built for.
+            nlist: The number of inverted lists, defaults to 4*sqrt(N).
+            n_iter: The number of k-means iterations.
+            seed: The random seed used for sampling and initialization.
+
+        Returns:
+            An IVFIndex instance.
+        """
+        matrix = field_index.matrix
+        num_rows = matrix.shape[0]
+        if nlist is None:
+            nlist = int(4 * np.sqrt(num_rows))
+        nlist = max(1, min(nlist, num_rows))
+        rng = np.random.RandomState(seed)
+        sample_size = min(num_rows, nlist * TRAIN_POINTS_PER_LIST)
+        sample = np.sort(rng.choice(num_rows, sample_size, replace=False))
+        centroids = _kmeans(l2_normalize(matrix[sample]), nlist, n_iter, rng)
+
+        assignment = _assign(matrix, centroids)
+        rows = np.argsort(assignment, kind='mergesort').astype(np.int32)
+        indptr = np.zeros(nlist + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(assignment, minlength=nlist))
+        return cls(field_index.fields, centroids, indptr, rows)
+
+    @classmethod
+    def load(cls, filepath):
+        """Loads an IVF index saved with `IVFIndex.save`."""
+        with np.load(filepath) as arrays:
+            return cls(arrays['fields'].tolist(), arrays['centroids'],
+                       arrays['indptr'], arrays['rows'])
+
+    def save(self, filepath):
+        """Saves the IVF index arrays in a single .npz file."""
+        np.savez(filepath,
+                 fields=np.array(self.fields, dtype=str),
+                 centroids=self.centroids,
+                 indptr=self.indptr,
+                 rows=self.rows)
+
+    def check_fields(self, fields):
+        """Raises a ValueError if the ANN index was built for different index
+        fields than the given ones."""
+        if list(fields) != self.fields:
+            raise ValueError(ann_fields_error.format(self.fields, fields))
+
+    def candidates(self, fused_query, nprobe):
+        """Returns the rows of the `nprobe` inverted lists closest to the given
+        fused query vector."""
+        nprobe = max(1, min(nprobe, self.nlist))
+        centroid_sims = self.centroids.dot(fused_query)
+        probe = top_k(centroid_sims, nprobe)
+        return np.concatenate(
+            [self.rows[self.indptr[c]:self.indptr[c + 1]] for c in probe])
+
+    def search(self, matrix, fused_query, k, nprobe):
+        """Approximate top-k search over the fused index matrix.
+
+        Args:
+            matrix: The fused index matrix the ANN index was built for.
+            fused_query: The fused query vector (see `FieldIndex.query_vector`).
+            k: The number of indices returned.
+            nprobe: The number of inverted lists scored.
+
+        Returns:
+            The top `k` row indices in descending similarity order and their
+            similarity values.
+        """
+        rows = self.candidates(fused_query, nprobe)
+        sims = np.asarray(matrix[rows].dot(fused_query)).reshape(-1)
+        order = top_k(sims, k)
+        return rows[order], sims[order]
+
+
+def _assign(matrix, centroids, batch_size=ROW_BATCH_SIZE):
+    """Assigns every row of the matrix to its closest (max inner product)
+    centroid, in batches."""
+    assignment = np.zeros(matrix.shape[0], dtype=np.int64)
+    for start in range(0, matrix.shape[0], batch_size):
+        batch = np.asarray(matrix[start:(start + batch_size)])
+        assignment[start:(start + len(batch))] = np.argmax(
+            batch.dot(centroids.T), axis=1)
+    return assignment
+
+
+def _kmeans(data, n_clusters, n_iter, rng):
+    """Spherical k-means on row-normalized data. Empty clusters are re-seeded
+    with random data points."""
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)]
+    for _ in range(n_iter):
+        assignment = _assign(data, centroids)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        # cluster sums as a (one-hot assignment x data) sparse product
+        one_hot = sparse.csr_matrix(
+            (np.ones(len(data), dtype=np.float32),
+             (assignment, np.arange(len(data)))),
+            shape=(n_clusters, len(data)))
+        sums = np.asarray(one_hot.dot(data))
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = data[rng.choice(len(data), len(empty))]
+        centroids = l2_normalize(sums)
+    return centroids
+
+
+def recall_report(field_index,
+                  query_vecs,
+                  k=10,
+                  nprobes=(1, 2, 4, 8, 16, 32, 64),
+                  field_weights=None):
+    """Measures the recall@k and the average query latency of the ANN index
+    of the given FieldIndex against the exact (brute force) scorer.
+
+    Args:
+        field_index: A dense FieldIndex with an attached ANN index.
+        query_vecs: A numpy matrix of query vectors (one per row).
+        k: The number of results compared for each query.
+        nprobes: The `nprobe` values evaluated.
+        field_weights: Field weights used to build the fused query vectors.
+
+    Returns:
+        A dictionary containing the exact search latency and, for each nprobe,
+        the mean recall@k and the average latency (ms).
+    """
+    start = time.time()
+    exact = [
+        set(field_index.top_k(q.reshape(1, -1), k, field_weights)[0])
+        for q in query_vecs
+    ]
+    report = {
+        'k': k,
+        'num_queries': len(query_vecs),
+        'exact_ms': 1000 * (time.time() - start) / len(query_vecs),
+        'nprobe': {}
+    }
+    for nprobe in nprobes:
+        start = time.time()
+        results = [
+            field_index.top_k(q.reshape(1, -1), k, field_weights,
+                              nprobe=nprobe)[0] for q in query_vecs
+        ]
+        latency = 1000 * (time.time() - start) / len(query_vecs)
+        recall = np.mean([
+            len(exact[ii].intersection(res)) / len(exact[ii])
+            for ii, res in enumerate(results)
+        ])
+        report['nprobe'][nprobe] = {
+            'recall@{}'.format(k): float(recall),
+            'latency_ms': latency
+        }
+    return report
@@ -0,0 +1,121 @@
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy import sparse
+
+## Error Strings
+size_error = 'Cache "max_size" must be a positive integer.'
+ttl_error = 'Cache "ttl" must be a positive number of seconds or None.'
+bytes_error = 'Cache "max_bytes" requires a "sizeof" function.'
+
+
+def vector_nbytes(value):
+    """Returns the memory footprint (bytes) of a numpy array, a sparse matrix
+    or a dictionary of those (e.g. an `infer_vector` result)."""
+    if isinstance(value, dict):
+        return sum(vector_nbytes(v) for v in value.values())
+    if sparse.issparse(value):
+        value = sparse.csr_matrix(value)
+        return (value.data.nbytes + value.indices.nbytes +
+                value.indptr.nbytes)
+    return np.asarray(value).nbytes
+
+
+class LRUCache:
+    """Thread-safe least recently used cache with an optional time to live
+    and memory budget.
+
+    Entries are evicted when the cache exceeds `max_size` entries or, if a
+    `sizeof` function is given, `max_bytes` bytes (least recently used first),
+    and when they are older than `ttl` seconds. Hits and misses are counted
+    for monitoring.
+    """
+    def __init__(self, max_size=1024, ttl=None, max_bytes=None, sizeof=None):
+        if not isinstance(max_size, int) or max_size <= 0:
+            raise ValueError(size_error)
+        if ttl is not None and ttl <= 0:
+            raise ValueError(ttl_error)
+        if max_bytes is not None and sizeof is None:
+            raise ValueError(bytes_error)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def _lookup(self, key):
+        # returns the (timestamp, value, nbytes) entry of a live key, drops
+        # expired ones
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+            self._remove(key)
+            return None
+        return entry
+
+    def _remove(self, key):
+        self.nbytes -= self._entries.pop(key)[2]
+
+    def _full(self):
+        return (len(self._entries) > self.max_size
+                or (self.max_bytes is not None and self.nbytes > self.max_bytes))
+
+    def get(self, key, default=None):
+        """Returns the cached value of the given key (marked as most recently
+        used), or `default` on a miss."""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Caches a value, evicting the least recently used entries if the
+        cache is full. Values larger than the memory budget are not cached."""
+        nbytes = self.sizeof(value) if self.sizeof else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                return
+            self._entries[key] = (time.monotonic(), value, nbytes)
+            self.nbytes += nbytes
+            while self._full():
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        """Invalidates every cached entry. The hit/miss counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """Returns the cache size, capacity and hit/miss counters."""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'nbytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
@@ -1,23 +1,43 @@
 import os
+from multiprocessing import Pool
 
 import numpy as np
 import pandas as pd
 from fasttext import load_model
 
 from wordvec_models.search_model import BaseSearchModel
+from wordvec_models.registry import artifact_key
+from wordvec_models.utils import bounded_imap, iter_chunks
 
 ## Vector building error strings
 doc_path_error = 'Provided document path doesn\'t exist.'
 doc_type_error = 'Invalid "doc" variable type {}. Expected str(path) or list.'
+mmap_path_error = 'An export path is required to memory-map the doc vectors.'
+workers_model_error = 'A model path is required when num_workers > 1.'
 
+# number of lines per doc vector building chunk
+CHUNK_SIZE = 10000
+# number of chunks in flight per worker process
+PENDING_CHUNKS = 2
+
+# fastText model of a doc vector building worker process
+_worker_model = None
 
-class FastTextSearch(BaseSearchModel):
-    def __init__(self, model_path, index_path, index_keys, metadata_path):
 
-        self.model = load_model(model_path)
+class FastTextSearch(BaseSearchModel):
+    def __init__(self,
+                 model_path,
+                 index_path,
+                 index_keys,
+                 metadata_path,
+                 registry=None):
+        self._set_registry(registry)
+        self.model = self.registry.get(artifact_key('fasttext', model_path),
+                                       lambda: load_model(model_path))
         print('fastText model: {} \u2713'.format(
             os.path.basename(model_path)))
-        super().__init__(index_path, index_keys, metadata_path, 'fasttext')
+        super().__init__(index_path, index_keys, metadata_path, 'fasttext',
+                         registry)
 
     def infer_vector(self, text):
         return {
@@ -26,54 +46,172 @@ class FastTextSearch(BaseSearchModel):
                 1, -1)
         }
 
-    def cli_search(self, num_results=10, field_weights=None, postid_fn=None):
+    def infer_vectors(self, texts):
+        return {
+            'query_vecs':
+            np.vstack([
+                self.model.get_sentence_vector(text.lower().strip())
+                for text in texts
+            ])
+        }
+
+    def cli_search(self,
+                   num_results=10,
+                   field_weights=None,
+                   postid_fn=None,
+                   nprobe=None):
         super().cli_search(num_results=num_results,
                            field_weights=field_weights,
                            ranking_fn=self.ranking,
-                           postid_fn=postid_fn)
+                           postid_fn=postid_fn,
+                           nprobe=nprobe)
 
     def search(self,
                query,
                tags=None,
                num_results=10,
                field_weights=None,
-               postid_fn=None):
+               postid_fn=None,
+               nprobe=None,
+               as_frame=True):
         return super().search(query=query,
                               tags=tags,
                               num_results=num_results,
                               field_weights=field_weights,
                               ranking_fn=self.ranking,
-                              postid_fn=postid_fn)
+                              postid_fn=postid_fn,
+                              nprobe=nprobe,
+                              as_frame=as_frame)
+
+    def search_batch(self,
+                     queries,
+                     tags_list=None,
+                     num_results=10,
+                     field_weights=None,
+                     as_frame=True):
+        return super().search_batch(queries=queries,
+                                    tags_list=tags_list,
+                                    num_results=num_results,
+                                    field_weights=field_weights,
+                                    ranking_fn=self.batch_ranking,
+                                    as_frame=as_frame)
+
+
+def _worker_init(model_path):
+    """Process pool initializer, loads the fastText model once per worker."""
+    global _worker_model
+    _worker_model = load_model(model_path)
+
+
+def _worker_vectors(lines):
+    return chunk_vectors(_worker_model, lines)
+
+
+def _worker_dimension():
+    return _worker_model.get_dimension()
+
+
+def chunk_vectors(model, lines):
+    """Returns the float32 sentence vector matrix of a chunk of lines."""
+    vectors = np.empty((len(lines), model.get_dimension()), dtype=np.float32)
+    for idx, line in enumerate(lines):
+        vectors[idx] = model.get_sentence_vector(str(line.strip()))
+    return vectors
 
 
-def build_doc_vectors(model, doc, export_path=None):
+def build_doc_vectors(model,
+                      doc,
+                      export_path=None,
+                      chunk_size=CHUNK_SIZE,
+                      num_workers=1,
+                      mmap=False):
     """Expected input is a preprocessed document.
     Calculates sentence vectors using the built-in fastText function which
     averages the word-vector norms of all the words in the given sentence.
-    """
-    def calc_vectors(doc, vector_matrix):
-        for idx, line in enumerate(doc):
-            print('\rcalculating vector for line #', idx, end='')
-            vector_matrix.append(model.get_sentence_vector(str(line.strip())))
-        print()
 
-    vector_matrix = []
-    if isinstance(model, str):
-        model = load_model(model)
+    The document is streamed in chunks of `chunk_size` lines and the vectors
+    of each chunk are written straight into a preallocated float32 matrix.
+    With `num_workers` > 1 the chunks are computed by a process pool, where
+    every worker loads the model once, with at most PENDING_CHUNKS chunks in
+    flight per worker.
+
+    Args:
+        model: A fastText model or the path to one (a path is required when
+               `num_workers` > 1).
+        doc: The path to a document (one text per line) or a list of texts.
+        export_path: The .npy file the vectors are saved in (optional).
+        chunk_size: The number of lines per chunk.
+        num_workers: The number of worker processes.
+        mmap: Write the vectors into a memory-mapped `export_path` instead of
+              keeping the whole matrix in memory.
+
+    Returns:
+        The (num_lines x dim) float32 doc vector matrix.
+    """
     if isinstance(doc, str):
-        if os.path.exists(doc):
-            with open(doc, 'r') as doc_file:
-                calc_vectors(doc_file, vector_matrix)
-        else:
+        if not os.path.exists(doc):
             raise ValueError(doc_path_error)
+        with open(doc, 'r') as doc_file:
+            num_lines = sum(1 for _ in doc_file)
     elif isinstance(doc, list):
-        calc_vectors(doc, vector_matrix)
+        num_lines = len(doc)
     else:
         raise TypeError(doc_type_error.format(type(doc)))
-    vector_matrix = np.array(vector_matrix)
+    if mmap and not export_path:
+        raise ValueError(mmap_path_error)
+    if num_workers > 1 and not isinstance(model, str):
+        raise ValueError(workers_model_error)
+    if num_workers == 1 and isinstance(model, str):
+        model = load_model(model)
+
+    def allocate(dim):
+        if mmap:
+            return np.lib.format.open_memmap(npy_path,
+                                             mode='w+',
+                                             dtype=np.float32,
+                                             shape=(num_lines, dim))
+        return np.empty((num_lines, dim), dtype=np.float32)
+
+    def fill(vector_matrix, chunks):
+        start = 0
+        for vectors in chunks:
+            vector_matrix[start:start + len(vectors)] = vectors
+            start += len(vectors)
+            print('\rcalculated vectors for {}/{} lines'.format(
+                start, num_lines),
+                  end='')
+        print()
+        return vector_matrix
+
+    npy_path = export_path
+    if export_path and not export_path.endswith('.npy'):
+        npy_path = export_path + '.npy'
+    doc_file = open(doc, 'r') if isinstance(doc, str) else None
+    try:
+        chunks = iter_chunks(doc_file or doc, chunk_size)
+        if num_workers > 1:
+            with Pool(num_workers,
+                      initializer=_worker_init,
+                      initargs=(model, )) as pool:
+                # the model is only loaded by the workers
+                vector_matrix = fill(
+                    allocate(pool.apply(_worker_dimension)),
+                    bounded_imap(pool, _worker_vectors, chunks,
+                                 num_workers * PENDING_CHUNKS))
+        else:
+            vector_matrix = fill(allocate(model.get_dimension()),
+                                 (chunk_vectors(model, chunk)
+                                  for chunk in chunks))
+    finally:
+        if doc_file is not None:
+            doc_file.close()
+
     if export_path:
-        np.save(export_path, vector_matrix)
-        print('\nfasttext doc vectors saved in', os.path.realpath(export_path))
+        if mmap:
+            vector_matrix.flush()
+        else:
+            np.save(npy_path, vector_matrix)
+        print('fasttext doc vectors saved in', os.path.realpath(npy_path))
     return vector_matrix
 
 
@@ -0,0 +1,500 @@
+import numpy as np
+from scipy import sparse
+
+## Error Strings
+empty_index_error = 'At least one index matrix is required.'
+rows_mismatch_error = 'Index matrices must have the same number of rows.'
+mixed_types_error = 'Index matrices must be either all dense or all sparse.'
+
+# number of index rows gathered at once when scoring a subset of the index
+ROW_BATCH_SIZE = 16384
+# subsets larger than this fraction of the index are scored with a full pass
+SUBSET_RATIO = 0.5
+# number of queries scored at once by the batched (matrix-matrix) scorer, the
+# batch similarity matrix holds QUERY_BATCH_SIZE x N float32 values
+QUERY_BATCH_SIZE = 32
+
+
+def top_k(sims, k, rows=None):
+    """Selects the `k` highest similarity values in O(N) using partial selection
+    (argpartition) and sorts only the selected values. Ties are broken by the
+    lowest index.
+
+    Args:
+        sims: A numpy array containing the similarity values of the index.
+        k: The number of indices returned.
+        rows: An optional array of candidate indices; selection is restricted to
+              these rows of `sims`.
+
+    Returns:
+        A numpy array containing the top `k` indices in descending similarity order.
+    """
+    if rows is not None:
+        rows = np.asarray(rows)
+        return rows[top_k(sims[rows], k)]
+    k = min(k, len(sims))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(sims):
+        indices = np.argpartition(-sims, k - 1)[:k]
+    else:
+        indices = np.arange(len(sims))
+    return indices[np.lexsort((indices, -sims[indices]))]
+
+
+def top_k_batch(sims, k, rows_list=None):
+    """Applies `top_k` to every row of a (queries x N) similarity matrix.
+
+    Args:
+        sims: A numpy array containing one row of similarity values per query.
+        k: The number of indices returned per query.
+        rows_list: An optional list of candidate index arrays (or None), one
+                   per query.
+
+    Returns:
+        A list of (indices, similarity values) tuples, one per query.
+    """
+    results = []
+    for ii, query_sims in enumerate(sims):
+        rows = None if rows_list is None else rows_list[ii]
+        indices = top_k(query_sims, k, rows)
+        results.append((indices, query_sims[indices]))
+    return results
+
+
+def finite_results(indices, sims):
+    """Drops the ranked indices of non-finite similarity, e.g. the rows of
+    superseded index segments (-inf, see segments.py) that fill a top k larger
+    than the number of live rows.
+
+    Args:
+        indices: A numpy array of ranked indices.
+        sims: The similarity values of the indices.
+
+    Returns:
+        The (indices, similarity values) tuple of the finite similarities.
+    """
+    sims = np.asarray(sims)
+    finite = np.isfinite(sims)
+    if finite.all():
+        return indices, sims
+    return np.asarray(indices)[finite], sims[finite]
+
+
+def column_max(matrix):
+    """Computes the maximum value of every column of a CSC matrix, i.e. the
+    upper bound of the contribution of every posting list (MaxScore)."""
+    col_max = np.zeros(matrix.shape[1], dtype=np.float32)
+    nnz_cols = np.flatnonzero(np.diff(matrix.indptr))
+    if len(nnz_cols) > 0:
+        col_max[nnz_cols] = np.maximum.reduceat(matrix.data,
+                                                matrix.indptr[nnz_cols])
+    return col_max
+
+
+def build_field_index(index):
+    """Builds a FieldIndex for dense, or a SparseFieldIndex for sparse index
+    matrices."""
+    if sparse.issparse(next(iter(index.values()))):
+        return SparseFieldIndex(index)
+    return FieldIndex(index)
+
+
+def l2_normalize(matrix):
+    """Scales every row of the given matrix (dense or sparse) to unit L2 norm.
+    Dense matrices are cast to float32. Rows with a zero norm are left as is.
+
+    Args:
+        matrix: A numpy array or scipy sparse matrix of row vectors.
+
+    Returns:
+        The row-normalized matrix.
+    """
+    if sparse.issparse(matrix):
+        # astype copies, the given matrix is never scaled in place
+        matrix = sparse.csr_matrix(matrix).astype(np.float32)
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)))
+        norms = norms.reshape(-1)
+        norms[norms == 0] = 1
+        # scale each stored value by the norm of the row it belongs to
+        matrix.data /= np.repeat(norms, np.diff(matrix.indptr))
+        return matrix
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+class FieldIndex:
+    """Multi-field search index (e.g. TitleV, BodyV) backed by a single fused
+    matrix.
+
+    The row-normalized field matrices are stacked horizontally into one
+    contiguous (N x fields*d) block. The weighted similarity of a query,
+    sum(w_f * <q, F_f>), is then computed as a single matrix-vector product
+    between the fused block and the query vector repeated once per field and
+    scaled by the field weights, without any per-field temporaries.
+
+    The index behaves like the read-only dictionary of field matrices it was
+    built from (keys, values, items, item access). For dense indices the
+    field matrices are views of the fused block.
+    """
+    def __init__(self, index):
+        if len(index) == 0:
+            raise ValueError(empty_index_error)
+        matrices = [l2_normalize(matrix) for matrix in index.values()]
+        if len(set(m.shape[0] for m in matrices)) != 1:
+            raise ValueError(rows_mismatch_error)
+        self.is_sparse = sparse.issparse(matrices[0])
+        if any(sparse.issparse(m) != self.is_sparse for m in matrices):
+            raise TypeError(mixed_types_error)
+
+        self._setup(list(index.keys()), [m.shape[1] for m in matrices],
+                    self._fuse(matrices))
+
+    @classmethod
+    def from_fused(cls, fields, dims, matrix):
+        """Creates the index from an already fused and row-normalized matrix,
+        e.g. one memory-mapped from an index store (see index_store.py).
+
+        Args:
+            fields: The index keys of the fused fields, in column order.
+            dims: The number of columns of each field.
+            matrix: The fused (N x sum(dims)) matrix.
+
+        Returns:
+            A FieldIndex instance sharing the given matrix.
+        """
+        index = cls.__new__(cls)
+        index.is_sparse = sparse.issparse(matrix)
+        index._setup(fields, dims, matrix)
+        return index
+
+    def _setup(self, fields, dims, matrix):
+        self.fields = list(fields)
+        self.dims = [int(d) for d in dims]
+        self.offsets = [int(o) for o in np.cumsum([0] + self.dims[:-1])]
+        self.matrix = matrix
+        self.shape = (self.matrix.shape[0], len(self.fields))
+        # optional approximate nearest neighbour index (see ann_index.py)
+        self.ann = None
+
+    def _fuse(self, matrices):
+        if self.is_sparse:
+            return sparse.hstack(matrices, format='csr')
+        return np.hstack(matrices)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __getitem__(self, key):
+        idx = self.fields.index(key)
+        start = self.offsets[idx]
+        return self.matrix[:, start:(start + self.dims[idx])]
+
+    def keys(self):
+        return list(self.fields)
+
+    def values(self):
+        return [self[key] for key in self.fields]
+
+    def items(self):
+        return [(key, self[key]) for key in self.fields]
+
+    def _weights(self, field_weights):
+        if field_weights is None:
+            return np.ones(len(self.fields), dtype=np.float32)
+        return np.asarray(field_weights, dtype=np.float32)
+
+    def query_vector(self, query_vec, field_weights=None):
+        """Builds the fused query vector, i.e. the normalized query vector
+        repeated once per field and scaled by the corresponding field weight.
+
+        Args:
+            query_vec: A numpy array or sparse matrix containing the query vector.
+            field_weights: Field weights (one per index field), defaults to 1 each.
+
+        Returns:
+            A 1-D float32 numpy array of length fields*d.
+        """
+        query_vec = l2_normalize(query_vec)
+        if sparse.issparse(query_vec):
+            query_vec = query_vec.toarray()
+        weights = self._weights(field_weights)
+        return np.outer(weights, query_vec.reshape(-1)).reshape(-1)
+
+    def query_matrix(self, query_vecs, field_weights=None):
+        """Builds the fused query vectors of a batch of queries (see
+        `query_vector`), one per row.
+
+        Args:
+            query_vecs: A numpy array or sparse matrix of query vectors (one per row).
+            field_weights: Field weights (one per index field), defaults to 1 each.
+
+        Returns:
+            A (queries x fields*d) float32 numpy array (sparse matrix for sparse
+            query vectors).
+        """
+        query_vecs = l2_normalize(query_vecs)
+        weights = self._weights(field_weights)
+        if sparse.issparse(query_vecs):
+            return sparse.hstack([query_vecs * w for w in weights],
+                                 format='csr')
+        return np.hstack([query_vecs * w for w in weights])
+
+    def batch_scores(self, query_vecs, field_weights=None):
+        """Computes the weighted similarities of a batch of queries against
+        every index row with a single matrix-matrix product.
+
+        Args:
+            query_vecs: A numpy array or sparse matrix of query vectors (one per row).
+            field_weights: Field weights (one per index field), defaults to 1 each.
+
+        Returns:
+            A (queries x N) float32 numpy array of weighted similarities.
+        """
+        fused_queries = self.query_matrix(query_vecs, field_weights)
+        if sparse.issparse(fused_queries):
+            fused_queries = fused_queries.toarray()
+        return np.asarray(fused_queries.dot(self.matrix.T))
+
+    def batch_top_k(self, query_vecs, k, field_weights=None, rows_list=None):
+        """Retrieves the `k` most similar index rows for every query of a
+        batch. The queries are scored in chunks of QUERY_BATCH_SIZE, one
+        matrix-matrix product per chunk.
+
+        Args:
+            query_vecs: A numpy array or sparse matrix of query vectors (one per row).
+            k: The number of indices returned per query.
+            field_weights: Field weights (one per index field), defaults to 1 each.
+            rows_list: An optional list of index row arrays (or None) the search
+                       of every query is restricted to.
+
+        Returns:
+            A list of (indices, similarity values) tuples, one per query.
+        """
+        results = []
+        for start in range(0, query_vecs.shape[0], QUERY_BATCH_SIZE):
+            end = start + QUERY_BATCH_SIZE
+            sims = self.batch_scores(query_vecs[start:end], field_weights)
+            results.extend(
+                top_k_batch(sims, k,
+                            None if rows_list is None else rows_list[start:end]))
+        return results
+
+    def scores(self, query_vec, field_weights=None, rows=None):
+        """Computes the weighted sum of the cosine similarities between the
+        query vector and every index field with a single matrix-vector product.
+        In case `rows` are given, only these rows of the index are scored.
+
+        Args:
+            query_vec: A numpy array or sparse matrix containing the query vector.
+            field_weights: Field weights (one per index field), defaults to 1 each.
+            rows: An optional array of index rows to be scored.
+
+        Returns:
+            A numpy array of length N (or len(rows)) containing the weighted
+            similarities.
+        """
+        fused_query = self.query_vector(query_vec, field_weights)
+        if rows is None or len(rows) > SUBSET_RATIO * self.shape[0]:
+            sims = np.asarray(self.matrix.dot(fused_query)).reshape(-1)
+            return sims if rows is None else sims[rows]
+        # gather and score the requested rows in bounded batches
+        sims = np.zeros(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), ROW_BATCH_SIZE):
+            batch = rows[start:(start + ROW_BATCH_SIZE)]
+            sims[start:(start + len(batch))] = np.asarray(
+                self.matrix[batch].dot(fused_query)).reshape(-1)
+        return sims
+
+    def top_k(self,
+              query_vec,
+              k,
+              field_weights=None,
+              rows=None,
+              nprobe=None):
+        """Retrieves the `k` most similar index rows to the given query vector.
+        In case `nprobe` is given and an ANN index is attached, the search is
+        approximate and only the `nprobe` closest inverted lists are scored.
+
+        Args:
+            query_vec: A numpy array or sparse matrix containing the query vector.
+            k: The number of indices returned.
+            field_weights: Field weights (one per index field), defaults to 1 each.
+            rows: An optional array of index rows the search is restricted to.
+            nprobe: The number of ANN inverted lists scored (None for exact search).
+
+        Returns:
+            The top `k` row indices in descending similarity order and their
+            similarity values.
+        """
+        if nprobe and self.ann is not None and rows is None:
+            fused_query = self.query_vector(query_vec, field_weights)
+            return self.ann.search(self.matrix, fused_query, k, nprobe)
+        sims = self.scores(query_vec, field_weights, rows)
+        order = top_k(sims, k)
+        indices = order if rows is None else np.asarray(rows)[order]
+        return indices, sims[order]
+
+
+class SparseFieldIndex(FieldIndex):
+    """FieldIndex for sparse (e.g. TF-IDF) index matrices.
+
+    The fused matrix is stored in CSC form, i.e. as one posting list (sorted
+    row indices and normalized weights) per (field, term) column. Queries only
+    contain a handful of terms, so the similarities are accumulated
+    term-at-a-time from the posting lists of the query terms, without touching
+    the rest of the index. Top-k retrieval additionally uses MaxScore pruning:
+    once the remaining terms cannot lift an unseen row into the top `k`, only
+    the rows already seen (and still able to make it) are scored further.
+    """
+    def _fuse(self, matrices):
+        matrix = sparse.hstack(matrices, format='csc')
+        matrix.sort_indices()
+        self.col_max = column_max(matrix)
+        return matrix
+
+    @classmethod
+    def from_fused(cls, fields, dims, matrix, col_max=None):
+        """Creates the index from an already fused and row-normalized CSC
+        matrix with sorted indices (see `FieldIndex.from_fused`). The column
+        maxima are computed if not given."""
+        index = super().from_fused(fields, dims, matrix)
+        index.col_max = column_max(matrix) if col_max is None else col_max
+        return index
+
+    @property
+    def nonnegative(self):
+        # MaxScore pruning requires nonnegative index weights, checked lazily
+        # so that loading a memory-mapped index does not touch its data
+        if not hasattr(self, '_nonnegative'):
+            data = self.matrix.data
+            self._nonnegative = len(data) == 0 or bool(data.min() >= 0)
+        return self._nonnegative
+
+    def query_terms(self, query_vec, field_weights=None):
+        """Maps the query vector terms to the fused index columns.
+
+        Args:
+            query_vec: A sparse matrix containing the query vector.
+            field_weights: Field weights (one per index field), defaults to 1 each.
+
+        Returns:
+            The fused column indices of the query terms and their (weighted)
+            query values.
+        """
+        query_vec = sparse.csr_matrix(l2_normalize(query_vec))
+        weights = self._weights(field_weights)
+        cols, values = [], []
+        for idx, weight in enumerate(weights):
+            if weight != 0:
+                cols.append(query_vec.indices + self.offsets[idx])
+                values.append(query_vec.data * weight)
+        if len(cols) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(cols), np.concatenate(values)
+
+    def batch_scores(self, query_vecs, field_weights=None):
+        """Computes the weighted similarities of a batch of queries against
+        every index row with a single sparse matrix-matrix product (see
+        `FieldIndex.batch_scores`)."""
+        fused_queries = self.query_matrix(query_vecs, field_weights)
+        return fused_queries.dot(self.matrix.T).toarray()
+
+    def _postings(self, col):
+        start, end = self.matrix.indptr[col], self.matrix.indptr[col + 1]
+        return self.matrix.indices[start:end], self.matrix.data[start:end]
+
+    def scores(self, query_vec, field_weights=None, rows=None):
+        """Computes the weighted sum of the cosine similarities between the
+        query vector and every index field, term-at-a-time over the posting
+        lists of the query terms.
+
+        Args:
+            query_vec: A sparse matrix containing the query vector.
+            field_weights: Field weights (one per index field), defaults to 1 each.
+            rows: An optional array of index rows to be scored.
+
+        Returns:
+            A numpy array of length N (or len(rows)) containing the weighted
+            similarities.
+        """
+        sims = np.zeros(self.shape[0], dtype=np.float32)
+        for col, value in zip(*self.query_terms(query_vec, field_weights)):
+            post_rows, post_values = self._postings(col)
+            sims[post_rows] += post_values * value
+        return sims if rows is None else sims[rows]
+
+    def top_k(self,
+              query_vec,
+              k,
+              field_weights=None,
+              rows=None,
+              nprobe=None):
+        """Retrieves the `k` most similar index rows to the given query vector
+        using term-at-a-time MaxScore pruning. Restricted (`rows`) searches and
+        indices with negative weights fall back to exhaustive scoring.
+
+        Args:
+            query_vec: A sparse matrix containing the query vector.
+            k: The number of indices returned.
+            field_weights: Field weights (one per index field), defaults to 1 each.
+            rows: An optional array of index rows the search is restricted to.
+            nprobe: Ignored, sparse searches are always exact.
+
+        Returns:
+            The top `k` row indices in descending similarity order and their
+            similarity values.
+        """
+        cols, values = self.query_terms(query_vec, field_weights)
+        if (rows is not None or k <= 0 or not self.nonnegative
+                or (values < 0).any()):
+            return super().top_k(query_vec, k, field_weights, rows)
+
+        # process terms by decreasing upper bound of their contribution
+        bounds = values * self.col_max[cols]
+        order = np.argsort(-bounds)
+        cols, values = cols[order], values[order]
+        remaining = np.cumsum(bounds[order][::-1])[::-1]
+        remaining = np.append(remaining[1:], 0)
+
+        sims = np.zeros(self.shape[0], dtype=np.float32)
+        seen = []
+        candidates = None
+        for ii, (col, value) in enumerate(zip(cols, values)):
+            post_rows, post_values = self._postings(col)
+            if len(post_rows) == 0:
+                # e.g. a term of the query never found in one of the fields
+                continue
+            if candidates is None:
+                sims[post_rows] += post_values * value
+                seen.append(post_rows)
+                touched = np.unique(np.concatenate(seen))
+                if len(touched) < k:
+                    continue
+                seen = [touched]
+                threshold = -np.partition(-sims[touched], k - 1)[k - 1]
+                if threshold < remaining[ii]:
+                    continue
+                # unseen rows can no longer make it into the top k
+                candidates = touched
+            else:
+                # score only the candidate rows present in the posting list
+                pos = np.searchsorted(post_rows, candidates)
+                pos[pos == len(post_rows)] = 0
+                hits = post_rows[pos] == candidates
+                sims[candidates[hits]] += post_values[pos[hits]] * value
+                threshold = -np.partition(-sims[candidates], k - 1)[k - 1]
+            candidates = candidates[
+                sims[candidates] + remaining[ii] >= threshold]
+
+        # every posting list was fully scored if pruning never kicked in
+        indices = top_k(sims, k, candidates)
+        return indices, sims[indices]
@@ -3,35 +3,73 @@ import pickle
 
 import numpy as np
 import pandas as pd
-from numpy.linalg import norm
+from scipy import sparse
 
 from wordvec_models.search_model import BaseSearchModel
-
-from text_processing.tokenizer import get_custom_tokenizer
+from wordvec_models.utils import iter_chunks
 
 ## Vector building error strings
 doc_path_error = 'Provided document path doesn\'t exist.'
 doc_type_error = 'Invalid "doc" variable type {}. Expected str(path) or list.'
 
+# number of lines per doc vector building chunk
+CHUNK_SIZE = 10000
+
 
 class GloVeModel(BaseSearchModel):
-    def __init__(self, wordvec_index, build_index, export_path=None):
-        self.tok = get_custom_tokenizer()
+    """GloVe sentence vector model.
+
+    The unit norm word vectors are held in one contiguous float32 matrix
+    (`embeddings`) and `vocab` maps every token to its row.
+    """
+    def __init__(self,
+                 wordvec_index,
+                 build_index,
+                 export_path=None,
+                 registry=None):
+        self._set_registry(registry)
+        self._load_tokenizer()
         if build_index:
             if export_path:
                 print('Building wordvec index...')
-                self.build_wordvec_index(wordvec_index, export_path)
+                wordvec_index = self.build_wordvec_index(
+                    wordvec_index, export_path)
             else:
                 raise Exception('Export file path is required.')
         else:
-            self.wordvec_index = pd.read_pickle(wordvec_index)
-        self.dim = self.wordvec_index.shape[1]
-        self.vocab = frozenset(list(self.wordvec_index.index))
-        self.unk_vec = self._normalize_vector(
-            self.wordvec_index.loc['<unk>'].values)
-
-    def _normalize_vector(self, vector):
-        return vector / norm(vector)
+            wordvec_index = pd.read_pickle(wordvec_index)
+        self._set_embeddings(wordvec_index)
+
+    def __getstate__(self):
+        # the registry and the tokenizer are shared, not pickled
+        state = self.__dict__.copy()
+        for name in ('registry', 'tok', 'normalizer'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'embeddings' not in state:
+            # models pickled with the wordvec index DataFrame
+            self._set_embeddings(self.__dict__.pop('wordvec_index'))
+        self._set_registry(None)
+        self._load_tokenizer()
+
+    def _set_embeddings(self, wordvec_index):
+        """Keeps the normalized word vectors of a wordvec index DataFrame and
+        the token -> row lookup."""
+        embeddings = np.array(wordvec_index.values, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        embeddings /= norms
+        self.embeddings = np.ascontiguousarray(embeddings)
+        self.vocab = {
+            token: row
+            for row, token in enumerate(wordvec_index.index)
+        }
+        self.dim = self.embeddings.shape[1]
+        self.unk_row = self.vocab['<unk>']
+        self.unk_vec = self.embeddings[self.unk_row]
 
     def build_wordvec_index(self, vec_filepath, export_path):
         """Given a GloVe vector file, output word vectors into a DataFrame where
@@ -49,45 +87,79 @@ class GloVeModel(BaseSearchModel):
                 token, vector = row.split(' ', 1)
                 vec_matrix[idx] = np.fromstring(vector, sep=' ')
                 index_tokens.append(token)
-        self.wordvec_index = pd.DataFrame(data=vec_matrix, index=index_tokens)
-        self.wordvec_index.to_pickle(export_path)
+        wordvec_index = pd.DataFrame(data=vec_matrix, index=index_tokens)
+        wordvec_index.to_pickle(export_path)
         print('GloVe wordvec index saved in', os.path.realpath(export_path))
+        return wordvec_index
+
+    def token_rows(self, text):
+        """Returns the embedding rows of the tokens of a text, unknown tokens
+        map to the <unk> row."""
+        return [self.vocab.get(token, self.unk_row) for token in text.split()]
 
     def infer_vector(self, text):
         """Calculates sentence vectors by mimiking the fastText algorithm.
         Average of the unit norm vectors of every token.
         """
-        count = 0
-        svec = np.zeros(self.dim, dtype=np.float32)
-        for token in text.split():
-            count += 1
-            if token in self.vocab:
-                svec += self._normalize_vector(
-                    self.wordvec_index.loc[token].values)
-            else:
-                svec += self.unk_vec
-        if count == 0:
-            return self.unk_vec
-        return svec / count
-
-    def cli_search(self, num_results=10, field_weights=None, postid_fn=None):
+        rows = self.token_rows(text)
+        if len(rows) == 0:
+            return self.unk_vec.copy()
+        return self.embeddings[rows].mean(axis=0)
+
+    def infer_doc_vectors(self, texts):
+        """Calculates the sentence vectors of a batch of texts as the product
+        of their (length normalized) sparse bag-of-words matrix and the
+        embedding matrix.
+
+        Args:
+            texts: A list of texts.
+
+        Returns:
+            A (len(texts) x dim) float32 matrix, row `i` equals
+            `infer_vector(texts[i])`.
+        """
+        rows = [self.token_rows(text) for text in texts]
+        lengths = np.array([len(r) for r in rows], dtype=np.int64)
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(lengths)
+        indices = np.fromiter((row for r in rows for row in r),
+                              dtype=np.int32,
+                              count=indptr[-1])
+        weights = np.repeat(1 / np.maximum(lengths, 1), lengths)
+        bow = sparse.csr_matrix(
+            (weights.astype(np.float32), indices, indptr),
+            shape=(len(rows), len(self.embeddings)))
+        vectors = np.asarray(bow.dot(self.embeddings), dtype=np.float32)
+        vectors[lengths == 0] = self.unk_vec
+        return vectors
+
+    def cli_search(self,
+                   num_results=10,
+                   field_weights=None,
+                   postid_fn=None,
+                   nprobe=None):
         super().cli_search(num_results=num_results,
                            field_weights=field_weights,
                            ranking_fn=self.ranking,
-                           postid_fn=postid_fn)
+                           postid_fn=postid_fn,
+                           nprobe=nprobe)
 
     def search(self,
                query,
                tags=None,
                num_results=10,
                field_weights=None,
-               postid_fn=None):
+               postid_fn=None,
+               nprobe=None,
+               as_frame=True):
         return super().search(query=query,
                               tags=tags,
                               num_results=num_results,
                               field_weights=field_weights,
                               ranking_fn=self.ranking,
-                              postid_fn=postid_fn)
+                              postid_fn=postid_fn,
+                              nprobe=nprobe,
+                              as_frame=as_frame)
 
 
 def load_glove_model(model_path):
@@ -104,32 +176,45 @@ def build_glove_model(wordvec_index, wv_export_path, model_export_path):
     return glove
 
 
-def build_doc_vectors(model, doc, export_path=None):
+def build_doc_vectors(model, doc, export_path=None, chunk_size=CHUNK_SIZE):
     """Expected input is a preprocessed document.
     Calculates sentence vectors as the average of the unit norm vectors
     of every token, like fastText.
-    """
-    def calc_vectors(doc, vector_matrix):
-        for idx, line in enumerate(doc):
-            print('\rcalculating vector for line #', idx, end='')
-            vector_matrix.append(model.infer_vector(str(line.strip())))
-        print()
 
-    vector_matrix = []
+    The document is streamed in chunks of `chunk_size` lines, the vectors of
+    a chunk are computed at once (see `GloVeModel.infer_doc_vectors`) and
+    written into a preallocated float32 matrix.
+    """
     if isinstance(model, str):
         model = load_glove_model(model)
     if isinstance(doc, str):
-        if os.path.exists(doc):
-            with open(doc, 'r') as doc_file:
-                calc_vectors(doc_file, vector_matrix)
-        else:
+        if not os.path.exists(doc):
             raise ValueError(doc_path_error)
+        with open(doc, 'r') as doc_file:
+            num_lines = sum(1 for _ in doc_file)
     elif isinstance(doc, list):
-        calc_vectors(doc, vector_matrix)
+        num_lines = len(doc)
     else:
         raise TypeError(doc_type_error.format(type(doc)))
-    vector_matrix = np.array(vector_matrix)
+
+    def fill(lines, vector_matrix):
+        start = 0
+        for chunk in iter_chunks(lines, chunk_size):
+            vector_matrix[start:start + len(chunk)] = model.infer_doc_vectors(
+                chunk)
+            start += len(chunk)
+            print('\rcalculated vectors for {}/{} lines'.format(
+                start, num_lines),
+                  end='')
+        print()
+
+    vector_matrix = np.empty((num_lines, model.dim), dtype=np.float32)
+    if isinstance(doc, str):
+        with open(doc, 'r') as doc_file:
+            fill(doc_file, vector_matrix)
+    else:
+        fill(doc, vector_matrix)
     if export_path:
         np.save(export_path, vector_matrix)
-        print('\nGloVe doc vectors saved in', os.path.realpath(export_path))
-    return vector_matrix
\ No newline at end of file
+        print('GloVe doc vectors saved in', os.path.realpath(export_path))
+    return vector_matrix
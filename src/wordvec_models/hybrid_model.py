@@ -4,45 +4,87 @@ import numpy as np
 import pandas as pd
 from fasttext import load_model
 
-from wordvec_models.search_model import BaseSearchModel
+from wordvec_models.search_model import BaseSearchModel, top_k
+from wordvec_models.field_index import QUERY_BATCH_SIZE, top_k_batch
+from wordvec_models.field_index import finite_results
+from wordvec_models.registry import artifact_key
+from wordvec_models.segments import index_dir, segment_snapshot
 
-from text_processing.tokenizer import get_custom_tokenizer
 
 ## Vector building error strings
 doc_path_error = 'Provided document path doesn\'t exist.'
 doc_type_error = 'Invalid "doc" variable type {}. Expected str(path) or list.'
 
+## Rerank error strings
+generator_error = 'Unknown candidate generator "{}". Expected one of {}.'
+ann_missing_error = 'The "ann" candidate generator requires a fastText ANN index.'
+
+## Rerank candidate generators
+CANDIDATE_GENERATORS = ['sparse', 'ann']
+# default number of ANN inverted lists searched by the "ann" generator
+DEFAULT_NPROBE = 16
+
 
 class HybridSearch(BaseSearchModel):
-    def __init__(self, ft_model_path, tfidf_model_path, ft_index_path,
-                 tfidf_index_path, index_keys, metadata_path):
+    def __init__(self,
+                 ft_model_path,
+                 tfidf_model_path,
+                 ft_index_path,
+                 tfidf_index_path,
+                 index_keys,
+                 metadata_path,
+                 rerank=False,
+                 candidate_pool=200,
+                 candidate_generator='sparse',
+                 registry=None):
+        """In the default (full) mode, both the fastText and the tf-idf index are
+        scored in full for every query. In `rerank` mode, a pool of
+        `candidate_pool` posts is first retrieved by the `candidate_generator`
+        ('sparse': tf-idf posting lists, 'ann': fastText ANN index) and only these
+        candidates are scored by the hybrid formula.
+        The models, indices and metadata are shared with the other search models
+        through the artifact `registry` (defaults to the process-wide one).
+        """
+        if candidate_generator not in CANDIDATE_GENERATORS:
+            raise ValueError(
+                generator_error.format(candidate_generator,
+                                       CANDIDATE_GENERATORS))
+        self.rerank = rerank
+        self.candidate_pool = candidate_pool
+        self.candidate_generator = candidate_generator
         self.name = 'hybrid'
-        self.tok = get_custom_tokenizer()
-        self.ft_model = load_model(ft_model_path)
+        self._set_registry(registry)
+        self._load_tokenizer()
+        # both indices and the metadata are loaded from the same segments
+        self.snapshot = segment_snapshot(index_dir(ft_index_path))
+        self.ft_model = self.registry.get(
+            artifact_key('fasttext', ft_model_path),
+            lambda: load_model(ft_model_path))
         print('fastText model: {} \u2713'.format(
             os.path.basename(ft_model_path)),
               end=' ')
-        self.ft_index = self._read_pickle(ft_index_path)
-        for key in list(self.ft_index.keys()):
-            if key not in index_keys:
-                del self.ft_index[key]
+        self.ft_index = self._load_index(ft_index_path, index_keys,
+                                         self.snapshot)
 
-        self.tfidf_model = self._read_pickle(tfidf_model_path)
+        self.tfidf_model = self.registry.get(
+            artifact_key('tfidf', tfidf_model_path),
+            lambda: self._read_pickle(tfidf_model_path))
         print('tf-idf model: {} u\'\u2713\''.format(
             os.path.basename(tfidf_model_path)))
-        self.tfidf_index = self._read_pickle(tfidf_index_path)
-        for key in list(self.tfidf_index.keys()):
-            if key not in index_keys:
-                del self.tfidf_index[key]
+        self.tfidf_index = self._load_index(tfidf_index_path, index_keys,
+                                            self.snapshot)
 
         self.num_index_keys = len(self.ft_index)
-        self.index_size = (next(iter(self.ft_index.values()))).shape[0]
+        self.index_size = self.ft_index.shape[0]
         print('Index keys used:', ', '.join(self.ft_index.keys()), end='\n\n')
 
-        mtdt = self._read_pickle(metadata_path)
-        self.metadata = mtdt['metadata']
-        self.etag_lookup = mtdt['etag_lookup']
-        mtdt = None
+        self.metadata, self.tag_index = self._load_metadata(
+            metadata_path, self.snapshot)
+        self._init_caches()
+
+        if (self.rerank and self.candidate_generator == 'ann'
+                and self.ft_index.ann is None):
+            raise ValueError(ann_missing_error)
 
     def infer_vector(self, text):
         text = text.lower().strip()
@@ -50,17 +92,25 @@ class HybridSearch(BaseSearchModel):
         tfidf_vec = self.tfidf_model.transform([text])
         return {'ft_query_vec': ft_vec, 'tfidf_query_vec': tfidf_vec}
 
+    def infer_vectors(self, texts):
+        texts = [text.lower().strip() for text in texts]
+        ft_vecs = np.vstack(
+            [self.ft_model.get_sentence_vector(text) for text in texts])
+        tfidf_vecs = self.tfidf_model.transform(texts)
+        return {'ft_query_vecs': ft_vecs, 'tfidf_query_vecs': tfidf_vecs}
+
     def hybrid_ranking(self,
                        ft_query_vec,
                        tfidf_query_vec,
                        num_results,
                        field_weights=None,
-                       tags=None):
+                       tags=None,
+                       nprobe=None):
         """Given a query vector, calculate the ranking of posts using cossine
         similarities. In case `field_weights` are given, apply weights in the formula.
         e.g. sims = 0.4*BodyMatrixSims + 0.6*TitleMatrixSims.
-        In case `tags` are provided, filter the resulting list to include posts
-        containing these tags.
+        In case `tags` are provided, only the posts containing these tags are
+        scored and ranked.
 
         Args:
             ft_query_vec: A numpy array containing the fastText infered query vector.
@@ -68,53 +118,144 @@ class HybridSearch(BaseSearchModel):
             num_results: The final number of results (post indices) returned.
             field_weights: Field weights (Title, Body, Tags) for the calculation of sims.
             tags: A list of tags to filter the final results.
+            nprobe: The number of ANN inverted lists searched by the "ann"
+                    candidate generator (rerank mode only).
 
         Returns:
             An index of PostIds and their similarity calues to the given query.
         """
-        sims = np.zeros([self.index_size], dtype=np.float32)
-        if field_weights:
-            # fastText sims
-            for idx, index_matrix in enumerate(self.ft_index.values()):
-                sims -= self._calc_cossims(ft_query_vec,
-                                           index_matrix) * field_weights[idx]
-            # tfidf sims
-            for idx, index_matrix in enumerate(self.tfidf_index.values()):
-                sims -= self._calc_cossims(tfidf_query_vec,
-                                           index_matrix) * field_weights[idx]
-            #sims = sims / self.num_index_keys ##Field weights 0.5 each
-        else:
-            # fastText sims
-            for index_matrix in self.ft_index.values():
-                sims -= self._calc_cossims(ft_query_vec, index_matrix)
-            # tfidf sims
-            for index_matrix in self.tfidf_index.values():
-                sims -= self._calc_cossims(tfidf_query_vec, index_matrix)
-            #sims = sims / self.num_index_keys ##Field weights 0.5 each
+        rows = self.tag_index.rows(tags) if tags else None
+        if self.rerank:
+            return self._rerank_ranking(ft_query_vec, tfidf_query_vec,
+                                        num_results, field_weights, rows,
+                                        nprobe)
+
+        # fastText & tfidf weighted sims, one BLAS call per model
+        sims = self.ft_index.scores(ft_query_vec, field_weights, rows)
+        sims += self.tfidf_index.scores(tfidf_query_vec, field_weights, rows)
         #sims = sims / 2  ##Model weights 0.5 each
 
-        indices = np.argsort(sims)
-        if tags:
-            indices = self._index_filter(indices, tags)
-        indices = indices[:num_results]
-        sim_values = [(-sims[i]) for i in indices]
-        return indices, sim_values
+        order = top_k(sims, num_results)
+        indices = order if rows is None else rows[order]
+        indices, sim_values = finite_results(indices, sims[order])
+        return indices, list(sim_values)
+
+    def _rerank_ranking(self, ft_query_vec, tfidf_query_vec, num_results,
+                        field_weights, rows, nprobe):
+        """Two-stage ranking: retrieve a pool of candidate posts with the
+        candidate generator, then rank only the candidates using the hybrid
+        (fastText + tf-idf) similarities.
+
+        Args:
+            ft_query_vec: A numpy array containing the fastText infered query vector.
+            tfidf_query_vec: A numpy array containing the TFIDF infered query vector.
+            num_results: The final number of results (post indices) returned.
+            field_weights: Field weights (Title, Body, Tags) for the calculation of sims.
+            rows: An optional array of index rows (tag filter) the search is restricted to.
+            nprobe: The number of ANN inverted lists searched by the "ann" generator.
+
+        Returns:
+            An index of PostIds and their similarity calues to the given query.
+        """
+        pool = max(self.candidate_pool, num_results)
+        if self.candidate_generator == 'sparse':
+            candidates, tfidf_sims = self.tfidf_index.top_k(
+                tfidf_query_vec, pool, field_weights, rows)
+        else:
+            candidates, _ = self.ft_index.top_k(ft_query_vec, pool,
+                                                field_weights, rows,
+                                                nprobe or DEFAULT_NPROBE)
+            tfidf_sims = self.tfidf_index.scores(tfidf_query_vec,
+                                                 field_weights, candidates)
+        sims = tfidf_sims + self.ft_index.scores(ft_query_vec, field_weights,
+                                                 candidates)
+        order = top_k(sims, num_results)
+        indices, sim_values = finite_results(candidates[order], sims[order])
+        return indices, list(sim_values)
+
+    def hybrid_batch_ranking(self,
+                             ft_query_vecs,
+                             tfidf_query_vecs,
+                             num_results,
+                             field_weights=None,
+                             tags_list=None):
+        """Batched version of `hybrid_ranking`. In the default (full) mode the
+        fastText and tf-idf similarities of every chunk of QUERY_BATCH_SIZE
+        queries are computed as two matrix-matrix products. In `rerank` mode
+        the queries are ranked one at a time.
+
+        Args:
+            ft_query_vecs: A numpy array of fastText query vectors (one per row).
+            tfidf_query_vecs: A sparse matrix of TFIDF query vectors (one per row).
+            num_results: The final number of results (post indices) returned per query.
+            field_weights: Field weights (Title, Body, Tags) for the calculation of sims.
+            tags_list: An optional list of tag lists (or None), one per query.
 
-    def cli_search(self, num_results=10, field_weights=None, postid_fn=None):
+        Returns:
+            A list of (PostId indices, similarity values) tuples, one per query.
+        """
+        if self.rerank:
+            return [
+                self.hybrid_ranking(ft_query_vecs[ii:(ii + 1)],
+                                    tfidf_query_vecs[ii:(ii + 1)],
+                                    num_results,
+                                    field_weights,
+                                    None if tags_list is None else tags_list[ii])
+                for ii in range(ft_query_vecs.shape[0])
+            ]
+
+        rows_list = self._batch_rows(tags_list)
+        results = []
+        for start in range(0, ft_query_vecs.shape[0], QUERY_BATCH_SIZE):
+            end = start + QUERY_BATCH_SIZE
+            sims = self.ft_index.batch_scores(ft_query_vecs[start:end],
+                                              field_weights)
+            sims += self.tfidf_index.batch_scores(tfidf_query_vecs[start:end],
+                                                  field_weights)
+            results.extend(
+                top_k_batch(sims, num_results,
+                            None if rows_list is None else rows_list[start:end]))
+        return [(indices, list(sim_values)) for indices, sim_values in (
+            finite_results(indices, sim_values)
+            for indices, sim_values in results)]
+
+    def cli_search(self,
+                   num_results=10,
+                   field_weights=None,
+                   postid_fn=None,
+                   nprobe=None):
         super().cli_search(num_results=num_results,
                            field_weights=field_weights,
                            ranking_fn=self.hybrid_ranking,
-                           postid_fn=postid_fn)
+                           postid_fn=postid_fn,
+                           nprobe=nprobe)
 
     def search(self,
                query,
                tags=None,
                num_results=10,
                field_weights=None,
-               postid_fn=None):
+               postid_fn=None,
+               nprobe=None,
+               as_frame=True):
         return super().search(query=query,
                               tags=tags,
                               num_results=num_results,
                               field_weights=field_weights,
                               ranking_fn=self.hybrid_ranking,
-                              postid_fn=postid_fn)
+                              postid_fn=postid_fn,
+                              nprobe=nprobe,
+                              as_frame=as_frame)
+
+    def search_batch(self,
+                     queries,
+                     tags_list=None,
+                     num_results=10,
+                     field_weights=None,
+                     as_frame=True):
+        return super().search_batch(queries=queries,
+                                    tags_list=tags_list,
+                                    num_results=num_results,
+                                    field_weights=field_weights,
+                                    ranking_fn=self.hybrid_batch_ranking,
+                                    as_frame=as_frame)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""On-disk search index format.
+
+An index store is a directory holding the fused, row-normalized index matrix
+of a FieldIndex as raw .npy arrays plus a small JSON manifest:
+
+    ft_v0.6.1_post_index/
+        manifest.json
+        matrix.npy                              (dense indices)
+        data.npy, indices.npy, indptr.npy,      (sparse indices, CSC)
+        col_max.npy
+
+The arrays are opened with `np.load(mmap_mode='r')`, so loading is
+(almost) free and the index pages are shared through the page cache across
+every process that opens the same store.
+"""
+
+import os
+import json
+import pickle
+import argparse
+
+import numpy as np
+from scipy import sparse
+
+from wordvec_models.field_index import FieldIndex, SparseFieldIndex
+from wordvec_models.field_index import build_field_index
+
+FORMAT_NAME = 'stacksearch-index'
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+
+## Error Strings
+manifest_error = '"{}" is not a valid index store (manifest missing).'
+format_error = 'Unsupported index store format "{}" version {}.'
+keys_error = 'None of the index keys {} are present in the index store {}.'
+
+
+def is_index_store(path):
+    """Returns True if the given path is an index store directory."""
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def read_manifest(path):
+    """Reads and validates the manifest of an index store.
+
+    Args:
+        path: The index store directory.
+
+    Returns:
+        The manifest dictionary.
+    """
+    if not is_index_store(path):
+        raise ValueError(manifest_error.format(path))
+    with open(os.path.join(path, MANIFEST), 'r') as f:
+        manifest = json.load(f)
+    if (manifest.get('format') != FORMAT_NAME
+            or manifest.get('version') != FORMAT_VERSION):
+        raise ValueError(
+            format_error.format(manifest.get('format'),
+                                manifest.get('version')))
+    return manifest
+
+
+def save_index_store(index, path):
+    """Writes a search index to an index store directory.
+
+    Args:
+        index: A FieldIndex or a dictionary of index matrices (e.g. the
+               `*_post_index.pkl` contents), normalized before saving.
+        path: The index store directory.
+    """
+    if not isinstance(index, FieldIndex):
+        index = build_field_index(index)
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    if index.is_sparse:
+        matrix = sparse.csc_matrix(index.matrix)
+        matrix.sort_indices()
+        arrays = {
+            'data': matrix.data.astype(np.float32),
+            'indices': matrix.indices,
+            'indptr': matrix.indptr,
+            'col_max': index.col_max
+        }
+    else:
+        arrays = {'matrix': np.ascontiguousarray(index.matrix, np.float32)}
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), array)
+
+    manifest = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'type': 'sparse' if index.is_sparse else 'dense',
+        'normalized': True,
+        'shape': [int(d) for d in index.matrix.shape],
+        'fields': [{
+            'key': key,
+            'offset': index.offsets[ii],
+            'dim': index.dims[ii]
+        } for ii, key in enumerate(index.fields)],
+        'arrays': sorted(name + '.npy' for name in arrays)
+    }
+    with open(os.path.join(path, MANIFEST), 'w') as out:
+        json.dump(manifest, out, indent=2)
+
+
+def load_index_store(path, index_keys, mmap_mode='r'):
+    """Opens an index store and retains only the given index keys.
+
+    The matrix is memory-mapped and shared as is when every stored field is
+    requested. Requesting a subset of the fields copies the selected column
+    blocks into memory.
+
+    Args:
+        path: The index store directory.
+        index_keys: The index keys (e.g. BodyV, TitleV) to be retained.
+        mmap_mode: The numpy memory-map mode (None loads the arrays in memory).
+
+    Returns:
+        A FieldIndex (dense) or SparseFieldIndex (sparse) instance.
+    """
+    manifest = read_manifest(path)
+    fields = [f for f in manifest['fields'] if f['key'] in index_keys]
+    if len(fields) == 0:
+        raise ValueError(keys_error.format(index_keys, path))
+
+    def load(name):
+        return np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+
+    keys = [f['key'] for f in fields]
+    dims = [f['dim'] for f in fields]
+    subset = len(fields) < len(manifest['fields'])
+    if manifest['type'] == 'sparse':
+        matrix = sparse.csc_matrix(
+            (load('data'), load('indices'), load('indptr')),
+            shape=tuple(manifest['shape']),
+            copy=False)
+        col_max = load('col_max')
+        if subset:
+            blocks = [slice(f['offset'], f['offset'] + f['dim'])
+                      for f in fields]
+            matrix = sparse.hstack([matrix[:, b] for b in blocks],
+                                   format='csc')
+            col_max = np.concatenate([col_max[b] for b in blocks])
+        return SparseFieldIndex.from_fused(keys, dims, matrix, col_max)
+
+    matrix = load('matrix')
+    if subset:
+        matrix = np.hstack([
+            matrix[:, f['offset']:(f['offset'] + f['dim'])] for f in fields
+        ])
+    return FieldIndex.from_fused(keys, dims, matrix)
+
+
+def convert_pickled_index(pickle_path, store_path=None):
+    """Converts a pickled (`*_post_index.pkl`) search index to an index store.
+
+    Args:
+        pickle_path: The path to the pickled search index.
+        store_path: The index store directory, defaults to the pickle path
+                    without the .pkl extension.
+
+    Returns:
+        The index store directory.
+    """
+    if store_path is None:
+        store_path = os.path.splitext(pickle_path)[0]
+    with open(pickle_path, 'rb') as _in:
+        index = pickle.load(_in)
+    save_index_store(index, store_path)
+    return store_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert a pickled search index to an index store.')
+    parser.add_argument('index_path',
+                        metavar='INDEX',
+                        help='Path to the pickled search index.')
+    parser.add_argument('store_path',
+                        metavar='STORE',
+                        nargs='?',
+                        default=None,
+                        help='Output directory. (default: INDEX without .pkl)')
+    args = parser.parse_args()
+    print('index store saved in',
+          os.path.realpath(
+              convert_pickled_index(args.index_path, args.store_path)))
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+"""Columnar metadata store.
+
+The metadata of every index post is stored column-wise in a directory of raw
+.npy arrays plus a small JSON manifest. Integer fields are plain arrays and
+text fields (titles, snippets, tags) are utf-8 blobs with offset arrays.
+The answer link, answer score and formatted code snippet of the highest
+scored answer are parsed once when the store is built. The arrays are
+memory-mapped at query time.
+"""
+
+import os
+import re
+import json
+import pickle
+import argparse
+
+import numpy as np
+
+from wordvec_models.tag_index import TagIndex
+
+FORMAT_NAME = 'stacksearch-metadata'
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+
+# answer attribution header found at the start of every snippet string
+SNIPPET_INFO_RE = re.compile(r'Post: .*\n##Score -?[0-9]{1,5}')
+
+## Error Strings
+manifest_error = '"{}" is not a valid metadata store (manifest missing).'
+format_error = 'Unsupported metadata store format "{}" version {}.'
+
+INT_COLUMNS = {
+    'post_ids': np.int64,
+    'scores': np.int32,
+    'snippet_counts': np.int32,
+    'answer_ids': np.int64,
+    'answer_scores': np.int32
+}
+STRING_COLUMNS = ['titles', 'snippets', 'tags']
+
+
+def is_metadata_store(path):
+    """Returns True if the given path is a metadata store directory."""
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def parse_snippet(snippet_str):
+    """Splits the snippet string of an answer to its id, score and the
+    formatted code snippet.
+
+    Args:
+        snippet_str: An answer snippet string (Post link, Score, code snippets).
+
+    Returns:
+        The answer id (-1 if missing), the answer score and the code snippet.
+    """
+    info_str = SNIPPET_INFO_RE.findall(snippet_str)
+    if len(info_str) == 0:
+        return -1, 0, snippet_str
+    info = info_str[0].split('\n')
+    score = int(info[1][8:])
+    answer_id = info[0][6:].rstrip('/').rsplit('/', 1)[-1]
+    answer_id = int(answer_id) if answer_id.isdigit() else -1
+    snippet_str = SNIPPET_INFO_RE.sub('', snippet_str).strip()
+    snippet = '\n' + '\n\n'.join(snippet_str.split('<_code_>')) + '\n'
+    return answer_id, score, snippet
+
+
+class StringColumn:
+    """A column of strings stored as one utf-8 blob and an offset array."""
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [s.encode('utf-8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(offsets, data)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.data[start:end].tobytes().decode('utf-8')
+
+
+class MetadataStore:
+    """Columnar, memory-mappable metadata of the index posts.
+
+    Row `i` holds the metadata of the post of row `i` of the search index.
+    The ETags of every post are stored in CSR form (`etag_indptr`, `etag_ids`)
+    as ids into the tag vocabulary `tags`, and the reverse (tag -> posts)
+    lookup is available as a TagIndex (`tag_index`).
+    """
+    def __init__(self, columns):
+        self.post_ids = columns['post_ids']
+        self.scores = columns['scores']
+        self.snippet_counts = columns['snippet_counts']
+        self.answer_ids = columns['answer_ids']
+        self.answer_scores = columns['answer_scores']
+        self.titles = columns['titles']
+        self.snippets = columns['snippets']
+        self.tags = columns['tags']
+        self.etag_indptr = columns['etag_indptr']
+        self.etag_ids = columns['etag_ids']
+        self.tag_index = TagIndex([self.tags[i] for i in range(len(self.tags))],
+                                  columns['tag_indptr'],
+                                  columns['tag_postings'])
+
+    def __len__(self):
+        return len(self.post_ids)
+
+    @classmethod
+    def from_records(cls, metadata):
+        """Builds the store in memory from the list of metadata dictionaries
+        produced by the index builder (PostId, Score, Title, ETags,
+        SnippetCount, Snippets).
+
+        Args:
+            metadata: A list of metadata dictionaries, one per index post.
+
+        Returns:
+            A MetadataStore instance.
+        """
+        def rows():
+            for entry in metadata:
+                answer_id, answer_score, snippet = -1, 0, ''
+                if len(entry['Snippets']) > 0:
+                    # highest scored answer
+                    answer_id, answer_score, snippet = parse_snippet(
+                        entry['Snippets'][0])
+                yield (entry['PostId'], entry['Score'], entry['SnippetCount'],
+                       answer_id, answer_score, entry['Title'], snippet,
+                       entry['ETags'])
+
+        return cls.from_rows(rows())
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Builds the store in memory from an iterable of parsed rows (see
+        `row`).
+
+        Args:
+            rows: An iterable of (post id, score, snippet count, answer id,
+                  answer score, title, snippet, ETags) tuples.
+
+        Returns:
+            A MetadataStore instance.
+        """
+        columns = {name: [] for name in INT_COLUMNS}
+        titles, snippets = [], []
+        tag_ids = {}
+        etag_lengths, etag_ids = [], []
+        # reverse lookup (tag -> posts) built in the same single pass
+        tag_postings = []
+        for row, (post_id, score, snippet_count, answer_id, answer_score,
+                  title, snippet, etags) in enumerate(rows):
+            columns['post_ids'].append(post_id)
+            columns['scores'].append(score)
+            columns['snippet_counts'].append(snippet_count)
+            columns['answer_ids'].append(answer_id)
+            columns['answer_scores'].append(answer_score)
+            titles.append(title)
+            snippets.append(snippet)
+            etag_lengths.append(len(etags))
+            for tag in etags:
+                tag_id = tag_ids.setdefault(tag, len(tag_ids))
+                if tag_id == len(tag_postings):
+                    tag_postings.append([])
+                postings = tag_postings[tag_id]
+                # a tag listed twice by a post is posted once
+                if len(postings) == 0 or postings[-1] != row:
+                    postings.append(row)
+                etag_ids.append(tag_id)
+
+        columns = {
+            name: np.array(values, dtype=INT_COLUMNS[name])
+            for name, values in columns.items()
+        }
+        columns['titles'] = StringColumn.from_strings(titles)
+        columns['snippets'] = StringColumn.from_strings(snippets)
+        columns['tags'] = StringColumn.from_strings(list(tag_ids))
+        columns['etag_indptr'] = np.zeros(len(etag_lengths) + 1,
+                                          dtype=np.int64)
+        columns['etag_indptr'][1:] = np.cumsum(etag_lengths)
+        columns['etag_ids'] = np.array(etag_ids, dtype=np.int32)
+
+        # int32 postings of every tag, rows are appended in ascending order
+        columns['tag_indptr'] = np.zeros(len(tag_ids) + 1, dtype=np.int64)
+        columns['tag_indptr'][1:] = np.cumsum([len(p) for p in tag_postings])
+        columns['tag_postings'] = np.fromiter(
+            (row for postings in tag_postings for row in postings),
+            dtype=np.int32,
+            count=int(columns['tag_indptr'][-1]))
+        return cls(columns)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Opens a metadata store directory.
+
+        Args:
+            path: The metadata store directory.
+            mmap_mode: The numpy memory-map mode (None loads the arrays in memory).
+
+        Returns:
+            A MetadataStore instance.
+        """
+        if not is_metadata_store(path):
+            raise ValueError(manifest_error.format(path))
+        with open(os.path.join(path, MANIFEST), 'r') as f:
+            manifest = json.load(f)
+        if (manifest.get('format') != FORMAT_NAME
+                or manifest.get('version') != FORMAT_VERSION):
+            raise ValueError(
+                format_error.format(manifest.get('format'),
+                                    manifest.get('version')))
+
+        def load(name):
+            return np.load(os.path.join(path, name + '.npy'),
+                           mmap_mode=mmap_mode)
+
+        columns = {name: load(name) for name in manifest['arrays']}
+        for name in STRING_COLUMNS:
+            columns[name] = StringColumn(columns.pop(name + '_offsets'),
+                                         columns.pop(name + '_data'))
+        return cls(columns)
+
+    def save(self, path):
+        """Writes the store to a metadata store directory."""
+        if not os.path.exists(path):
+            os.makedirs(path)
+        arrays = {name: getattr(self, name) for name in INT_COLUMNS}
+        arrays['etag_indptr'] = self.etag_indptr
+        arrays['etag_ids'] = self.etag_ids
+        arrays['tag_indptr'] = self.tag_index.indptr
+        arrays['tag_postings'] = self.tag_index.indices
+        for name in STRING_COLUMNS:
+            arrays[name + '_offsets'] = getattr(self, name).offsets
+            arrays[name + '_data'] = getattr(self, name).data
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), array)
+
+        manifest = {
+            'format': FORMAT_NAME,
+            'version': FORMAT_VERSION,
+            'num_rows': len(self),
+            'num_tags': len(self.tags),
+            'arrays': sorted(arrays)
+        }
+        with open(os.path.join(path, MANIFEST), 'w') as out:
+            json.dump(manifest, out, indent=2)
+
+    def etags(self, idx):
+        """Returns the list of ETags of the post at the given row."""
+        start, end = self.etag_indptr[idx], self.etag_indptr[idx + 1]
+        return [self.tags[t] for t in self.etag_ids[start:end]]
+
+    def row(self, idx):
+        """Returns the parsed row of the post at the given row (see
+        `from_rows`)."""
+        return (int(self.post_ids[idx]), int(self.scores[idx]),
+                int(self.snippet_counts[idx]), int(self.answer_ids[idx]),
+                int(self.answer_scores[idx]), self.titles[idx],
+                self.snippets[idx], self.etags(idx))
+
+
+def convert_pickled_metadata(pickle_path, store_path=None):
+    """Converts the pickled extended metadata (`extended_metadata.pkl`) to a
+    metadata store.
+
+    Args:
+        pickle_path: The path to the pickled extended metadata.
+        store_path: The metadata store directory, defaults to a `metadata`
+                    directory next to the pickle.
+
+    Returns:
+        The metadata store directory.
+    """
+    if store_path is None:
+        store_path = os.path.join(os.path.dirname(pickle_path), 'metadata')
+    with open(pickle_path, 'rb') as _in:
+        metadata = pickle.load(_in)['metadata']
+    MetadataStore.from_records(metadata).save(store_path)
+    return store_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert the pickled extended metadata to a metadata store.')
+    parser.add_argument('metadata_path',
+                        metavar='METADATA',
+                        help='Path to the pickled extended metadata.')
+    parser.add_argument('store_path',
+                        metavar='STORE',
+                        nargs='?',
+                        default=None,
+                        help='Output directory. (default: METADATA dir/metadata)')
+    args = parser.parse_args()
+    print('metadata store saved in',
+          os.path.realpath(
+              convert_pickled_metadata(args.metadata_path, args.store_path)))
@@ -0,0 +1,119 @@
+import os
+import time
+import threading
+
+
+class ArtifactRegistry:
+    """Process-wide registry of loaded search artifacts (vector models,
+    indices, metadata, tokenizer).
+
+    Every artifact is loaded at most once per key, the first time it is
+    requested, and is then shared by every search model of the process (e.g.
+    a HybridSearch and a FastTextSearch share the fastText model and index).
+    Concurrent requests for the same artifact wait for a single load. The load
+    time of every artifact is recorded. Eviction listeners are notified of
+    every eviction (e.g. to reload the models after a compaction).
+    """
+    def __init__(self):
+        self._artifacts = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._loading = {}
+        self._listeners = []
+        self.timings = {}
+
+    def __len__(self):
+        return len(self._artifacts)
+
+    def __contains__(self, key):
+        return key in self._artifacts
+
+    def keys(self):
+        return list(self._artifacts)
+
+    def get(self, key, loader):
+        """Returns the artifact of the given key, loading it with `loader` if
+        it is not registered yet.
+
+        Args:
+            key: A hashable artifact key, e.g. ('index', path, index_keys).
+            loader: A function without arguments that loads the artifact.
+
+        Returns:
+            The (shared) artifact.
+        """
+        with self._lock:
+            if key in self._artifacts:
+                return self._artifacts[key]
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._artifacts:
+                start = time.time()
+                self._loading[key] = start
+                try:
+                    artifact = loader()
+                finally:
+                    del self._loading[key]
+                self.timings[key] = time.time() - start
+                with self._lock:
+                    self._artifacts[key] = artifact
+        return self._artifacts[key]
+
+    def evict(self, path=None):
+        """Drops the registered artifacts loaded from the given path (every
+        artifact if no path is given), so that they are reloaded on their next
+        request. Models holding references keep their copies."""
+        with self._lock:
+            for key in list(self._artifacts):
+                if path is None or artifact_path(key) == _real_path(path):
+                    del self._artifacts[key]
+                    self.timings.pop(key, None)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(path)
+
+    def add_evict_listener(self, listener):
+        """Registers a function called with the evicted path (None for every
+        artifact) after each `evict`."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def status(self):
+        """Returns the kind, path, state ('ready' or 'loading') and load time
+        (seconds, elapsed so far while loading) of every registered or
+        currently loading artifact."""
+        now = time.time()
+        status = [{
+            'kind': key[0],
+            'path': artifact_path(key),
+            'state': 'ready',
+            'seconds': round(self.timings.get(key, 0), 3)
+        } for key in self.keys()]
+        status.extend({
+            'kind': key[0],
+            'path': artifact_path(key),
+            'state': 'loading',
+            'seconds': round(now - start, 3)
+        } for key, start in list(self._loading.items()))
+        return status
+
+
+def _real_path(path):
+    return os.path.realpath(path)
+
+
+def artifact_key(kind, path=None, *extra):
+    """Builds the registry key of an artifact from its kind (e.g. 'index'),
+    the path it is loaded from and any load options."""
+    if path is None:
+        return (kind, )
+    return (kind, _real_path(path)) + tuple(extra)
+
+
+def artifact_path(key):
+    """Returns the path of an artifact key (None for path-less artifacts)."""
+    return key[1] if len(key) > 1 else None
+
+
+# registry shared by every search model of the process
+ARTIFACTS = ArtifactRegistry()
@@ -1,20 +1,36 @@
 import os
-import re
 import json
 import pickle
 import subprocess
 
-import scipy
 import numpy as np
 import pandas as pd
 from tabulate import tabulate
-from sklearn.metrics.pairwise import cosine_similarity
 
-from text_processing.tokenizer import get_custom_tokenizer
+from text_processing.tokenizer import QueryNormalizer, get_custom_tokenizer
+from wordvec_models.field_index import build_field_index, top_k
+from wordvec_models.field_index import finite_results
+from wordvec_models.metadata_store import MetadataStore, is_metadata_store
+from wordvec_models.ann_index import IVFIndex, ann_index_path
+from wordvec_models.index_store import is_index_store, load_index_store
+from wordvec_models.cache import LRUCache, vector_nbytes
+from wordvec_models.registry import ARTIFACTS, artifact_key
+from wordvec_models.segments import index_dir, segment_snapshot
+from wordvec_models.segments import load_segmented_index
+from wordvec_models.segments import load_segmented_metadata
 
 ## StackOverflow Base URL
 base_url = 'https://stackoverflow.com/questions/'
 
+## Result cache
+# maximum number of cached search results & their time to live (seconds)
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_TTL = 3600
+## Query vector cache
+# maximum number of cached inferred query vectors & their memory budget (bytes)
+VECTOR_CACHE_SIZE = 4096
+VECTOR_CACHE_BYTES = 64 * 1024**2
+
 ## Error Strings
 no_metadata_error = 'A metadata file, extended (etags) or otherwise, must be provided'
 cw_sum_error = '"field_weights" array elements must have a sum of 1.'
@@ -22,11 +38,54 @@ cw_num_el_error = '"field_weights" array must be of length {}.'
 cw_type_error = '"field_weights" variable must be of type ndarray.'
 q_type_error = '"query" variable must be of type str.'
 t_error_type = '"tags" variable must be of type list.'
+tl_len_error = '"tags_list" must contain one entry per query ({} given, {} queries).'
 
 ## Presenter Strings
 code_div = '################################# CODE #################################'
 
 
+class SearchResult:
+    """A single search result, i.e. the metadata of a ranked post and its
+    similarity to the query."""
+    __slots__ = ('post_id', 'title', 'snippet_count', 'answer_id',
+                 'answer_score', 'snippet', 'sim')
+
+    def __init__(self, post_id, title, snippet_count, answer_id, answer_score,
+                 snippet, sim):
+        self.post_id = post_id
+        self.title = title
+        self.snippet_count = snippet_count
+        self.answer_id = answer_id
+        self.answer_score = answer_score
+        self.snippet = snippet
+        self.sim = sim
+
+    @property
+    def link(self):
+        return base_url + str(self.post_id)
+
+    @property
+    def sdict(self):
+        return {
+            'anslink': base_url + str(self.answer_id),
+            'snippet': self.snippet,
+            'score': self.answer_score
+        }
+
+    def to_dict(self):
+        """Returns the result as a JSON-serializable dictionary with the
+        metadata dataframe fields (PostId, Title, SnippetCount, sdict, Sim,
+        Link)."""
+        return {
+            'PostId': self.post_id,
+            'Title': self.title,
+            'SnippetCount': self.snippet_count,
+            'sdict': self.sdict,
+            'Sim': self.sim,
+            'Link': self.link
+        }
+
+
 class BaseSearchModel:
     """Base model for searching a precomputed vector index for similar 
     documents.
@@ -34,21 +93,58 @@ class BaseSearchModel:
     Given a user text query the corresponding vector is inferred using the 
     vector space model each subclass utilizes (FastText, TFIDF etc.)
     """
-    def __init__(self, index_path, index_keys, metadata_path, name):
+    def __init__(self,
+                 index_path,
+                 index_keys,
+                 metadata_path,
+                 name,
+                 registry=None):
         self.name = name
-        self.tok = get_custom_tokenizer()
-        self.index = self._read_pickle(index_path)
-        for key in list(self.index.keys()):
-            if key not in index_keys:
-                del self.index[key]
+        self._set_registry(registry)
+        self._load_tokenizer()
+        # the index and the metadata are loaded from the same segments
+        self.snapshot = segment_snapshot(index_dir(index_path))
+        self.index = self._load_index(index_path, index_keys, self.snapshot)
 
         self.num_index_keys = len(self.index)
-        self.index_size = (next(iter(self.index.values()))).shape[0]
+        self.index_size = self.index.shape[0]
         print('Index keys used:', ', '.join(self.index.keys()), end='\n\n')
-        mtdt = self._read_pickle(metadata_path)
-        self.metadata = mtdt['metadata']
-        self.etag_lookup = mtdt['etag_lookup']
-        mtdt = None
+        self.metadata, self.tag_index = self._load_metadata(
+            metadata_path, self.snapshot)
+        self._init_caches()
+
+    def outdated(self):
+        """Whether index segments were added or compacted since the model was
+        loaded, i.e. whether a reloaded model would search different rows (see
+        web_app/model_loader.py)."""
+        return self.snapshot.outdated()
+
+    def _set_registry(self, registry):
+        """Sets the artifact registry the model artifacts are loaded from and
+        shared through, defaults to the process-wide registry (see
+        registry.py)."""
+        self.registry = ARTIFACTS if registry is None else registry
+
+    def _load_tokenizer(self):
+        """Loads the (shared) custom tokenizer and query normalizer."""
+        self.tok = self.registry.get(artifact_key('tokenizer'),
+                                     get_custom_tokenizer)
+        self.normalizer = self.registry.get(
+            artifact_key('normalizer'), lambda: QueryNormalizer(self.tok))
+
+    def _init_caches(self):
+        """Creates the query result cache (see `search`) and the inferred
+        query vector cache (see `_infer_cached`)."""
+        self.result_cache = LRUCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+        self.vector_cache = LRUCache(VECTOR_CACHE_SIZE,
+                                     max_bytes=VECTOR_CACHE_BYTES,
+                                     sizeof=vector_nbytes)
+
+    def invalidate_caches(self):
+        """Drops every cached result, e.g. once the model is replaced by a
+        model rebuilt from new index segments (see web_app/model_loader.py).
+        Query vectors only depend on the vector model and are kept."""
+        self.result_cache.clear()
 
     def _read_pickle(self, filepath):
         """Utility function for loading pickled objects.
@@ -62,6 +158,119 @@ class BaseSearchModel:
         with open(filepath, 'rb') as _in:
             return pickle.load(_in)
 
+    def _load_snapshot(self, path, snapshot):
+        """Returns the given segment snapshot if the store path belongs to its
+        base index directory, or a new snapshot of the store directory (see
+        segments.py)."""
+        if snapshot is not None and snapshot.covers(path):
+            return snapshot
+        return segment_snapshot(index_dir(path))
+
+    def _load_index(self, index_path, index_keys, snapshot=None):
+        """Loads a search index, retains only the given index keys and
+        L2-normalizes every index matrix once, so that cosine similarities can
+        be computed at query time as plain dot products. The normalized matrices
+        are fused into a single `FieldIndex` block (posting lists for sparse
+        matrices, see `SparseFieldIndex`).
+        Index stores (see index_store.py) are already normalized and are
+        memory-mapped instead of being read in memory.
+        Each (index, index keys) pair is loaded once per artifact registry.
+        The index segments found next to the index are searched along with it
+        and compacted index stores replace it (see segments.py).
+
+        Args:
+            index_path: The path to the index store or the pickled search index.
+            index_keys: The index keys (e.g. BodyV, TitleV) to be retained.
+            snapshot: The SegmentSnapshot shared with the other artifacts of
+                      the model (taken at load time if not given).
+
+        Returns:
+            A FieldIndex containing the row-normalized index matrices.
+        """
+        snapshot = self._load_snapshot(index_path, snapshot)
+        index_path = snapshot.store_path(index_path)
+
+        def load():
+            if is_index_store(index_path):
+                index = load_index_store(index_path, index_keys)
+            else:
+                index = self._read_pickle(index_path)
+                for key in list(index.keys()):
+                    if key not in index_keys:
+                        del index[key]
+                index = build_field_index(index)
+            index.ann = self._load_ann_index(ann_index_path(index_path), index)
+            return index
+
+        index = self.registry.get(
+            artifact_key('index', index_path, tuple(index_keys)), load)
+        if snapshot.segments:
+            base_index = index
+            index = self.registry.get(
+                artifact_key('index', index_path, tuple(index_keys),
+                             snapshot.segments),
+                lambda: load_segmented_index(snapshot, index_path, base_index,
+                                             index_keys))
+        return index
+
+    def _load_ann_index(self, ann_path, index):
+        """Loads the optional ANN (IVF) index built next to a dense search
+        index. The ANN index is ignored if missing, or if it was built for
+        different index keys.
+
+        Args:
+            ann_path: The path to the saved IVF index.
+            index: The FieldIndex the ANN index is attached to.
+
+        Returns:
+            An IVFIndex instance or None.
+        """
+        if index.is_sparse or not os.path.exists(ann_path):
+            return None
+        ann = IVFIndex.load(ann_path)
+        try:
+            ann.check_fields(index.fields)
+        except ValueError as e:
+            print('ANN index ignored:', e)
+            return None
+        print('ANN index: {} \u2713'.format(os.path.basename(ann_path)))
+        return ann
+
+    def _load_metadata(self, metadata_path, snapshot=None):
+        """Loads the post metadata and the inverted ETag index. Metadata stores
+        (see metadata_store.py) are memory-mapped, while the pickled extended
+        metadata is converted to an in-memory store once at load time. The
+        metadata is loaded once per artifact registry. The metadata of the
+        index segments is appended to it and a compacted metadata store
+        replaces it (see segments.py).
+
+        Args:
+            metadata_path: The path to the metadata store or the pickled
+                           extended metadata.
+            snapshot: The SegmentSnapshot shared with the other artifacts of
+                      the model (taken at load time if not given).
+
+        Returns:
+            A MetadataStore and its TagIndex instance.
+        """
+        snapshot = self._load_snapshot(metadata_path, snapshot)
+        metadata_path = snapshot.store_path(metadata_path)
+
+        def load():
+            if is_metadata_store(metadata_path):
+                return MetadataStore.load(metadata_path)
+            return MetadataStore.from_records(
+                self._read_pickle(metadata_path)['metadata'])
+
+        metadata = self.registry.get(artifact_key('metadata', metadata_path),
+                                     load)
+        if snapshot.segments:
+            base_metadata = metadata
+            metadata = self.registry.get(
+                artifact_key('metadata', metadata_path, snapshot.segments),
+                lambda: load_segmented_metadata(snapshot, base_metadata))
+        return metadata, metadata.tag_index
+
     def _read_json(self, filepath):
         """Utility function for loading json files.
 
@@ -93,7 +302,10 @@ class BaseSearchModel:
             raise TypeError(cw_type_error)
 
     def _normalize_query(self, query):
-        """Function used to normalize text in a given query
+        """Function used to normalize text in a given query. The query is
+        tokenized twice (punctuation, symbols and numbers are removed in the
+        first pass), computed chunk by chunk from a memoized norm table (see
+        `QueryNormalizer`).
         
         Args:
             query: Unprocessed string representation of the search query
@@ -101,100 +313,39 @@ class BaseSearchModel:
         Returns:
             A normalized and processed string of the given query.
         """
-        # ensure quality
-        doc = self.tok(query.strip())
-        norm_query = ' '.join(t.norm_ for t in doc
-                              if not (t.is_punct or t.is_bracket or t.is_quote
-                                      or t._.is_symbol or t.like_num))
-        doc = self.tok(norm_query)
-        return ' '.join(t.norm_ for t in doc)
-
-    def _index_filter(self, indices, tags):
-        """Given a list of tags, filter the index list by retaining indices
-        of posts that include at least one of the tags. Tags that are no
-        present in the etag lookup table are ignored.
-
-        Args:
-            indices: A list of indices corresponding to posts and their metadata.
-            tags: A list of tags given by the user to filter results.
-
-        Returns:
-            A filtered list of indices containing posts that include the given tags.
-        """
-        tag_index_filter = []
-        for tag in tags:
-            tag_index_filter.extend(self.etag_lookup.get(tag, []))
-        tag_index_filter = frozenset(tag_index_filter)
-
-        return [i for i in indices if i in tag_index_filter]
-
-    def _calc_cossims(self,
-                      vector,
-                      matrix,
-                      batch_calc=False,
-                      batch_size=100000):
-        """Given a query vector, compute the cosine similarities between the given 
-        vector and each row of the provided matrix of document vectors.
-        Cosine similarity is computed as the normalized dot product of two vectors 
-        X and Y as follows: K(X, Y) = <X, Y> / (||X||*||Y||).
-
-        Args:
-            vector: A numpy array containing the query vector.
-            matrix: A numpy matrix containing the index vectors. 
-            batch_calc: Reduces memory usage by calculating similarities in batches.
-            batch_size: The size of each batch used when batch_calc is True.
-
-        Returns:
-            A numpy array containing the values of the computed cosine similarities. 
-        """
-        def batch_cossims(vector, matrix, batch_size):
-            mat_len = len(matrix)
-            if mat_len > batch_size:
-                n_batches = round(mat_len / batch_size)
-                matrix = np.array_split(matrix, n_batches)
-            for batch in matrix:
-                yield cosine_similarity(vector, batch).reshape(-1)
-
-        if batch_calc and not scipy.sparse.issparse(vector):
-            istart = 0
-            cossims = np.zeros(len(matrix), dtype=np.float32)
-            for batch_vec in batch_cossims(vector, matrix, batch_size):
-                cossims[istart:(istart + len(batch_vec))] = batch_vec
-                istart = istart + len(batch_vec)
-            return cossims
-        else:
-            return cosine_similarity(vector, matrix).reshape(-1)
-
-    def ranking(self, query_vec, num_results, field_weights=None, tags=None):
+        return self.normalizer(query)
+
+    def ranking(self,
+                query_vec,
+                num_results,
+                field_weights=None,
+                tags=None,
+                nprobe=None):
         """Given a query vector, calculate the ranking of posts using cossine
         similarities. In case `field_weights` are given, apply weights in the formula.
         e.g. sims = 0.4*BodyMatrixSims + 0.6*TitleMatrixSims.
-        In case `tags` are provided, filter the resulting list to include posts
-        containing these tags.
+        In case `tags` are provided, only the posts containing these tags are
+        scored and ranked.
 
         Args:
             query_vec: A numpy array containing the infered query vector.
             num_results: The final number of results (post indices) returned.
             field_weights: Field weights (Title, Body, Tags) for the calculation of sims.
             tags: A list of tags to filter the final results.
+            nprobe: The number of ANN inverted lists searched. If given (and an ANN
+                    index is available) the ranking is approximate.
 
         Returns:
             An index of PostIds and their similarity calues to the given query.
         """
-        sims = np.zeros([self.index_size], dtype=np.float32)
-        if field_weights:
-            for idx, index_matrix in enumerate(self.index.values()):
-                sims -= (self._calc_cossims(query_vec, index_matrix) *
-                         field_weights[idx])
-        else:
-            for index_matrix in self.index.values():
-                sims -= self._calc_cossims(query_vec, index_matrix)
-            #sims = sims / self.num_index_keys ##Field weights 0.5 each
-        indices = np.argsort(sims)
-        if tags:
-            indices = self._index_filter(indices, tags)
-        indices = indices[:num_results]
-        sim_values = [(-sims[i]) for i in indices]
+        # score only the posts carrying the tags (inverted tag index)
+        rows = self.tag_index.rows(tags) if tags else None
+        # weighted sum of the field similarities in a single BLAS call
+        # (term-at-a-time over posting lists for sparse indices)
+        indices, sims = self.index.top_k(query_vec, num_results,
+                                         field_weights, rows, nprobe)
+        indices, sims = finite_results(indices, sims)
+        sim_values = list(sims)
         return indices, sim_values
 
     def infer_vector(self, text):
@@ -203,60 +354,114 @@ class BaseSearchModel:
         """
         raise NotImplementedError
 
-    def metadata_frame(self, indices, sim_values):
-        """Given a ranked list of indices and their similarity values build
-        a dataframe containing the corresponding metadata (title, code snippets etc.)
-        and retrieve the most frequent tags appearing in the top results.
+    def infer_vectors(self, texts):
+        """Function used to infer the sentence vectors of a batch of texts,
+        stacked one per row.
+        """
+        raise NotImplementedError
+
+    def _infer_cached(self, query):
+        """Returns the inferred vector(s) of a normalized query, memoized in
+        the query vector cache. Cached vectors are shared and must not be
+        modified."""
+        query_vec = self.vector_cache.get(query)
+        if query_vec is None:
+            query_vec = self.infer_vector(query)
+            self.vector_cache.put(query, query_vec)
+        return query_vec
+
+    def batch_ranking(self,
+                      query_vecs,
+                      num_results,
+                      field_weights=None,
+                      tags_list=None):
+        """Batched version of `ranking`: the query vectors are scored against
+        the index as matrix-matrix products (see `FieldIndex.batch_top_k`).
+        The batched ranking is always exact.
+
+        Args:
+            query_vecs: A numpy array or sparse matrix of query vectors (one per row).
+            num_results: The final number of results (post indices) returned per query.
+            field_weights: Field weights (Title, Body, Tags) for the calculation of sims.
+            tags_list: An optional list of tag lists (or None), one per query.
+
+        Returns:
+            A list of (PostId indices, similarity values) tuples, one per query.
+        """
+        rows_list = self._batch_rows(tags_list)
+        results = self.index.batch_top_k(query_vecs, num_results,
+                                         field_weights, rows_list)
+        return [(indices, list(sims)) for indices, sims in (
+            finite_results(indices, sims) for indices, sims in results)]
+
+    def _batch_rows(self, tags_list):
+        """Maps a list of per query tag lists to the index rows carrying
+        these tags (None for queries without tags)."""
+        if tags_list is None:
+            return None
+        return [self.tag_index.rows(tags) if tags else None for tags in tags_list]
+
+    def metadata_results(self, indices, sim_values):
+        """Given a ranked list of indices and their similarity values retrieve
+        the corresponding metadata (title, code snippets etc.) as SearchResult
+        records and the most frequent tags appearing in the top results.
 
         Args:
             indices: A list of PostIds ranked by the ranking algorithm.
             sim_values: A list of cosine similarity values corresponding to the indices.
 
         Returns:
-            A metadata dataframe and a list of the 8 most frequently observed tags.
+            A list of SearchResult records and a list of the 8 most frequently
+            observed tags.
         """
-        def sdict(snippet_list, postid):
-            # highest scored answer
-            snippet_str = snippet_list[0]
-            #print(postid)
-            #print(snippet_str)
-            info_str = re.findall(r'Post: .*\n##Score -?[0-9]{1,5}',
-                                  snippet_str)[0]
-            info = info_str.split('\n')
-            score = int(info[1][8:])
-            answer_link = info[0][6:]
-            snippet_str = re.sub(r'Post: .*\n##Score -?[0-9]{1,5}', '',
-                                 snippet_str).strip()
-            snippet = '\n' + '\n\n'.join(snippet_str.split('<_code_>')) + '\n'
-            d = {'anslink': answer_link, 'snippet': snippet, 'score': score}
-            return d
-
-        postids = [self.metadata[i]['PostId'] for i in indices]
-        df_dict = {
-            'Title': [self.metadata[i]['Title'] for i in indices],
-            'SnippetCount':
-            [self.metadata[i]['SnippetCount'] for i in indices],
-            'sdict': [
-                sdict(self.metadata[i]['Snippets'], postids[jj])
-                for jj, i in enumerate(indices)
-            ],
-            'Sim': [round(s, 4) for s in sim_values],
-            'Link': [(base_url + str(_id)) for _id in postids]
-        }
+        mt = self.metadata
+        results = [
+            SearchResult(int(mt.post_ids[i]), mt.titles[i],
+                         int(mt.snippet_counts[i]), int(mt.answer_ids[i]),
+                         int(mt.answer_scores[i]), mt.snippets[i],
+                         round(float(sim), 4))
+            for i, sim in zip(indices, sim_values)
+        ]
 
         # Calculate tag frequency and sort in descenting order
         # to retrieve the 8 most frequent tags
         tag_freq = {}
         for i in indices:
-            tag_list = self.metadata[i]['ETags']
-            for t in tag_list:
+            for t in mt.etags(i):
                 if t in tag_freq:
                     tag_freq[t] += 1
                 else:
                     tag_freq[t] = 1
         top_tags = sorted(tag_freq, key=tag_freq.get, reverse=True)[:8]
 
-        return pd.DataFrame(data=df_dict, index=postids), top_tags
+        return results, top_tags
+
+    def results_frame(self, results):
+        """Builds the metadata dataframe (indexed by PostId) of a list of
+        SearchResult records."""
+        df_dict = {
+            'Title': [r.title for r in results],
+            'SnippetCount': [r.snippet_count for r in results],
+            'sdict': [r.sdict for r in results],
+            'Sim': [r.sim for r in results],
+            'Link': [r.link for r in results]
+        }
+        return pd.DataFrame(data=df_dict, index=[r.post_id for r in results])
+
+    def metadata_frame(self, indices, sim_values):
+        """Given a ranked list of indices and their similarity values build
+        a dataframe containing the corresponding metadata (title, code snippets etc.)
+        and retrieve the most frequent tags appearing in the top results.
+
+        Args:
+            indices: A list of PostIds ranked by the ranking algorithm.
+            sim_values: A list of cosine similarity values corresponding to the indices.
+
+        Returns:
+            A metadata dataframe and a list of the 8 most frequently observed tags.
+        """
+        results, top_tags = self.metadata_results(indices, sim_values)
+        return self.results_frame(results), top_tags
 
     def presenter(self, df, num_results, top_tags):
         """Given a dataframe containing the results and their metadata present
@@ -304,7 +509,8 @@ class BaseSearchModel:
                    num_results=10,
                    field_weights=None,
                    ranking_fn=None,
-                   postid_fn=None):
+                   postid_fn=None,
+                   nprobe=None):
         """Provides the CLI search function, and an entry point for the search
         model.
 
@@ -316,8 +522,10 @@ class BaseSearchModel:
                         similarities it calculates.
             postid_fn: A function that can be used to manipulate and use the PostIds of
                        the results.
+            nprobe: The number of ANN inverted lists searched (approximate search),
+                    None for exact search.
         """
-        if field_weights:
+        if field_weights is not None:
             self._check_custom_weights(field_weights)
 
         while (True):
@@ -335,24 +543,39 @@ class BaseSearchModel:
                 if len(tags) == 0:
                     tags = None
 
-            query_vec = self.infer_vector(query)
+            query_vec = self._infer_cached(query)
             indices, sim_values = ranking_fn(**query_vec,
                                              num_results=num_results,
                                              field_weights=field_weights,
-                                             tags=tags)
+                                             tags=tags,
+                                             nprobe=nprobe)
             meta_df, top_tags = self.metadata_frame(indices, sim_values)
             self.presenter(meta_df, len(meta_df.index), top_tags)
 
             if postid_fn:
                 postid_fn(list(meta_df.index))
 
+    def _result_cache_key(self, query, tags, num_results, field_weights,
+                          ranking_fn, nprobe):
+        """Builds the result cache key of a search from the segment snapshot
+        version of the model, the normalized query, the sorted tags and the
+        ranking parameters."""
+        return (self.snapshot.version, query,
+                tuple(sorted(set(tags))) if tags else None,
+                num_results,
+                None if field_weights is None else tuple(
+                    float(w) for w in field_weights),
+                getattr(ranking_fn, '__name__', None), nprobe)
+
     def search(self,
                query,
                tags=None,
                num_results=10,
                field_weights=None,
                ranking_fn=None,
-               postid_fn=None):
+               postid_fn=None,
+               nprobe=None,
+               as_frame=True):
         """Provides a JSON-response search function, and an entry point for the search
         model.
 
@@ -366,8 +589,20 @@ class BaseSearchModel:
                         similarities it calculates.
             postid_fn: A function that can be used to manipulate and use the PostIds of
                        the results.
+            nprobe: The number of ANN inverted lists searched (approximate search),
+                    None for exact search.
+            as_frame: If False, the results are returned as a list of SearchResult
+                      records instead of a metadata dataframe.
+
+        Results are cached per index snapshot, normalized query, tags, field weights
+        and number of results (see `RESULT_CACHE_SIZE`, `RESULT_CACHE_TTL`), cached
+        records are shared and must not be modified.
+
+        Returns:
+            A metadata dataframe (or list of SearchResult records) and a list of the
+            8 most frequently observed tags.
         """
-        if field_weights:
+        if field_weights is not None:
             self._check_custom_weights(field_weights)
 
         if not isinstance(query, str):
@@ -380,14 +615,81 @@ class BaseSearchModel:
                 tags = None
 
         query = self._normalize_query(query)
-        query_vec = self.infer_vector(query)
-        indices, sim_values = ranking_fn(**query_vec,
-                                         num_results=num_results,
-                                         field_weights=field_weights,
-                                         tags=tags)
-        meta_df, top_tags = self.metadata_frame(indices, sim_values)
+        cache_key = self._result_cache_key(query, tags, num_results,
+                                           field_weights, ranking_fn, nprobe)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            results, top_tags = cached
+        else:
+            query_vec = self._infer_cached(query)
+            indices, sim_values = ranking_fn(**query_vec,
+                                             num_results=num_results,
+                                             field_weights=field_weights,
+                                             tags=tags,
+                                             nprobe=nprobe)
+            results, top_tags = self.metadata_results(indices, sim_values)
+            self.result_cache.put(cache_key, (results, top_tags))
 
         if postid_fn:
-            postid_fn(list(meta_df.index))
+            postid_fn([r.post_id for r in results])
+
+        if as_frame:
+            return self.results_frame(results), top_tags
+        return results, top_tags
+
+    def search_batch(self,
+                     queries,
+                     tags_list=None,
+                     num_results=10,
+                     field_weights=None,
+                     ranking_fn=None,
+                     as_frame=True):
+        """Batched version of `search`. The query vectors of every query are
+        inferred at once and scored against the index as matrix-matrix products
+        instead of one full index scan per query.
+
+        Args:
+            queries: A list of string representations of the search queries.
+            tags_list: An optional list of tag lists (or None), one per query.
+            num_results: An integer used to limit the results of every query.
+            field_weights: A list of floats used in the similarity calculation formula
+                           as weights for the index fields (Title, Body, Tags).
+            ranking_fn: The batched function that is used to rank the indices based
+                        on the similarities it calculates.
+            as_frame: If False, the results are returned as lists of SearchResult
+                      records instead of metadata dataframes.
+
+        Returns:
+            A list of (metadata dataframe or SearchResult list, top tags) tuples,
+            one per query.
+        """
+        if field_weights is not None:
+            self._check_custom_weights(field_weights)
+
+        if any(not isinstance(query, str) for query in queries):
+            raise TypeError(q_type_error)
+
+        if tags_list is not None:
+            if len(tags_list) != len(queries):
+                raise ValueError(
+                    tl_len_error.format(len(tags_list), len(queries)))
+            if any(tags and not isinstance(tags, list) for tags in tags_list):
+                raise TypeError(t_error_type)
 
-        return meta_df, top_tags
\ No newline at end of file
+        if len(queries) == 0:
+            return []
+        queries = [self._normalize_query(query) for query in queries]
+        query_vecs = self.infer_vectors(queries)
+        results = ranking_fn(**query_vecs,
+                             num_results=num_results,
+                             field_weights=field_weights,
+                             tags_list=tags_list)
+        if as_frame:
+            return [
+                self.metadata_frame(indices, sim_values)
+                for indices, sim_values in results
+            ]
+        return [
+            self.metadata_results(indices, sim_values)
+            for indices, sim_values in results
+        ]
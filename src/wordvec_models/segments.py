@@ -0,0 +1,693 @@
+#!/usr/bin/env python
+"""Incremental index segments.
+
+New or edited questions are added to the search indices and the metadata
+without a full rebuild, as segments written next to the base stores:
+
+    wordvec_models/index/
+        metadata/                           (base metadata store)
+        ft_v0.6.1_post_index/               (base index stores)
+        tfidf_v0.3_post_index/
+        segments/
+            seg_1602946800000/
+                manifest.json
+                metadata/                   (metadata of the segment rows)
+                ft_v0.6.1_post_index/       (index rows of the segment)
+                tfidf_v0.3_post_index/
+        compacted.json                      (current compacted base)
+        compacted/
+            base_1602950400000/
+                metadata/                   (compacted base stores)
+                ft_v0.6.1_post_index/
+                tfidf_v0.3_post_index/
+
+The rows of a segment follow the rows of the base and of every older
+segment. A post found again in a newer segment (an edited question) is
+superseded, i.e. its older rows are never ranked. `compact_segments` merges
+the segments into a new compacted base, e.g. in a background thread (see
+`compact_in_background`):
+
+    python -m wordvec_models.segments wordvec_models/index
+
+Every store of the compacted base is switched in at once, by replacing the
+compaction pointer (compacted.json) that also lists the segments merged into
+it. The search models read the base stores and the live segments from a
+single `SegmentSnapshot` per load.
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import threading
+
+import numpy as np
+from scipy import sparse
+
+from wordvec_models.field_index import QUERY_BATCH_SIZE, top_k, top_k_batch
+from wordvec_models.field_index import finite_results
+from wordvec_models.metadata_store import MetadataStore, is_metadata_store
+from wordvec_models.index_store import is_index_store, read_manifest
+from wordvec_models.index_store import load_index_store, save_index_store
+from wordvec_models.ann_index import IVFIndex, ann_index_path
+from wordvec_models.registry import ARTIFACTS
+
+FORMAT_NAME = 'stacksearch-segment'
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+SEGMENTS_DIR = 'segments'
+METADATA_DIR = 'metadata'
+SEGMENT_PREFIX = 'seg_'
+POINTER_FORMAT_NAME = 'stacksearch-compaction'
+POINTER_FORMAT_VERSION = 1
+POINTER = 'compacted.json'
+COMPACTED_DIR = 'compacted'
+BASE_PREFIX = 'base_'
+PICKLED_INDEX_SUFFIX = '_post_index.pkl'
+
+## Error Strings
+segment_index_error = 'Segment "{}" has no index store "{}".'
+segment_rows_error = 'Segment "{}" holds {} index rows, {} expected.'
+base_metadata_error = 'Index segments require a base metadata store in "{}".'
+pointer_format_error = 'Unknown compaction pointer format in "{}".'
+pickled_base_error = ('Pickled search indices cannot be compacted: {}. Convert '
+                      'them to index stores first (python -m '
+                      'wordvec_models.index_store).')
+
+
+def segments_path(base_dir):
+    """Returns the segments directory of a base index directory."""
+    return os.path.join(base_dir, SEGMENTS_DIR)
+
+
+def index_dir(path):
+    """Returns the base index directory of a store (index or metadata)."""
+    return os.path.dirname(os.path.normpath(path))
+
+
+def store_name(path):
+    """Returns the name of a store inside a base or segment directory, e.g.
+    ft_v0.6.1_post_index for .../ft_v0.6.1_post_index(.pkl)."""
+    name = os.path.basename(os.path.normpath(path))
+    # only the pickle extension, store names hold versions (e.g. v0.6.1)
+    return name[:-4] if name.endswith('.pkl') else name
+
+
+def read_segment_manifest(path):
+    """Reads the manifest of a segment (None if the segment is incomplete,
+    being removed or of an unknown format)."""
+    manifest_path = os.path.join(path, MANIFEST)
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if (manifest.get('format') != FORMAT_NAME
+            or manifest.get('version') != FORMAT_VERSION):
+        return None
+    return manifest
+
+
+def list_segments(base_dir):
+    """Returns the names of the complete segments of a base index directory,
+    oldest first."""
+    path = segments_path(base_dir)
+    if not os.path.isdir(path):
+        return []
+    return sorted(
+        name for name in os.listdir(path) if name.startswith(SEGMENT_PREFIX)
+        and read_segment_manifest(os.path.join(path, name)) is not None)
+
+
+def _new_stamped_path(directory, prefix):
+    """Creates a new directory named after the current time (ms)."""
+    stamp = int(time.time() * 1000)
+    while True:
+        path = os.path.join(directory, '{}{:013d}'.format(prefix, stamp))
+        try:
+            os.makedirs(path)
+            return path
+        except FileExistsError:
+            stamp += 1
+
+
+def new_segment_path(base_dir):
+    """Creates the directory of a new (empty) segment. The segment is ignored
+    until its manifest is written (see `write_segment_manifest`)."""
+    return _new_stamped_path(segments_path(base_dir), SEGMENT_PREFIX)
+
+
+def write_segment_manifest(path, num_rows, indices):
+    """Completes a segment, written after its metadata and index stores.
+
+    Args:
+        path: The segment directory.
+        num_rows: The number of rows of the segment.
+        indices: The names of the index stores of the segment.
+    """
+    manifest = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'num_rows': int(num_rows),
+        'indices': sorted(indices)
+    }
+    with open(os.path.join(path, MANIFEST), 'w') as out:
+        json.dump(manifest, out, indent=2)
+
+
+def read_pointer(base_dir):
+    """Reads the compaction pointer of a base index directory (None if its
+    segments were never compacted)."""
+    path = os.path.join(base_dir, POINTER)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as f:
+        pointer = json.load(f)
+    if (pointer.get('format') != POINTER_FORMAT_NAME
+            or pointer.get('version') != POINTER_FORMAT_VERSION):
+        raise ValueError(pointer_format_error.format(path))
+    return pointer
+
+
+def write_pointer(base_dir, base, previous, merged):
+    """Atomically switches a base index directory to a compacted base.
+
+    Args:
+        base_dir: The base index directory.
+        base: The name of the compacted base (in compacted/).
+        previous: The name of the replaced base (None for the stores of the
+                  base index directory itself).
+        merged: The names of the segments included in the compacted base.
+    """
+    pointer = {
+        'format': POINTER_FORMAT_NAME,
+        'version': POINTER_FORMAT_VERSION,
+        'base': base,
+        'previous': previous,
+        'merged': sorted(merged)
+    }
+    tmp_path = os.path.join(base_dir, POINTER + '.tmp')
+    with open(tmp_path, 'w') as out:
+        json.dump(pointer, out, indent=2)
+    os.replace(tmp_path, os.path.join(base_dir, POINTER))
+
+
+def discard_compaction(base_dir):
+    """Drops the compacted bases of a base index directory, e.g. once its
+    base stores are rebuilt. The segments are kept."""
+    path = os.path.join(base_dir, POINTER)
+    if os.path.exists(path):
+        os.remove(path)
+    shutil.rmtree(os.path.join(base_dir, COMPACTED_DIR), ignore_errors=True)
+
+
+class SegmentSnapshot:
+    """The base stores and the live segments of a base index directory at a
+    single point in time.
+
+    Attributes:
+        directory: The base index directory (e.g. wordvec_models/index).
+        base: The name of the current compacted base (None if the base stores
+              are the ones of the base index directory).
+        segments: The names of the live segments, oldest first.
+        pointer: The compaction pointer read (or None).
+    """
+    def __init__(self, directory, base=None, segments=(), pointer=None):
+        self.directory = directory
+        self.base = base
+        self.segments = tuple(segments)
+        self.pointer = pointer
+
+    @property
+    def base_path(self):
+        """The directory of the current base stores."""
+        if self.base is None:
+            return self.directory
+        return os.path.join(self.directory, COMPACTED_DIR, self.base)
+
+    def covers(self, path):
+        """Whether a store path belongs to the base index directory."""
+        return os.path.realpath(index_dir(path)) == os.path.realpath(
+            self.directory)
+
+    def store_path(self, path):
+        """Returns the path of the current version of a base store, given its
+        path in the base index directory (e.g. .../ft_v0.6.1_post_index)."""
+        if self.base is None:
+            return path
+        return os.path.join(self.base_path, store_name(path))
+
+    def segment_path(self, name):
+        return os.path.join(segments_path(self.directory), name)
+
+    @property
+    def version(self):
+        """The compacted base and the live segments, the content of the
+        snapshot."""
+        return (self.base, self.segments)
+
+    def outdated(self):
+        """Whether segments were added or compacted since the snapshot was
+        taken."""
+        return segment_snapshot(self.directory).version != self.version
+
+
+def segment_snapshot(base_dir):
+    """Takes a snapshot of the base stores and of the live segments of a base
+    index directory (see `SegmentSnapshot`)."""
+    # segments first: the segments merged by a compaction switched in after
+    # the listing are listed by the pointer read
+    names = list_segments(base_dir)
+    pointer = read_pointer(base_dir)
+    if pointer is None:
+        return SegmentSnapshot(base_dir, segments=names)
+    merged = set(pointer['merged'])
+    return SegmentSnapshot(base_dir, pointer['base'],
+                           [name for name in names if name not in merged],
+                           pointer)
+
+
+def superseded_rows(post_ids):
+    """Given the post ids of the base rows followed by the rows of every
+    segment, returns the sorted rows superseded by a later row of the same
+    post."""
+    post_ids = np.asarray(post_ids)
+    _, last = np.unique(post_ids[::-1], return_index=True)
+    superseded = np.ones(len(post_ids), dtype=bool)
+    superseded[len(post_ids) - 1 - last] = False
+    return np.flatnonzero(superseded)
+
+
+def load_metadata_parts(snapshot):
+    """Opens the base metadata store and the metadata of the segments of a
+    snapshot."""
+    base_path = os.path.join(snapshot.base_path, METADATA_DIR)
+    if not is_metadata_store(base_path):
+        raise ValueError(base_metadata_error.format(snapshot.base_path))
+    return [MetadataStore.load(base_path)] + [
+        MetadataStore.load(
+            os.path.join(snapshot.segment_path(name), METADATA_DIR))
+        for name in snapshot.segments
+    ]
+
+
+def load_index_parts(snapshot, name, index_keys):
+    """Opens the index stores of the segments of a snapshot that belong to
+    the base index store of the given name."""
+    parts = []
+    for segment in snapshot.segments:
+        segment_path = snapshot.segment_path(segment)
+        path = os.path.join(segment_path, name)
+        if not is_index_store(path):
+            raise ValueError(segment_index_error.format(segment, name))
+        part = load_index_store(path, index_keys)
+        num_rows = read_segment_manifest(segment_path)['num_rows']
+        if part.shape[0] != num_rows:
+            raise ValueError(
+                segment_rows_error.format(segment, part.shape[0], num_rows))
+        parts.append(part)
+    return parts
+
+
+class SegmentedIndex:
+    """A base FieldIndex followed by the FieldIndex of every segment.
+
+    Row `i` of the segmented index is row `i - starts[p]` of part `p`.
+    Superseded rows score -inf and are never returned by `top_k`. Every part
+    is searched on its own (MaxScore pruning, ANN index of the base) and the
+    per part top k are merged.
+    """
+    def __init__(self, parts, superseded):
+        self.parts = parts
+        base = parts[0]
+        self.fields = base.fields
+        self.dims = base.dims
+        self.offsets = base.offsets
+        self.is_sparse = base.is_sparse
+        self.starts = np.cumsum([0] + [p.shape[0] for p in parts])
+        self.shape = (int(self.starts[-1]), len(self.fields))
+        self.superseded = np.asarray(superseded, dtype=np.int64)
+        self.part_superseded = [
+            self.superseded[(self.superseded >= start)
+                            & (self.superseded < end)] - start
+            for start, end in zip(self.starts[:-1], self.starts[1:])
+        ]
+
+    @property
+    def ann(self):
+        return self.parts[0].ann
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def keys(self):
+        return list(self.fields)
+
+    def query_vector(self, query_vec, field_weights=None):
+        return self.parts[0].query_vector(query_vec, field_weights)
+
+    def scores(self, query_vec, field_weights=None, rows=None):
+        """Computes the weighted similarities of every part (see
+        `FieldIndex.scores`), superseded rows score -inf."""
+        if rows is None:
+            sims = np.concatenate(
+                [p.scores(query_vec, field_weights) for p in self.parts])
+            sims[self.superseded] = -np.inf
+            return sims
+        rows = np.asarray(rows)
+        sims = np.zeros(len(rows), dtype=np.float32)
+        part_ids = np.searchsorted(self.starts, rows, side='right') - 1
+        for ii, part in enumerate(self.parts):
+            selected = np.flatnonzero(part_ids == ii)
+            if len(selected) > 0:
+                sims[selected] = part.scores(
+                    query_vec, field_weights,
+                    rows[selected] - self.starts[ii])
+        sims[np.isin(rows, self.superseded)] = -np.inf
+        return sims
+
+    def batch_scores(self, query_vecs, field_weights=None):
+        """Computes the (queries x N) weighted similarities of every part (see
+        `FieldIndex.batch_scores`), superseded rows score -inf."""
+        sims = np.hstack(
+            [p.batch_scores(query_vecs, field_weights) for p in self.parts])
+        sims[:, self.superseded] = -np.inf
+        return sims
+
+    def batch_top_k(self, query_vecs, k, field_weights=None, rows_list=None):
+        """Batched version of `top_k` (see `FieldIndex.batch_top_k`)."""
+        results = []
+        for start in range(0, query_vecs.shape[0], QUERY_BATCH_SIZE):
+            end = start + QUERY_BATCH_SIZE
+            sims = self.batch_scores(query_vecs[start:end], field_weights)
+            for indices, values in top_k_batch(
+                    sims, k,
+                    None if rows_list is None else rows_list[start:end]):
+                results.append(finite_results(indices, values))
+        return results
+
+    def top_k(self,
+              query_vec,
+              k,
+              field_weights=None,
+              rows=None,
+              nprobe=None):
+        """Retrieves the `k` most similar live rows to the given query vector
+        (see `FieldIndex.top_k`), the top k of every part are merged."""
+        indices, sims = [], []
+        for ii, part in enumerate(self.parts):
+            start, end = self.starts[ii], self.starts[ii + 1]
+            part_rows = None
+            if rows is not None:
+                part_rows = np.asarray(rows)
+                part_rows = part_rows[(part_rows >= start)
+                                      & (part_rows < end)] - start
+                if len(part_rows) == 0:
+                    continue
+            superseded = self.part_superseded[ii]
+            part_indices, part_sims = part.top_k(query_vec,
+                                                 k + len(superseded),
+                                                 field_weights, part_rows,
+                                                 nprobe)
+            live = ~np.isin(part_indices, superseded)
+            indices.append(np.asarray(part_indices)[live] + start)
+            sims.append(np.asarray(part_sims, dtype=np.float32)[live])
+        if len(indices) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        indices, sims = np.concatenate(indices), np.concatenate(sims)
+        order = top_k(sims, k)
+        return finite_results(indices[order], sims[order])
+
+
+def load_segmented_index(snapshot, index_path, index, index_keys):
+    """Attaches the segments of a snapshot to a loaded base index.
+
+    Args:
+        snapshot: The SegmentSnapshot the base index was loaded from.
+        index_path: The path to the base index store.
+        index: The loaded base FieldIndex.
+        index_keys: The index keys (e.g. BodyV, TitleV) to be retained.
+
+    Returns:
+        A SegmentedIndex instance.
+    """
+    post_ids = np.concatenate(
+        [p.post_ids for p in load_metadata_parts(snapshot)])
+    parts = [index] + load_index_parts(snapshot, store_name(index_path),
+                                       index_keys)
+    if sum(p.shape[0] for p in parts) != len(post_ids):
+        raise ValueError(
+            segment_rows_error.format(store_name(index_path),
+                                      sum(p.shape[0] for p in parts),
+                                      len(post_ids)))
+    print('Index segments: {} \u2713'.format(len(snapshot.segments)))
+    return SegmentedIndex(parts, superseded_rows(post_ids))
+
+
+class SegmentedColumn:
+    """A metadata column spanning the base store and every segment."""
+    def __init__(self, columns, starts):
+        self.columns = columns
+        self.starts = starts
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def __getitem__(self, idx):
+        part = np.searchsorted(self.starts, idx, side='right') - 1
+        return self.columns[part][idx - self.starts[part]]
+
+
+class SegmentedTagIndex:
+    """The inverted ETag index spanning the base store and every segment (see
+    `TagIndex`)."""
+    def __init__(self, tag_indices, starts):
+        self.tag_indices = tag_indices
+        self.starts = starts
+        self.tags = list(
+            dict.fromkeys(t for ti in tag_indices for t in ti.tags))
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __contains__(self, tag):
+        return any(tag in ti for ti in self.tag_indices)
+
+    def postings(self, tag):
+        return np.concatenate([
+            ti.postings(tag).astype(np.int64) + start
+            for ti, start in zip(self.tag_indices, self.starts)
+        ])
+
+    def rows(self, tags):
+        return np.concatenate([
+            ti.rows(tags) + start
+            for ti, start in zip(self.tag_indices, self.starts)
+        ])
+
+
+class SegmentedMetadata:
+    """The base metadata store followed by the metadata of every segment,
+    row `i` matching row `i` of a SegmentedIndex."""
+    def __init__(self, stores):
+        self.stores = stores
+        self.starts = np.cumsum([0] + [len(s) for s in stores])
+        for name in ('post_ids', 'scores', 'snippet_counts', 'answer_ids',
+                     'answer_scores', 'titles', 'snippets'):
+            setattr(self, name,
+                    SegmentedColumn([getattr(s, name) for s in stores],
+                                    self.starts))
+        self.tag_index = SegmentedTagIndex([s.tag_index for s in stores],
+                                           self.starts)
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def _locate(self, idx):
+        part = np.searchsorted(self.starts, idx, side='right') - 1
+        return self.stores[part], idx - self.starts[part]
+
+    def etags(self, idx):
+        store, idx = self._locate(idx)
+        return store.etags(idx)
+
+    def row(self, idx):
+        store, idx = self._locate(idx)
+        return store.row(idx)
+
+
+def load_segmented_metadata(snapshot, metadata):
+    """Appends the metadata of the segments of a snapshot to a loaded base
+    metadata store."""
+    stores = [metadata] + [
+        MetadataStore.load(
+            os.path.join(snapshot.segment_path(name), METADATA_DIR))
+        for name in snapshot.segments
+    ]
+    return SegmentedMetadata(stores)
+
+
+def _index_store_names(base_dir):
+    """Returns the names of the index stores of a base index directory."""
+    names = []
+    for name in sorted(os.listdir(base_dir)):
+        try:
+            read_manifest(os.path.join(base_dir, name))
+        except ValueError:
+            continue
+        names.append(name)
+    return names
+
+
+def _pickled_indices(base_dir):
+    """Returns the pickled search indices (`*_post_index.pkl`) of a base index
+    directory that were not converted to index stores."""
+    return [
+        name for name in sorted(os.listdir(base_dir))
+        if name.endswith(PICKLED_INDEX_SUFFIX)
+        and not is_index_store(os.path.join(base_dir, store_name(name)))
+    ]
+
+
+def _remove_base(base_dir, base):
+    """Removes the stores of a replaced base (see `SegmentSnapshot.base`). The
+    original base is the one of the base index directory itself (None)."""
+    if base is not None:
+        shutil.rmtree(os.path.join(base_dir, COMPACTED_DIR, base),
+                      ignore_errors=True)
+        return
+    for name in _index_store_names(base_dir):
+        path = os.path.join(base_dir, name)
+        shutil.rmtree(path)
+        if os.path.exists(ann_index_path(path)):
+            os.remove(ann_index_path(path))
+    shutil.rmtree(os.path.join(base_dir, METADATA_DIR), ignore_errors=True)
+
+
+def compact_segments(base_dir, registry=None):
+    """Merges the segments of a base index directory and its base metadata
+    and index stores into a new compacted base, dropping the superseded rows.
+    The ANN indices of the merged stores are rebuilt. The new base is switched
+    in at once (see `write_pointer`), segments added while compacting are
+    kept. The replaced base and its segments are left for the models still
+    loading them and are removed by the next compaction, i.e. the second
+    compaction deletes the original base stores and metadata store of the
+    base index directory. Pickled search indices would not be switched along
+    with the other stores, so a base holding any is not compacted. A single
+    compaction may run at a time.
+
+    Args:
+        base_dir: The base index directory (e.g. wordvec_models/index).
+        registry: The artifact registry the stale stores are evicted from
+                  (defaults to the process-wide registry).
+
+    Returns:
+        The names of the merged segments.
+
+    Raises:
+        ValueError: If the base holds pickled search indices.
+    """
+    registry = ARTIFACTS if registry is None else registry
+    snapshot = segment_snapshot(base_dir)
+    names = list(snapshot.segments)
+    if len(names) == 0:
+        print('No index segments to compact.')
+        return names
+    pickled = _pickled_indices(snapshot.base_path)
+    if pickled:
+        raise ValueError(pickled_base_error.format(', '.join(pickled)))
+    print('Compacting {} index segments...'.format(len(names)))
+
+    stores = load_metadata_parts(snapshot)
+    post_ids = np.concatenate([s.post_ids for s in stores])
+    live = np.ones(len(post_ids), dtype=bool)
+    live[superseded_rows(post_ids)] = False
+    post_ids = None
+
+    compacted_path = _new_stamped_path(os.path.join(base_dir, COMPACTED_DIR),
+                                       BASE_PREFIX)
+    # index stores first, the superseded rows are read from the metadata
+    store_paths = []
+    for name in _index_store_names(snapshot.base_path):
+        path = os.path.join(snapshot.base_path, name)
+        keys = [f['key'] for f in read_manifest(path)['fields']]
+        parts = [load_index_store(path, keys)] + load_index_parts(
+            snapshot, name, keys)
+        if parts[0].is_sparse:
+            matrix = sparse.vstack([p.matrix for p in parts],
+                                   format='csr')[live].tocsc()
+            matrix.sort_indices()
+        else:
+            matrix = np.vstack([p.matrix for p in parts])[live]
+        index = type(parts[0]).from_fused(parts[0].fields, parts[0].dims,
+                                          matrix)
+        parts = None
+        new_path = os.path.join(compacted_path, name)
+        save_index_store(index, new_path)
+        if os.path.exists(ann_index_path(path)):
+            IVFIndex.build(index).save(ann_index_path(new_path))
+        store_paths.append(path)
+        print('index store compacted:', os.path.realpath(new_path))
+
+    def live_rows():
+        for part, store in enumerate(stores):
+            start, end = starts[part], starts[part + 1]
+            for idx in np.flatnonzero(live[start:end]):
+                yield store.row(idx)
+
+    starts = np.cumsum([0] + [len(s) for s in stores])
+    metadata = MetadataStore.from_rows(live_rows())
+    stores = None
+    metadata_path = os.path.join(compacted_path, METADATA_DIR)
+    metadata.save(metadata_path)
+    store_paths.append(os.path.join(snapshot.base_path, METADATA_DIR))
+    print('metadata store compacted:', os.path.realpath(metadata_path))
+
+    # segments merged by the previous compaction are removed below
+    pointer = snapshot.pointer
+    merged = [] if pointer is None else [
+        name for name in pointer['merged']
+        if os.path.isdir(snapshot.segment_path(name))
+    ]
+    write_pointer(base_dir, os.path.basename(compacted_path), snapshot.base,
+                  merged + names)
+    for path in store_paths:
+        registry.evict(path)
+
+    if pointer is not None:
+        _remove_base(base_dir, pointer['previous'])
+        for name in merged:
+            shutil.rmtree(snapshot.segment_path(name), ignore_errors=True)
+    return names
+
+
+def compact_in_background(base_dir, registry=None):
+    """Runs `compact_segments` in a daemon thread.
+
+    Returns:
+        The started threading.Thread.
+    """
+    thread = threading.Thread(target=compact_segments,
+                              args=(base_dir, registry),
+                              name='segment-compaction',
+                              daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Merge the index segments into the base index.')
+    parser.add_argument('base_dir',
+                        metavar='INDEX_DIR',
+                        help='The base index directory (e.g. '
+                        'wordvec_models/index).')
+    args = parser.parse_args()
+    compact_segments(args.base_dir)
@@ -0,0 +1,82 @@
+import numpy as np
+
+
+class TagIndex:
+    """Compact inverted ETag index stored in CSR form.
+
+    The postings (metadata entry indices) of every tag are stored contiguously
+    and sorted in a single int32 array, `indices[indptr[i]:indptr[i + 1]]`
+    holding the postings of tag `tags[i]`.
+    """
+    def __init__(self, tags, indptr, indices):
+        self.tags = list(tags)
+        self.tag_ids = {tag: ii for ii, tag in enumerate(self.tags)}
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __contains__(self, tag):
+        return tag in self.tag_ids
+
+    @classmethod
+    def from_lookup(cls, etag_lookup):
+        """Builds the index from a reverse ETag lookup dictionary.
+
+        Args:
+            etag_lookup: A dictionary of tag: list of metadata entry indices.
+
+        Returns:
+            A TagIndex instance.
+        """
+        tags = sorted(etag_lookup)
+        # a post listing a tag twice is posted once
+        postings = [np.unique(etag_lookup[tag]) for tag in tags]
+        indptr = np.zeros(len(tags) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(p) for p in postings])
+        indices = np.zeros(indptr[-1], dtype=np.int32)
+        for ii, tag_postings in enumerate(postings):
+            indices[indptr[ii]:indptr[ii + 1]] = tag_postings
+        return cls(tags, indptr, indices)
+
+    @classmethod
+    def load(cls, filepath):
+        """Loads a tag index saved with `TagIndex.save`."""
+        with np.load(filepath) as arrays:
+            return cls(arrays['tags'].tolist(), arrays['indptr'],
+                       arrays['indices'])
+
+    def save(self, filepath):
+        """Saves the tag index arrays in a single .npz file."""
+        np.savez(filepath,
+                 tags=np.array(self.tags, dtype=str),
+                 indptr=self.indptr,
+                 indices=self.indices)
+
+    def postings(self, tag):
+        """Returns the sorted metadata entry indices of the given tag (empty
+        if the tag is unknown)."""
+        idx = self.tag_ids.get(tag)
+        if idx is None:
+            return self.indices[:0]
+        return self.indices[self.indptr[idx]:self.indptr[idx + 1]]
+
+    def rows(self, tags):
+        """Given a list of tags, retrieve the indices of posts that include at
+        least one of the tags. Tags that are not present in the index are
+        ignored.
+
+        Args:
+            tags: A list of tags given by the user to filter results.
+
+        Returns:
+            A sorted numpy array of the indices of posts that include the given tags.
+        """
+        postings = [self.postings(tag) for tag in set(tags)]
+        postings = [p for p in postings if len(p) > 0]
+        if len(postings) == 0:
+            return np.zeros(0, dtype=np.int64)
+        # unique rows, stores built before the postings were deduplicated may
+        # post a row twice
+        return np.unique(np.concatenate(postings)).astype(np.int64)
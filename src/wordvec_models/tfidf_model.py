@@ -1,44 +1,91 @@
 import os
 import pickle
+import tempfile
+from multiprocessing import Pool
 
 import numpy as np
 from scipy import sparse
 from sklearn.feature_extraction.text import TfidfVectorizer
 
 from wordvec_models.search_model import BaseSearchModel
+from wordvec_models.registry import artifact_key
+from wordvec_models.utils import bounded_imap, iter_chunks
 
 # every token consists of two or more non whitespace characters
 TOKEN_RE = r'\S\S+'
+# number of lines per doc vector building chunk
+CHUNK_SIZE = 10000
+# number of chunks in flight per worker process
+PENDING_CHUNKS = 2
+
+# tf-idf model of a doc vector building worker process
+_worker_model = None
 
 
 class TfIdfSearch(BaseSearchModel):
-    def __init__(self, model_path, index_path, index_keys, metadata_path):
-        self.model = self._read_pickle(model_path)
+    def __init__(self,
+                 model_path,
+                 index_path,
+                 index_keys,
+                 metadata_path,
+                 registry=None):
+        self._set_registry(registry)
+        self.model = self.registry.get(artifact_key('tfidf', model_path),
+                                       lambda: self._read_pickle(model_path))
         print('tf-idf model: {} \u2713'.format(
             os.path.basename(model_path)))
-        super().__init__(index_path, index_keys, metadata_path, 'tf-idf')
+        super().__init__(index_path, index_keys, metadata_path, 'tf-idf',
+                         registry)
 
     def infer_vector(self, text):
         return {'query_vec': self.model.transform([text.lower().strip()])}
 
-    def cli_search(self, num_results=10, field_weights=None, postid_fn=None):
+    def infer_vectors(self, texts):
+        return {
+            'query_vecs':
+            self.model.transform([text.lower().strip() for text in texts])
+        }
+
+    def cli_search(self,
+                   num_results=10,
+                   field_weights=None,
+                   postid_fn=None,
+                   nprobe=None):
         super().cli_search(num_results=num_results,
                            field_weights=field_weights,
                            ranking_fn=self.ranking,
-                           postid_fn=postid_fn)
+                           postid_fn=postid_fn,
+                           nprobe=nprobe)
 
     def search(self,
                query,
                tags=None,
                num_results=10,
                field_weights=None,
-               postid_fn=None):
+               postid_fn=None,
+               nprobe=None,
+               as_frame=True):
         return super().search(query=query,
                               tags=tags,
                               num_results=num_results,
                               field_weights=field_weights,
                               ranking_fn=self.ranking,
-                              postid_fn=postid_fn)
+                              postid_fn=postid_fn,
+                              nprobe=nprobe,
+                              as_frame=as_frame)
+
+    def search_batch(self,
+                     queries,
+                     tags_list=None,
+                     num_results=10,
+                     field_weights=None,
+                     as_frame=True):
+        return super().search_batch(queries=queries,
+                                    tags_list=tags_list,
+                                    num_results=num_results,
+                                    field_weights=field_weights,
+                                    ranking_fn=self.batch_ranking,
+                                    as_frame=as_frame)
 
 
 def load_text_list(filename):
@@ -68,25 +115,110 @@ def train_tfidf_model(post_list, model_export_path, vec_export_path):
     return tfidf
 
 
-def build_doc_vectors(model, doc, export_path=None):
-    """Calculates sentence vectors using the provided pre-trained tf-idf model
-    """
-    vec_matrix = None
+def _worker_init(model):
+    """Process pool initializer, loads the tf-idf model once per worker."""
+    global _worker_model
     if isinstance(model, str):
         model = load_tfidf_model(model)
+    _worker_model = model
+
+
+def _worker_transform(lines):
+    return _worker_model.transform(lines)
+
+
+def stack_pieces(pieces):
+    """Stacks CSR matrices vertically. The data and indices of every piece are
+    appended to temporary files as soon as the piece is produced, and are read
+    back once at the end, instead of keeping every piece in memory along with
+    their stacked copy.
+
+    Args:
+        pieces: An iterable of CSR matrices with the same number of columns.
+
+    Returns:
+        The stacked CSR matrix (None if there are no pieces).
+    """
+    indptrs = [np.zeros(1, dtype=np.int64)]
+    num_lines, num_cols, nnz, dtype = 0, None, 0, None
+    with tempfile.TemporaryDirectory() as parts_dir:
+        data_path = os.path.join(parts_dir, 'data')
+        indices_path = os.path.join(parts_dir, 'indices')
+        with open(data_path, 'wb') as data_out, \
+                open(indices_path, 'wb') as indices_out:
+            for piece in pieces:
+                if dtype is None:
+                    num_cols, dtype = piece.shape[1], piece.dtype
+                piece.data.astype(dtype, copy=False).tofile(data_out)
+                piece.indices.astype(np.int32, copy=False).tofile(indices_out)
+                indptrs.append(piece.indptr[1:] + np.int64(nnz))
+                nnz += piece.nnz
+                num_lines += piece.shape[0]
+                print('\rtransformed {} lines'.format(num_lines), end='')
+        print()
+        if dtype is None:
+            return None
+        data = np.fromfile(data_path, dtype=dtype)
+        indices = np.fromfile(indices_path, dtype=np.int32)
+    return sparse.csr_matrix((data, indices, np.concatenate(indptrs)),
+                             shape=(num_lines, num_cols))
+
+
+def build_doc_vectors(model,
+                      doc,
+                      export_path=None,
+                      chunk_size=CHUNK_SIZE,
+                      num_workers=1):
+    """Calculates sentence vectors using the provided pre-trained tf-idf model
+
+    The document is streamed in chunks of `chunk_size` lines. Every chunk is
+    transformed on its own (by a process pool when `num_workers` > 1, with at
+    most PENDING_CHUNKS chunks in flight per worker). The CSR pieces are
+    spooled to temporary files and read back once into the output arrays, so
+    only the output matrix and the chunks in flight reside in memory.
+
+    Args:
+        model: A tf-idf model or the path to one.
+        doc: The path to a document (one text per line) or a list of texts.
+        export_path: The .npz file the vectors are saved in (optional).
+        chunk_size: The number of lines per chunk.
+        num_workers: The number of worker processes.
+
+    Returns:
+        The (num_lines x vocabulary size) CSR doc vector matrix.
+    """
     if isinstance(doc, str):
-        if os.path.exists(doc):
-            doc = load_text_list(doc)
-            vec_matrix = model.transform(doc)
-        else:
+        if not os.path.exists(doc):
             raise ValueError(
                 'Provided document path {} doesn\'t exist.'.format(doc))
-    elif isinstance(doc, list):
-        vec_matrix = model.transform(doc)
-    else:
+    elif not isinstance(doc, list):
         raise ValueError('Invalid "doc" variable type {}.'.format(
             str(type(doc))))
+    if isinstance(model, str) and num_workers == 1:
+        model = load_tfidf_model(model)
+
+    def transform(lines):
+        chunks = iter_chunks((line.strip() for line in lines), chunk_size)
+        if num_workers > 1:
+            with Pool(num_workers,
+                      initializer=_worker_init,
+                      initargs=(model, )) as pool:
+                return stack_pieces(
+                    bounded_imap(pool, _worker_transform, chunks,
+                                 num_workers * PENDING_CHUNKS))
+        return stack_pieces(model.transform(chunk) for chunk in chunks)
+
+    if isinstance(doc, str):
+        with open(doc, 'r') as doc_file:
+            vec_matrix = transform(doc_file)
+    else:
+        vec_matrix = transform(doc)
+    if vec_matrix is None:
+        if isinstance(model, str):
+            model = load_tfidf_model(model)
+        vec_matrix = sparse.csr_matrix((0, len(model.vocabulary_)),
+                                       dtype=np.float64)
     if export_path:
         sparse.save_npz(export_path, vec_matrix)
-        print('\ntfidf doc vectors saved in', os.path.realpath(export_path))
+        print('tfidf doc vectors saved in', os.path.realpath(export_path))
     return vec_matrix
@@ -1,6 +1,8 @@
 import os
 import sys
 import sqlite3
+from itertools import islice
+from collections import deque
 
 file_path = os.path.dirname(os.path.abspath(__file__))
 
@@ -32,4 +34,37 @@ def print_linked_posts(post_ids):
     src_ids, tgt_ids = get_linked_posts(post_ids)
     for idx, sid in enumerate(src_ids):
         print(sid, 'linked with', tgt_ids[idx])
-    print()
\ No newline at end of file
+    print()
+
+
+def iter_chunks(lines, chunk_size):
+    """Yields lists of (at most) `chunk_size` consecutive lines."""
+    lines = iter(lines)
+    chunk = list(islice(lines, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(lines, chunk_size))
+
+
+def bounded_imap(pool, func, items, max_pending):
+    """Ordered `pool.imap` that submits at most `max_pending` items ahead of
+    the consumer. `pool.imap` feeds the workers from a thread that reads the
+    whole (lazy) input at once, and keeps every result until it is consumed.
+
+    Args:
+        pool: A multiprocessing Pool.
+        func: The function applied to every item.
+        items: An iterable of items, read lazily.
+        max_pending: The maximum number of submitted items whose results are
+                     not consumed yet.
+
+    Yields:
+        The results of `func`, in the order of the items.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item, )))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()